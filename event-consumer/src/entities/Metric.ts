@@ -7,6 +7,8 @@ import {
 } from "typeorm";
 
 @Entity("metrics")
+// Per-service window reads (WHERE service = ? AND timestamp >= ? ORDER BY timestamp DESC)
+@Index(["service", "timestamp"])
 export class Metric {
   @PrimaryGeneratedColumn("uuid")
   id!: string;
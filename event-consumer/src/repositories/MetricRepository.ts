@@ -11,6 +11,7 @@ export class MetricRepository {
 
   async save(metricData: any): Promise<Metric> {
     const metric = this.repository.create({
+      id: metricData.id || undefined,        // Gateway-assigned, so stream alerts can be joined back
       service: metricData.service,
       traceId: metricData.traceId || null,  // ✅ Save traceId
       method: metricData.method || null,     // ✅ Save method
@@ -1,4 +1,5 @@
 import { Request, Response, NextFunction } from "express";
+import { randomUUID } from "crypto";
 import logger from "../utils/logger";
 import { RequestWithTracking } from "./requestLogger";
 
@@ -210,8 +211,11 @@ export function createEventPublishingMiddleware() {
         // 2. Service Metrics Event
         const metricsEvent = {
           eventType: "metric.service",
+          id: randomUUID(), // Row id in metrics; stream-scored alerts reference it
           timestamp: new Date().toISOString(),
           service: service,
+          method: req.method,
+          path: req.path,
           metrics: {
             response_time_ms: duration,
             status_code: res.statusCode,
@@ -1,4 +1,5 @@
 import { Router } from "express";
+import { randomUUID } from "crypto";
 import { createProxyMiddleware, Options } from "http-proxy-middleware";
 import { ServiceConfig } from "../types/service.types";
 import { circuitBreakerRegistry } from "../utils/circuitBreaker";
@@ -101,6 +102,7 @@ export function createServiceProxy(service: ServiceConfig): Router {
           // 2. Service Metrics Event ✅ NOW WITH TRACEID
           const metricsEvent = {
             eventType: "metric.service",
+            id: randomUUID(),       // Row id in metrics; stream-scored alerts reference it
             timestamp: new Date().toISOString(),
             traceId: req.traceId,  // ✅ Added traceId
             service: serviceName,
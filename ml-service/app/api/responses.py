@@ -0,0 +1,14 @@
+from typing import Any
+from starlette.responses import JSONResponse
+from app.utils.serialization import dumps
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with the shared encoder.
+    Returning it (or a Response with pre-encoded bytes) from an endpoint skips
+    FastAPI's response_model validation and jsonable_encoder pass, so it is
+    meant for payloads built from internal records.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,15 +1,32 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from app.schemas.response import HealthResponse, AnomalyDetectionResponse, TrainingResponse
-from app.services.ml_service import ml_service
+from app.services.ml_service import ml_service, DETECTION_WINDOW_MINUTES
 from app.services.database import db
 from app.services.rabbitmq import rabbitmq_publisher
+from app.services.stream_consumer import stream_consumer
+from app.services.sharding import shard_ring
+from app.services.leader import leader_election
+from app.services.model_storage import model_storage
+from app.services.scheduler import scheduler
+from app.services.service_catalog import service_catalog
+from app.services.index_advisor import index_advisor
+from app.services.correlation import correlation_engine
+from app.utils.single_flight import SingleFlight
+from app.utils.serialization import dumps
+from app.utils.startup import startup_timer
+from app.config.settings import settings
 from datetime import datetime
+from typing import Optional
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Dashboards polling /detect and /status at once share one computation per key
+api_cache = SingleFlight(ttl_seconds=settings.API_CACHE_TTL_SECONDS)
+
 @router.get("/", tags=["Root"])
 async def root():
     return {
@@ -20,7 +37,10 @@ async def root():
             "health": "/health",
             "train": "/train",
             "detect": "/detect",
-            "status": "/status"
+            "status": "/status",
+            "models": "/models/{service}/versions",
+            "incidents": "/incidents",
+            "diagnostics": "/diagnostics/queries"
         }
     }
 
@@ -32,7 +52,7 @@ async def health():
         "status": "healthy" if rabbitmq_status == "connected" else "degraded",
         "service": "ml-anomaly-detection",
         "version": "2.0.0",
-        "database": "connected" if db.connection else "disconnected",
+        "database": "connected" if db.pool else "disconnected",
         "rabbitmq": rabbitmq_status,
         "is_model_trained": len(trained_services) > 0,
         "last_training": ml_service.detector.last_training.get(trained_services[0]) if trained_services else None
@@ -40,34 +60,107 @@ async def health():
 
 @router.post("/train", response_model=TrainingResponse, tags=["ML"])
 async def train_models():
+    if not leader_election.is_leader:
+        raise HTTPException(status_code=409, detail="Training runs on the leader worker; retry the request")
     try:
+        # A manual run should include services that appeared since the last catalog refresh
+        service_catalog.invalidate()
         result = ml_service.train_all_services()
+        api_cache.invalidate()
         return result
     except Exception as e:
         logger.error(f"Training failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _detect(service: Optional[str]) -> bytes:
+    # Read-only: alerts are published by the scheduler and stream consumer
+    anomalies = ml_service.detect_anomalies(service, publish=False)
+    # Encoded once and cached as bytes; the records come from the detectors,
+    # so they skip response_model validation (the model still documents the shape)
+    return dumps({
+        "success": True,
+        "service": service or "all",
+        "anomalies_detected": len(anomalies),
+        "timestamp": datetime.now().isoformat(),
+        "details": [anomaly.to_dict() for anomaly in anomalies]
+    })
+
 @router.get("/detect", response_model=AnomalyDetectionResponse, tags=["ML"])
 async def detect_anomalies(service: str = None):
+    if service and not shard_ring.owns(service):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Service {service} is owned by replica {shard_ring.owner_of(service)}"
+        )
     try:
-        anomalies = ml_service.detect_anomalies(service)
-        return {
-            "success": True,
-            "service": service or "all",
-            "anomalies_detected": len(anomalies),
-            "timestamp": datetime.now().isoformat(),
-            "details": anomalies
-        }
+        body = await api_cache.run(("detect", service, DETECTION_WINDOW_MINUTES), _detect, service)
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         logger.error(f"Detection failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _status() -> bytes:
+    status = ml_service.get_service_status()
+    status["rabbitmq_connected"] = rabbitmq_publisher.is_connected()
+    status["worker"] = {"pid": os.getpid(), "leader": leader_election.is_leader}
+    if leader_election.is_leader:
+        status["scheduler"] = scheduler.get_stats()
+    if settings.STREAM_DETECTION_ENABLED:
+        status["stream"] = stream_consumer.get_stats()
+    status["api_cache"] = api_cache.get_stats()
+    status["startup"] = startup_timer.report()
+    return dumps(status)
+
 @router.get("/status", tags=["ML"])
 async def get_status():
     try:
-        status = ml_service.get_service_status()
-        status["rabbitmq_connected"] = rabbitmq_publisher.is_connected()
-        return status
+        body = await api_cache.run(("status",), _status)
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         logger.error(f"Failed to get status: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/models/{service}/versions", tags=["ML"])
+async def list_model_versions(service: str):
+    model_storage.refresh()
+    versions = model_storage.list_versions(service)
+    if not versions:
+        raise HTTPException(status_code=404, detail=f"No saved models for {service}")
+    return {"service": service, "versions": versions}
+
+@router.post("/models/{service}/rollback", tags=["ML"])
+async def rollback_model(service: str, version: str = None):
+    # Followers follow the leader's saved models; the leader never reloads from theirs
+    if not leader_election.is_leader:
+        raise HTTPException(status_code=409, detail="Rollback runs on the leader worker; retry the request")
+    model_storage.refresh()
+    activated = ml_service.rollback_model(service, version)
+    api_cache.invalidate()
+    if not activated:
+        raise HTTPException(status_code=404, detail=f"No version to roll back to for {service}")
+    return {"success": True, "service": service, "active_version": activated}
+
+@router.get("/incidents", tags=["ML"])
+async def list_incidents():
+    if not correlation_engine.enabled:
+        raise HTTPException(status_code=404, detail="Cross-service correlation is disabled")
+    # Incidents are merged where alerts are published (the leader worker); others serve its last save
+    if not leader_election.is_leader:
+        correlation_engine.load()
+    return {
+        "worker": {"pid": os.getpid(), "leader": leader_election.is_leader},
+        **correlation_engine.incidents(),
+        "correlated_pairs": correlation_engine.top_pairs()
+    }
+
+@router.get("/diagnostics/queries", tags=["Diagnostics"])
+def query_diagnostics(service: str = None, trace_id: str = None, analyze: bool = False):
+    """Per-statement timings, index check and EXPLAIN plans of the hot metric reads"""
+    service = service or next(iter(service_catalog.services()), None)
+    return {
+        "prepared_statements": db.prepare_enabled,
+        "query_stats": db.get_query_stats(),
+        "indexes": index_advisor.check(),
+        "service": service,
+        "plans": index_advisor.explain(service, trace_id, DETECTION_WINDOW_MINUTES, analyze) if service else {}
+    }
@@ -1,69 +1,216 @@
+from __future__ import annotations
+
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-from typing import Dict, List, Tuple, Any, Optional
+from typing import Dict, List, Tuple, Any, Optional, Callable, TYPE_CHECKING
 import logging
+import time
 from datetime import datetime
 from app.services.model_storage import model_storage
+from app.models.endpoint_registry import EndpointModelRegistry, endpoint_key
+from app.models.feature_pipeline import FeaturePipeline, RAW_FEATURES, DERIVED_FEATURES
+from app.models.shadow import ShadowEvaluation
+from app.models.compiled_forest import CompiledForest, ArrayScaler
+from app.models.records import AnomalyRecord
+from app.config.settings import settings
+
+# pandas and scikit-learn are imported on first use, keeping them out of startup
+if TYPE_CHECKING:
+    import pandas as pd
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import StandardScaler
 
 logger = logging.getLogger(__name__)
 
 class AnomalyDetector:
-    def __init__(self, contamination: float = 0.02):
+    def __init__(self, contamination: float = 0.02, clock: Callable[[], datetime] = datetime.now,
+                 load_sklearn: bool = True):
         self.contamination = contamination
-        self.models: Dict[str, IsolationForest] = {}
-        self.scalers: Dict[str, StandardScaler] = {}
-        self.feature_columns = [
-            'response_time_ms',
-            'status_code',
-            'error_count',
-            'response_size_bytes'
-        ]
+        # Simulated during replays
+        self.clock = clock
+        # Saved models are unpickled only where this is on (the leader); other
+        # workers score with the memory-mapped compiled forests
+        self.load_sklearn = load_sklearn
+        # None for services served from the compiled forest alone
+        self.models: Dict[str, Optional[IsolationForest]] = {}
+        self.scalers: Dict[str, Any] = {}
+        self.endpoint_models: Dict[str, EndpointModelRegistry] = {}
+        # Forests flattened into node arrays for the low-latency scoring path
+        self.forests: Dict[str, CompiledForest] = {}
+        # (most abnormal, most normal) training decision values; scores are placed on this range
+        self.score_scales: Dict[str, Tuple[float, float]] = {}
+        # Retrained models scored in shadow until promoted or rejected
+        self.challengers: Dict[str, ShadowEvaluation] = {}
+        # Live rolling-window state per service, shared by polling and stream scoring
+        self.pipelines: Dict[str, FeaturePipeline] = {}
+        self.feature_columns = FeaturePipeline.feature_names()
+        self.pipeline_config = self._new_pipeline().config()
         self.last_training = {}
         self.model_versions = {}
         logger.info(f"Initialized AnomalyDetector with contamination={contamination}")
     
-    def load_saved_models(self):
+    def load_saved_models(self, service_filter: Optional[Callable[[str], bool]] = None):
         """Load all previously saved models at startup"""
         logger.info("Loading saved models from disk...")
         services = model_storage.list_services()
+        if service_filter:
+            services = [service for service in services if service_filter(service)]
         
         if not services:
             logger.info("No saved models found")
             return
         
         for service in services:
-            result = model_storage.load_model(service)
-            if result:
-                model, scaler, meta = result
-                self.models[service] = model
-                self.scalers[service] = scaler
-                self.last_training[service] = meta['timestamp']
-                self.model_versions[service] = meta['version']
-                logger.info(f"✅ Loaded saved model for {service}: {meta['version']}")
-    
-    def prepare_features(self, metrics: List[Dict[str, Any]]) -> pd.DataFrame:
-        """Convert raw metrics to feature DataFrame"""
+            if self._load_from_storage(service):
+                logger.info(f"✅ Loaded saved model for {service}: {self.model_versions[service]}")
+    
+    def _new_pipeline(self, cache_size: Optional[int] = None) -> FeaturePipeline:
+        return FeaturePipeline(
+            window_seconds=settings.FEATURE_WINDOW_SECONDS,
+            slots=settings.FEATURE_WINDOW_SLOTS,
+            cache_size=settings.FEATURE_CACHE_SIZE if cache_size is None else cache_size
+        )
+    
+    def _pipeline(self, service: str) -> FeaturePipeline:
+        pipeline = self.pipelines.get(service)
+        if pipeline is None:
+            # setdefault: threads racing on a new service end up sharing one pipeline
+            pipeline = self.pipelines.setdefault(service, self._new_pipeline())
+        return pipeline
+    
+    def _load_from_storage(self, service: str) -> bool:
+        """
+        Install the latest saved model for a service
+
+        Without `load_sklearn` the worker maps the compiled forest arrays and
+        takes the scaler from the metadata, so every worker shares one copy of
+        the model through the page cache. Versions saved without a compiled
+        forest still load the sklearn pickles.
+        """
+        meta = model_storage.get_model_info(service)
+        if not meta:
+            logger.warning(f"No saved model found for {service}")
+            return False
+        if meta.get('features') != self.feature_columns or meta.get('feature_pipeline') != self.pipeline_config:
+            logger.info(f"Saved model for {service} uses another feature set, waiting for retraining")
+            return False
+        if not meta.get('score_scale'):
+            logger.info(f"Saved model for {service} has no score scale, waiting for retraining")
+            return False
+        arrays = model_storage.load_forest(meta)
+        forest = CompiledForest.from_arrays(*arrays) if arrays else None
+        if self.load_sklearn or forest is None or not meta.get('scaling'):
+            result = model_storage.load_model(service, meta['version'])
+            if not result:
+                return False
+            model, scaler, _ = result
+            if forest is None and settings.FAST_SCORING_ENABLED:
+                forest = self._compile(service, model)
+        else:
+            model, scaler = None, ArrayScaler.from_dict(meta['scaling'])
+        self.models[service] = model
+        self.scalers[service] = scaler
+        endpoints = model_storage.load_endpoints(meta)
+        if endpoints:
+            self.endpoint_models[service] = EndpointModelRegistry.from_arrays(endpoints)
+        else:
+            self.endpoint_models.pop(service, None)
+        if forest is not None:
+            self.forests[service] = forest
+        else:
+            self.forests.pop(service, None)
+        self.score_scales[service] = tuple(meta['score_scale'])
+        self.last_training[service] = meta['timestamp']
+        self.model_versions[service] = meta['version']
+        return True
+    
+    def reload_model(self, service: str) -> bool:
+        """Install whichever version is now active for a service (after a rollback)"""
+        return self._load_from_storage(service)
+    
+    def sync_saved_models(self, service_filter: Optional[Callable[[str], bool]] = None) -> List[str]:
+        """Reload models whose saved version differs from the one in memory"""
+        if not model_storage.refresh():
+            return []
+        updated = []
+        for service in model_storage.list_services():
+            if service_filter and not service_filter(service):
+                continue
+            info = model_storage.get_model_info(service)
+            if info['version'] == self.model_versions.get(service):
+                continue
+            if self._load_from_storage(service):
+                updated.append(service)
+        if updated:
+            logger.info(f"🔄 Reloaded models saved by the leader: {updated}")
+        return updated
+    
+    def prepare_features(self, metrics: List[Dict[str, Any]],
+                         pipeline: Optional[FeaturePipeline] = None,
+                         keys: Optional[List[str]] = None, update: bool = True) -> pd.DataFrame:
+        """
+        Convert raw metrics to feature DataFrame
+        
+        Rows from the feature store already carry their window features; other
+        rows are run through `pipeline` (a fresh one if not given), folding
+        them into its window state unless `update` is off.
+        """
+        import pandas as pd
         df = pd.DataFrame(metrics)
         df['response_size_bytes'] = df['response_size_bytes'].fillna(0)
+        if not set(DERIVED_FEATURES).issubset(df.columns):
+            pipeline = pipeline or self._new_pipeline(cache_size=0)
+            df[DERIVED_FEATURES] = pipeline.transform(metrics, keys or self._endpoint_keys(metrics), update)
         features = df[self.feature_columns].copy()
         return features
     
-    def train(self, service: str, metrics: List[Dict[str, Any]], save_model: bool = True) -> bool:
+    def _endpoint_keys(self, metrics) -> List[str]:
+        """Registry key per row ('GET /orders/:id')"""
+        if isinstance(metrics, np.ndarray):
+            return [key.decode() for key in metrics['endpoint']]
+        return [endpoint_key(metric.get('method'), metric.get('path')) for metric in metrics]
+    
+    def _scaler_from_baseline(self, baseline: Dict[str, Any], features: pd.DataFrame) -> StandardScaler:
+        """
+        Fit a scaler on the training sample, then take the raw columns' mean/std
+        from rollup moments so they reflect the whole window
+        """
+        from sklearn.preprocessing import StandardScaler
+        scaler = StandardScaler().fit(features)
+        for idx, feature in enumerate(self.feature_columns):
+            if feature not in RAW_FEATURES:
+                continue
+            std = float(baseline['std'][feature])
+            scaler.mean_[idx] = baseline['mean'][feature]
+            scaler.var_[idx] = std ** 2
+            scaler.scale_[idx] = std if std > 0 else 1.0
+        return scaler
+    
+    def train(self, service: str, metrics: List[Dict[str, Any]], save_model: bool = True,
+              baseline: Optional[Dict[str, Any]] = None) -> bool:
         """
         Train Isolation Forest model for a specific service
+        
+        Args:
+            baseline: Optional window stats from rollups; when given, feature
+                scaling uses the whole window instead of the sampled rows
         """
         if len(metrics) < 10:
             logger.warning(f"Not enough samples for {service}: {len(metrics)}")
             return False
         
+        from sklearn.ensemble import IsolationForest
+        from sklearn.preprocessing import StandardScaler
+        
         try:
             features = self.prepare_features(metrics)
             
             # Initialize scaler
-            scaler = StandardScaler()
-            scaled_features = scaler.fit_transform(features)
+            if baseline and baseline['count'] >= len(metrics):
+                scaler = self._scaler_from_baseline(baseline, features)
+                scaled_features = scaler.transform(features)
+            else:
+                scaler = StandardScaler()
+                scaled_features = scaler.fit_transform(features)
             
             # Train Isolation Forest
             model = IsolationForest(
@@ -74,66 +221,220 @@ class AnomalyDetector:
                 n_jobs=-1
             )
             model.fit(scaled_features)
+            score_scale = self._score_scale(model.decision_function(scaled_features))
+            
+            # Lightweight per-endpoint models on the raw columns, checked next to the forest
+            registry = None
+            if settings.ENDPOINT_MODELS_ENABLED:
+                registry = EndpointModelRegistry.fit(
+                    np.array(self._endpoint_keys(metrics)),
+                    features[RAW_FEATURES].to_numpy(dtype=float),
+                    contamination=self.contamination,
+                    min_samples=settings.ENDPOINT_MIN_SAMPLES,
+                    max_keys=settings.ENDPOINT_MAX_KEYS
+                )
+            
+            if registry is not None and not len(registry):
+                registry = None
             
-            # Store in memory
-            self.models[service] = model
-            self.scalers[service] = scaler
-            self.last_training[service] = datetime.now().isoformat()
+            # Always compiled: it is what the other workers score with
+            forest = self._compile(service, model, scaled_features)
+            
+            # A service that already has a live model gets the new one as a challenger
+            shadowing = settings.SHADOW_ENABLED and service in self.models
             
             # Persist to disk
+            version = None
             if save_model:
                 version = model_storage.save_model(
                     service, model, scaler, 
-                    len(metrics), self.feature_columns
+                    len(metrics), self.feature_columns,
+                    feature_pipeline=self.pipeline_config,
+                    endpoints=registry.to_arrays() if registry is not None else None,
+                    forest=forest,
+                    scaling=ArrayScaler.from_scaler(scaler).to_dict(),
+                    score_scale=score_scale,
+                    activate=not shadowing
                 )
-                self.model_versions[service] = version
             
-            logger.info(f"✅ Trained model for {service} with {len(metrics)} samples")
+            if shadowing:
+                self.challengers[service] = ShadowEvaluation(service, version, model, scaler, registry, forest,
+                                                             score_scale=score_scale, clock=self.clock)
+                logger.info(f"🧪 Trained challenger for {service} with {len(metrics)} samples, scoring in shadow")
+            else:
+                self._install(service, model, scaler, registry, version, forest, score_scale)
+                logger.info(
+                    f"✅ Trained model for {service} with {len(metrics)} samples"
+                    f" ({len(registry) if registry is not None else 0} endpoint models)"
+                )
             return True
             
         except Exception as e:
             logger.error(f"Failed to train model for {service}: {e}")
             return False
     
-    def predict(self, service: str, metrics: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Detect anomalies in metrics"""
+    def _compile(self, service: str, model, check: Optional[np.ndarray] = None) -> Optional[CompiledForest]:
+        """Flatten a forest for fast scoring; falls back to sklearn if it does not reproduce its scores"""
+        try:
+            forest = CompiledForest.from_sklearn(model)
+            if check is not None:
+                deviation = CompiledForest.max_deviation(model, forest, check[:256])
+                if deviation > 1e-9:
+                    logger.warning(f"Compiled forest for {service} deviates by {deviation:.2e}, using sklearn scoring")
+                    return None
+            return forest
+        except Exception as e:
+            logger.warning(f"Could not compile forest for {service}, using sklearn scoring: {e}")
+            return None
+    
+    @staticmethod
+    def _score_scale(raw: np.ndarray) -> Tuple[float, float]:
+        """
+        Fixed range for anomaly scores: the 0.1% and 99.9% quantiles of the
+        training set's decision values (most abnormal, most normal)
+        """
+        low, high = np.quantile(raw, [0.001, 0.999])
+        return float(low), float(high)
+    
+    def _install(self, service: str, model, scaler, registry: Optional[EndpointModelRegistry],
+                 version: Optional[str], forest: Optional[CompiledForest] = None,
+                 score_scale: Tuple[float, float] = (0.0, 0.0)):
+        """Make a model the live one for a service"""
+        self.models[service] = model
+        self.scalers[service] = scaler
+        self.score_scales[service] = score_scale
+        if registry is not None:
+            self.endpoint_models[service] = registry
+        else:
+            self.endpoint_models.pop(service, None)
+        if forest is not None:
+            self.forests[service] = forest
+        else:
+            self.forests.pop(service, None)
+        self.last_training[service] = self.clock().isoformat()
+        if version:
+            self.model_versions[service] = version
+    
+    def is_evaluating(self, service: str) -> bool:
+        """True while a challenger is still in shadow; settles expired evaluations first"""
+        challenger = self.challengers.get(service)
+        if challenger and challenger.expired:
+            self._settle(service, challenger)
+        return service in self.challengers
+    
+    def _settle(self, service: str, challenger: ShadowEvaluation):
+        """Promote or reject a challenger once its evaluation has a verdict"""
+        verdict = challenger.verdict()
+        if verdict is None:
+            return
+        self.challengers.pop(service, None)
+        stats = challenger.get_stats()
+        if verdict == "promote":
+            if challenger.version:
+                model_storage.activate(service, challenger.version)
+            self._install(service, challenger.model, challenger.scaler, challenger.registry,
+                          challenger.version, challenger.forest, challenger.score_scale)
+            logger.info(f"🏆 Promoted challenger for {service}: {stats}")
+        else:
+            if challenger.version:
+                model_storage.reject(service, challenger.version)
+            logger.warning(f"Rejected challenger for {service}, keeping {self.model_versions.get(service)}: {stats}")
+    
+    def _score(self, model, scaler, registry: Optional[EndpointModelRegistry],
+               features: pd.DataFrame, keys: List[str],
+               forest: Optional[CompiledForest] = None,
+               score_scale: Tuple[float, float] = (0.0, 0.0)) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Score rows with one model set (forest + endpoint registry)
+        Returns:
+            (is_anomaly, anomaly_score, margin, detection_method) per row; the
+            margin is the distance past the model's own decision boundary.
+            Forest scores map decision values onto the model's training range
+            (`score_scale`), so a row scores the same whatever batch it comes in.
+        """
+        n = len(features)
+        methods = np.full(n, 'isolation_forest', dtype=object)
+        
+        # Every row goes through the service-level forest, which also sees the window features
+        if forest is not None and (model is None or (settings.FAST_SCORING_ENABLED
+                                                    and n <= settings.FAST_SCORING_MAX_BATCH)):
+            # Plain NumPy scaling and the compiled forest, no sklearn validation or dispatch: the
+            # only path on workers without the sklearn model, the fast one for small batches
+            scaled_features = (features.to_numpy(dtype=float) - scaler.mean_) / scaler.scale_
+            raw = forest.decision_function(scaled_features)
+        else:
+            scaled_features = scaler.transform(features)
+            # IsolationForest.predict is decision_function < 0, so one pass gives both
+            raw = model.decision_function(scaled_features)
+        flags = raw < 0
+        low, high = score_scale
+        scores = np.clip((high - raw) / max(high - low, 1e-10), 0.0, 1.0)
+        margins = -raw
+        
+        # Rows whose endpoint has its own model are also checked against it; when
+        # it flags a row the forest missed (or scores it higher), it reports the row
+        rows = registry.lookup(keys) if registry else np.full(n, -1)
+        routed = np.flatnonzero(rows >= 0)
+        if len(routed):
+            is_anomaly, routed_scores = registry.score(rows[routed], features[RAW_FEATURES].to_numpy(dtype=float)[routed])
+            wins = is_anomaly & (~flags[routed] | (routed_scores > scores[routed]))
+            target = routed[wins]
+            scores[target] = routed_scores[wins]
+            margins[target] = 2 * routed_scores[wins] - 1
+            methods[target] = 'endpoint_quantile'
+            flags[routed] |= is_anomaly
+        return flags, scores, margins, methods
+    
+    def _shadow(self, service: str, challenger: ShadowEvaluation, features: pd.DataFrame,
+                keys: List[str], flags: np.ndarray, margins: np.ndarray, champion_seconds: float):
+        """Score a sample of the batch with the challenger and compare it with the champion"""
+        try:
+            rows = challenger.sample(len(features))
+            if len(rows):
+                started = time.perf_counter()
+                shadow_flags, _, shadow_margins, _ = self._score(
+                    challenger.model, challenger.scaler, challenger.registry,
+                    features.iloc[rows], [keys[idx] for idx in rows], challenger.forest,
+                    challenger.score_scale
+                )
+                challenger.record(flags[rows], shadow_flags, margins[rows], shadow_margins)
+                challenger.record_cost(champion_seconds, len(features), time.perf_counter() - started, len(rows))
+            self._settle(service, challenger)
+        except Exception as e:
+            logger.error(f"Shadow scoring failed for {service}, dropping challenger: {e}")
+            self.challengers.pop(service, None)
+    
+    def predict(self, service: str, metrics: List[Dict[str, Any]], publish: bool = True) -> List[AnomalyRecord]:
+        """
+        Detect anomalies in metrics
+
+        Args:
+            publish: Off for API reads. Only the publishing paths (scheduler,
+                stream) fold rows into the live window state and score the
+                batch with a pending challenger, so reads that re-score the
+                same rows change nothing and never count as shadow evidence.
+        """
         if service not in self.models:
             logger.warning(f"No trained model for {service}")
             return []
         
         try:
-            features = self.prepare_features(metrics)
-            scaled_features = self.scalers[service].transform(features)
+            keys = self._endpoint_keys(metrics)
+            features = self.prepare_features(metrics, self._pipeline(service), keys, update=publish)
             
-            # Predict
-            predictions = self.models[service].predict(scaled_features)
-            scores = self.models[service].decision_function(scaled_features)
+            started = time.perf_counter()
+            flags, scores, margins, methods = self._score(
+                self.models[service], self.scalers[service], self.endpoint_models.get(service),
+                features, keys, self.forests.get(service), self.score_scales[service]
+            )
+            model_version = self.model_versions.get(service, 'unknown')
             
-            # Normalize scores
-            anomaly_scores = 1 - (scores - scores.min()) / (scores.max() - scores.min() + 1e-10)
+            # Same feature rows, scored in shadow by a pending challenger
+            challenger = self.challengers.get(service) if publish else None
+            if challenger:
+                self._shadow(service, challenger, features, keys, flags, margins, time.perf_counter() - started)
             
-            # Create alerts
-            anomalies = []
-            for idx, (prediction, score) in enumerate(zip(predictions, anomaly_scores)):
-                if prediction == -1:
-                    metric = metrics[idx]
-                    anomalies.append({
-                        'metric_id': metric['id'],
-                        'service': service,
-                        'trace_id': metric.get('trace_id'),
-                        'method': metric.get('method'),
-                        'path': metric.get('path'),
-                        'anomaly_score': float(score),
-                        'detection_method': 'isolation_forest',
-                        'model_version': self.model_versions.get(service, 'unknown'),
-                        'timestamp': metric['timestamp'].isoformat(),
-                        'details': {
-                            'response_time_ms': metric['response_time_ms'],
-                            'status_code': metric['status_code'],
-                            'error_count': metric['error_count'],
-                            'response_size_bytes': metric.get('response_size_bytes', 0)
-                        }
-                    })
+            anomalies = self.records(metrics, service, flags, scores, methods, model_version)
             
             if anomalies:
                 logger.info(f"Detected {len(anomalies)} anomalies for {service}")
@@ -144,6 +445,16 @@ class AnomalyDetector:
             logger.error(f"Failed to predict anomalies for {service}: {e}")
             return []
     
+    @staticmethod
+    def records(metrics: List[Dict[str, Any]], service: str, flags: np.ndarray, scores: np.ndarray,
+                methods: List[str], model_version: str) -> List[AnomalyRecord]:
+        """Alerts for the flagged rows (records point at their metric row; no per-alert dicts)"""
+        flagged = np.flatnonzero(flags)
+        return [
+            AnomalyRecord(metrics[idx], service, score, methods[idx], model_version)
+            for idx, score in zip(flagged.tolist(), scores[flagged].tolist())
+        ]
+    
     def is_trained(self, service: str) -> bool:
         """Check if model is trained for a service"""
         return service in self.models
@@ -0,0 +1,121 @@
+import re
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+_ID_SEGMENT = re.compile(
+    r'^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|[0-9a-fA-F]{16,})$'
+)
+
+# Raw-unit floor for the per-feature scale, so constant features (e.g. an
+# endpoint that never errors) still yield finite z-scores
+SCALE_FLOOR = 1.0
+
+def normalize_path(path: Optional[str]) -> str:
+    """Collapse ids in a request path into a template: /orders/42/items -> /orders/:id/items"""
+    if not path:
+        return "/"
+    path = path.split('?', 1)[0].rstrip('/') or "/"
+    return "/".join(":id" if _ID_SEGMENT.match(segment) else segment for segment in path.split('/'))
+
+# Keys are stored fixed-width in the feature store
+MAX_KEY_LENGTH = 64
+
+def endpoint_key(method: Optional[str], path: Optional[str]) -> str:
+    """Registry key for a request: 'GET /orders/:id'"""
+    return f"{(method or '*').upper()} {normalize_path(path)}"[:MAX_KEY_LENGTH]
+
+class EndpointModelRegistry:
+    """
+    Lightweight per-endpoint models for one service, stored as struct-of-arrays:
+    per-feature mean and scale plus a quantile threshold on the max |z| per key.
+    A key costs ~40 bytes of arrays, so tens of thousands of endpoints stay cheap
+    to hold, persist and load.
+    """
+
+    def __init__(self, keys: List[str], mean: np.ndarray, scale: np.ndarray,
+                 threshold: np.ndarray, count: np.ndarray):
+        self.keys = keys
+        self.index: Dict[str, int] = {key: idx for idx, key in enumerate(keys)}
+        self.mean = mean
+        self.scale = scale
+        self.threshold = threshold
+        self.count = count
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def fit(cls, keys: np.ndarray, features: np.ndarray, contamination: float,
+            min_samples: int, max_keys: int) -> "EndpointModelRegistry":
+        """
+        Fit every key with at least `min_samples` rows in one vectorized pass.
+        The threshold is the (1 - contamination) quantile of the key's own max |z|.
+        """
+        uniques, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        n_keys = len(uniques)
+        n_features = features.shape[1]
+
+        sums = np.zeros((n_keys, n_features))
+        sumsq = np.zeros((n_keys, n_features))
+        np.add.at(sums, inverse, features)
+        np.add.at(sumsq, inverse, features ** 2)
+        mean = sums / counts[:, None]
+        std = np.sqrt(np.maximum(sumsq / counts[:, None] - mean ** 2, 0.0))
+        scale = np.maximum(std, SCALE_FLOOR)
+
+        z = np.abs(features - mean[inverse]) / scale[inverse]
+        score = z.max(axis=1)
+        # Per-key quantile: sort by (key, score) and index into each key's run
+        order = np.lexsort((score, inverse))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        positions = starts + np.floor((1 - contamination) * (counts - 1)).astype(np.int64)
+        threshold = np.maximum(score[order][positions], 1.0)
+
+        keep = np.flatnonzero(counts >= min_samples)
+        if len(keep) > max_keys:
+            keep = keep[np.argsort(-counts[keep], kind='stable')[:max_keys]]
+            keep.sort()
+        return cls(
+            [str(key) for key in uniques[keep]],
+            mean[keep].astype(np.float32),
+            scale[keep].astype(np.float32),
+            threshold[keep].astype(np.float32),
+            counts[keep].astype(np.int32)
+        )
+
+    def lookup(self, keys: List[str]) -> np.ndarray:
+        """Registry row per key, -1 where the key has no model"""
+        rows = {key: self.index.get(key, -1) for key in set(keys)}
+        return np.fromiter((rows[key] for key in keys), dtype=np.int64, count=len(keys))
+
+    def score(self, rows: np.ndarray, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score rows that have a model (`rows` >= 0).
+        Returns:
+            (is_anomaly, anomaly_score in [0, 1]; 0.5 sits exactly on the threshold)
+        """
+        z = np.abs(features - self.mean[rows]) / self.scale[rows]
+        ratio = z.max(axis=1) / self.threshold[rows]
+        return ratio > 1.0, np.minimum(ratio / 2.0, 1.0)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "keys": np.array(self.keys, dtype=str),
+            "mean": self.mean,
+            "scale": self.scale,
+            "threshold": self.threshold,
+            "count": self.count
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "EndpointModelRegistry":
+        return cls(
+            arrays["keys"].tolist(),
+            arrays["mean"],
+            arrays["scale"],
+            arrays["threshold"],
+            arrays["count"]
+        )
@@ -0,0 +1,218 @@
+import math
+import threading
+import numpy as np
+from collections import OrderedDict
+from datetime import timezone
+from typing import Dict, List, Any, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+RAW_FEATURES = [
+    'response_time_ms',
+    'status_code',
+    'error_count',
+    'response_size_bytes'
+]
+
+DERIVED_FEATURES = [
+    'request_rate',
+    'error_ratio',
+    'latency_p50_delta',
+    'latency_p95_delta',
+    'latency_p99_delta',
+    'hour_sin',
+    'hour_cos'
+]
+
+# Log-spaced latency histogram: 1 ms .. 60 s in 48 buckets (~26% wide)
+HISTOGRAM_BUCKETS = 48
+_LOG_BASE = math.log(60000.0) / HISTOGRAM_BUCKETS
+_BUCKET_VALUES = np.exp((np.arange(HISTOGRAM_BUCKETS) + 0.5) * _LOG_BASE)
+
+PIPELINE_VERSION = 1
+
+def _epoch(ts) -> float:
+    if isinstance(ts, (int, float, np.floating)):
+        return float(ts)
+    return ts.replace(tzinfo=timezone.utc).timestamp() if ts.tzinfo is None else ts.timestamp()
+
+def _bucket(latency: float) -> int:
+    if latency <= 1.0:
+        return 0
+    return min(int(math.log(latency) / _LOG_BASE), HISTOGRAM_BUCKETS - 1)
+
+class RollingWindow:
+    """
+    Sliding time window over one endpoint, kept as a ring of time slots.
+    Each slot holds request/error counts and a latency histogram; the window
+    totals are maintained by adding new observations and subtracting slots as
+    they expire, so every update and percentile read is constant-time.
+    Not thread-safe: FeaturePipeline serializes access.
+    """
+
+    __slots__ = ('slot_seconds', 'slots', 'epochs', 'counts', 'errors', 'histograms',
+                 'total_count', 'total_errors', 'total_histogram')
+
+    def __init__(self, window_seconds: int, slots: int):
+        self.slot_seconds = window_seconds / slots
+        self.slots = slots
+        self.epochs = np.full(slots, -1, dtype=np.int64)
+        self.counts = np.zeros(slots, dtype=np.int64)
+        self.errors = np.zeros(slots, dtype=np.int64)
+        self.histograms = np.zeros((slots, HISTOGRAM_BUCKETS), dtype=np.int64)
+        self.total_count = 0
+        self.total_errors = 0
+        self.total_histogram = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+
+    def _expire(self, epoch: int):
+        """Drop slots that have fallen out of the window ending at `epoch`"""
+        stale = (self.epochs >= 0) & (self.epochs <= epoch - self.slots)
+        for slot in np.flatnonzero(stale):
+            self.total_count -= self.counts[slot]
+            self.total_errors -= self.errors[slot]
+            self.total_histogram -= self.histograms[slot]
+            self.counts[slot] = 0
+            self.errors[slot] = 0
+            self.histograms[slot] = 0
+            self.epochs[slot] = -1
+
+    def _totals(self, epoch: int) -> Tuple[int, int, np.ndarray]:
+        """Window totals as of `epoch`, leaving expired slots in place (read-only scoring)"""
+        stale = (self.epochs >= 0) & (self.epochs <= epoch - self.slots)
+        if not stale.any():
+            return self.total_count, self.total_errors, self.total_histogram
+        return (self.total_count - int(self.counts[stale].sum()),
+                self.total_errors - int(self.errors[stale].sum()),
+                self.total_histogram - self.histograms[stale].sum(axis=0))
+
+    @staticmethod
+    def _percentile(histogram: np.ndarray, count: int, q: float) -> float:
+        if count == 0:
+            return 0.0
+        idx = int(np.searchsorted(np.cumsum(histogram), q * count, side='left'))
+        return float(_BUCKET_VALUES[min(idx, HISTOGRAM_BUCKETS - 1)])
+
+    def percentile(self, q: float) -> float:
+        return self._percentile(self.total_histogram, self.total_count, q)
+
+    def observe(self, timestamp: float, latency: float, is_error: bool, update: bool = True) -> List[float]:
+        """
+        Window features for a request, computed against the window before it
+        is added; without `update` the window is left exactly as it was
+        """
+        epoch = int(timestamp // self.slot_seconds)
+        if update:
+            self._expire(epoch)
+            count, errors, histogram = self.total_count, self.total_errors, self.total_histogram
+        else:
+            count, errors, histogram = self._totals(epoch)
+        window_seconds = self.slot_seconds * self.slots
+        features = [
+            (count + 1) / window_seconds,
+            (errors + is_error) / (count + 1),
+            latency - self._percentile(histogram, count, 0.50),
+            latency - self._percentile(histogram, count, 0.95),
+            latency - self._percentile(histogram, count, 0.99)
+        ]
+        # Too old for the ring: score it, but do not count it
+        if update and epoch > self.epochs.max() - self.slots:
+            slot = epoch % self.slots
+            if self.epochs[slot] != epoch:
+                self.total_count -= self.counts[slot]
+                self.total_errors -= self.errors[slot]
+                self.total_histogram -= self.histograms[slot]
+                self.counts[slot] = 0
+                self.errors[slot] = 0
+                self.histograms[slot] = 0
+                self.epochs[slot] = epoch
+            bucket = _bucket(latency)
+            self.counts[slot] += 1
+            self.errors[slot] += is_error
+            self.histograms[slot, bucket] += 1
+            self.total_count += 1
+            self.total_errors += is_error
+            self.total_histogram[bucket] += 1
+        return features
+
+class FeaturePipeline:
+    """
+    Incremental feature pipeline for one service: raw per-request columns plus
+    rolling-window features per endpoint (request rate, error ratio, latency
+    deltas against rolling p50/p95/p99) and a time-of-day encoding.
+
+    Rows are folded into the window state once; derived vectors are cached by
+    metric id, so re-scoring overlapping detection windows does not double
+    count traffic. A lock serializes the scheduler, stream consumer and API
+    threads sharing a service's pipeline; read-only transforms (API reads)
+    compute features without folding or caching anything.
+    """
+
+    def __init__(self, window_seconds: int = 60, slots: int = 12, cache_size: int = 50000):
+        self.window_seconds = window_seconds
+        self.slots = slots
+        self.cache_size = cache_size
+        self._windows: Dict[str, RollingWindow] = {}
+        self._cache: "OrderedDict[Any, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def feature_names() -> List[str]:
+        return RAW_FEATURES + DERIVED_FEATURES
+
+    def config(self) -> Dict[str, Any]:
+        """Recorded in model metadata; models trained with another config are not reused"""
+        return {
+            "version": PIPELINE_VERSION,
+            "window_seconds": self.window_seconds,
+            "slots": self.slots,
+            "features": self.feature_names()
+        }
+
+    def _window(self, key: str) -> RollingWindow:
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = RollingWindow(self.window_seconds, self.slots)
+        return window
+
+    def derive(self, key: str, timestamp, latency: float, status_code: int, error_count: int,
+               update: bool = True) -> List[float]:
+        """Derived features for one request (folded into the window when `update`)"""
+        with self._lock:
+            return self._derive(key, timestamp, latency, status_code, error_count, update)
+
+    def _derive(self, key: str, timestamp, latency: float, status_code: int, error_count: int,
+                update: bool) -> List[float]:
+        """Caller holds the lock"""
+        ts = _epoch(timestamp)
+        is_error = int(error_count > 0 or status_code >= 500)
+        values = self._window(key).observe(ts, float(latency), is_error, update=update)
+        angle = 2 * math.pi * (ts % 86400) / 86400
+        values.extend([math.sin(angle), math.cos(angle)])
+        return values
+
+    def transform(self, rows: List[Dict[str, Any]], keys: List[str], update: bool = True) -> np.ndarray:
+        """
+        Derived feature matrix (len(rows) x len(DERIVED_FEATURES)) in row order.
+        Rows are folded into the windows oldest first; with `update` off they
+        are scored against the windows as they stand and nothing is changed.
+        """
+        out = np.zeros((len(rows), len(DERIVED_FEATURES)))
+        order = sorted(range(len(rows)), key=lambda idx: _epoch(rows[idx]['timestamp']))
+        with self._lock:
+            for idx in order:
+                row = rows[idx]
+                row_id = row.get('id')
+                cached = self._cache.get(row_id) if row_id is not None else None
+                if cached is not None:
+                    out[idx] = cached
+                    continue
+                out[idx] = self._derive(
+                    keys[idx], row['timestamp'], row['response_time_ms'],
+                    row['status_code'], row['error_count'], update
+                )
+                if update and row_id is not None:
+                    self._cache[row_id] = out[idx]
+                    if len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        return out
@@ -0,0 +1,89 @@
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+# Statistical signal: (feature, value, z_score, mean, std)
+Signal = Tuple[str, float, float, float, float]
+
+class AnomalyRecord:
+    """
+    One flagged metric on its way through detection, enrichment and alerting.
+
+    Holds a reference to the metric row it flags rather than copies of its
+    fields; the alert dict (`to_dict`) and the broker message are only built
+    at the API and broker boundary.
+    """
+
+    __slots__ = ('metric', 'service', 'anomaly_score', 'detection_method', 'model_version',
+                 'signals', 'baseline', 'threshold', 'enrichment', 'incident')
+
+    def __init__(self, metric: Mapping[str, Any], service: str, anomaly_score: float,
+                 detection_method: str, model_version: Optional[str] = None,
+                 signals: Optional[Tuple[Signal, ...]] = None, baseline: Optional[str] = None):
+        self.metric = metric
+        self.service = service
+        self.anomaly_score = anomaly_score
+        self.detection_method = detection_method
+        self.model_version = model_version
+        self.signals = signals
+        self.baseline = baseline
+        self.threshold: Optional[float] = None
+        # Root cause analysis of the trace, when the metric has one
+        self.enrichment: Optional[Dict[str, Any]] = None
+        # Cross-service incident summary (id, origin, services)
+        self.incident: Optional[Dict[str, Any]] = None
+
+    @property
+    def metric_id(self):
+        return self.metric['id']
+
+    @property
+    def trace_id(self):
+        return self.metric.get('trace_id')
+
+    @property
+    def timestamp(self):
+        """The metric's timestamp (datetime); ISO formatted in the dict shapes"""
+        return self.metric['timestamp']
+
+    def details(self) -> Dict[str, Any]:
+        metric = self.metric
+        details = {
+            'response_time_ms': metric['response_time_ms'],
+            'status_code': metric['status_code'],
+            'error_count': metric['error_count'],
+            'response_size_bytes': metric.get('response_size_bytes', 0)
+        }
+        if self.signals is not None:
+            details['anomaly_signals'] = [
+                {'feature': feature, 'value': value, 'z_score': z_score, 'mean': mean, 'std': std}
+                for feature, value, z_score, mean, std in self.signals
+            ]
+            details['baseline'] = self.baseline
+        return details
+
+    def to_dict(self) -> Dict[str, Any]:
+        """API shape (AnomalyDetail)"""
+        metric = self.metric
+        alert = {
+            'metric_id': metric['id'],
+            'service': self.service,
+            'trace_id': metric.get('trace_id'),
+            'method': metric.get('method'),
+            'path': metric.get('path'),
+            'anomaly_score': self.anomaly_score,
+            'detection_method': self.detection_method
+        }
+        if self.model_version is not None:
+            alert['model_version'] = self.model_version
+        alert['timestamp'] = metric['timestamp'].isoformat()
+        alert['details'] = self.details()
+        alert['threshold'] = self.threshold
+        if self.enrichment is not None:
+            alert.update({
+                'root_cause': self.enrichment.get('root_cause'),
+                'service_chain': self.enrichment.get('service_chain'),
+                'impacted_services': self.enrichment.get('impacted_services'),
+                'suggested_action': self.enrichment.get('suggested_action')
+            })
+        if self.incident is not None:
+            alert['incident'] = self.incident
+        return alert
@@ -6,13 +6,14 @@ logger = logging.getLogger(__name__)
 
 class RootCauseAnalyzer:
     @staticmethod
-    def fetch_trace_events(trace_id: str) -> List[Dict[str, Any]]:
+    def fetch_trace_events(trace_id: str, database=None) -> List[Dict[str, Any]]:
         """
         Fetch all metrics/events with the same trace_id for correlation.
+        `database` defaults to the shared connection pool.
         """
         try:
             # Replace this with correct DB call or API call
-            return db.fetch_events_by_trace_id(trace_id)
+            return (database or db).fetch_events_by_trace_id(trace_id)
         except Exception as exc:
             logger.error(f"Failed to fetch events for trace_id={trace_id}: {exc}")
             return []
@@ -0,0 +1,116 @@
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable, Tuple
+import logging
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+class ShadowEvaluation:
+    """
+    A freshly trained challenger model scored in shadow next to the live
+    (champion) model of a service.
+
+    Both models see the same feature rows; the challenger only scores a sample
+    of them, sized so its cost stays within SHADOW_OVERHEAD_BUDGET of the
+    champion's. Agreement, alert-volume delta and score drift accumulate until
+    the challenger has seen SHADOW_MIN_ROWS rows, after which it is promoted
+    as soon as it meets the criteria, or rejected after SHADOW_MAX_ROWS.
+    Evaluations are capped at SHADOW_MAX_MINUTES; a challenger that has not
+    seen SHADOW_MIN_ROWS rows by then is rejected, since too little shows it
+    is safe, and the champion stays live until the next training round
+    brings a new challenger.
+    """
+
+    def __init__(self, service: str, version: Optional[str], model, scaler, registry, forest=None,
+                 score_scale: Tuple[float, float] = (0.0, 0.0),
+                 clock: Callable[[], datetime] = datetime.now):
+        self.service = service
+        self.version = version
+        self.model = model
+        self.scaler = scaler
+        self.registry = registry
+        self.forest = forest
+        self.score_scale = score_scale
+        self.clock = clock
+        self.started = clock()
+        self.rows = 0
+        self.agreements = 0
+        self.champion_alerts = 0
+        self.challenger_alerts = 0
+        self.margin_diff_sum = 0.0
+        self.sample_rate = settings.SHADOW_SAMPLE_RATE
+        # Per-row scoring cost, smoothed over batches
+        self._champion_cost: Optional[float] = None
+        self._challenger_cost: Optional[float] = None
+
+    def sample(self, n: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """Row indices the challenger should score for a batch of `n`"""
+        rng = rng or np.random.default_rng()
+        if self.sample_rate >= 1.0:
+            return np.arange(n)
+        return np.flatnonzero(rng.random(n) < self.sample_rate)
+
+    def record_cost(self, champion_seconds: float, champion_rows: int,
+                    challenger_seconds: float, challenger_rows: int):
+        """Shrink or grow the sample rate to keep shadow scoring inside the overhead budget"""
+        def smooth(previous, value):
+            return value if previous is None else 0.8 * previous + 0.2 * value
+        if champion_rows:
+            self._champion_cost = smooth(self._champion_cost, champion_seconds / champion_rows)
+        if challenger_rows:
+            self._challenger_cost = smooth(self._challenger_cost, challenger_seconds / challenger_rows)
+        if self._champion_cost and self._challenger_cost:
+            affordable = settings.SHADOW_OVERHEAD_BUDGET * self._champion_cost / self._challenger_cost
+            self.sample_rate = float(np.clip(affordable, 0.01, settings.SHADOW_SAMPLE_RATE))
+
+    def record(self, champion_flags: np.ndarray, challenger_flags: np.ndarray,
+               champion_margin: np.ndarray, challenger_margin: np.ndarray):
+        """Fold one shadow-scored batch (same rows for both models) into the comparison"""
+        self.rows += len(champion_flags)
+        self.agreements += int(np.sum(champion_flags == challenger_flags))
+        self.champion_alerts += int(np.sum(champion_flags))
+        self.challenger_alerts += int(np.sum(challenger_flags))
+        self.margin_diff_sum += float(np.sum(np.abs(challenger_margin - champion_margin)))
+
+    @property
+    def agreement_rate(self) -> float:
+        return self.agreements / self.rows if self.rows else 0.0
+
+    @property
+    def alert_delta(self) -> float:
+        """Relative change in alert volume (+0.5 = challenger raises 50% more)"""
+        return (self.challenger_alerts - self.champion_alerts) / max(self.champion_alerts, 1)
+
+    @property
+    def score_drift(self) -> float:
+        """Mean absolute difference of the models' distances to their own decision boundary"""
+        return self.margin_diff_sum / self.rows if self.rows else 0.0
+
+    @property
+    def expired(self) -> bool:
+        return self.clock() - self.started >= timedelta(minutes=settings.SHADOW_MAX_MINUTES)
+
+    def verdict(self) -> Optional[str]:
+        """'promote', 'reject' or None while still collecting evidence"""
+        expired = self.expired
+        if self.rows < settings.SHADOW_MIN_ROWS:
+            return "reject" if expired else None
+        if (self.agreement_rate >= settings.SHADOW_MIN_AGREEMENT
+                and abs(self.alert_delta) <= settings.SHADOW_MAX_ALERT_DELTA
+                and self.score_drift <= settings.SHADOW_MAX_SCORE_DRIFT):
+            return "promote"
+        if self.rows >= settings.SHADOW_MAX_ROWS or expired:
+            return "reject"
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "started": self.started.isoformat(),
+            "rows": self.rows,
+            "agreement_rate": round(self.agreement_rate, 4),
+            "alert_delta": round(self.alert_delta, 4),
+            "score_drift": round(self.score_drift, 4),
+            "sample_rate": round(self.sample_rate, 4)
+        }
@@ -1,7 +1,7 @@
 import numpy as np
-import pandas as pd
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import logging
+from app.models.records import AnomalyRecord
 
 logger = logging.getLogger(__name__)
 
@@ -20,73 +20,55 @@ class StatisticalDetector:
             'response_size_bytes'
         ]
     
-    def detect(self, metrics: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def detect(self, metrics: List[Dict[str, Any]],
+               baseline: Optional[Dict[str, Any]] = None,
+               seasonal: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> List[AnomalyRecord]:
         """
         Detect anomalies using z-score method
         
         Args:
             metrics: List of recent metrics
+            baseline: Optional window stats from rollups; when given, rows are
+                compared against the long window instead of their own batch
+            seasonal: Optional per-row (mean, std, valid) from the hour-of-week
+                baseline store; takes precedence wherever a row's bucket is valid
             
         Returns:
             List of detected anomalies with scores
         """
-        if len(metrics) < 10:
+        has_seasonal = seasonal is not None and bool(seasonal[2].any())
+        if len(metrics) < 10 and not baseline and not has_seasonal:
             logger.warning(f"Too few samples for statistical detection: {len(metrics)}")
             return []
         
         try:
+            import pandas as pd
             df = pd.DataFrame(metrics)
             df['response_size_bytes'] = df['response_size_bytes'].fillna(0)
             
-            anomalies = []
+            # Reference mean/std per row and feature: seasonal bucket, then window, then batch
+            values = df[self.feature_columns].to_numpy(dtype=float)
+            if baseline:
+                fallback_mean = np.array([baseline['mean'][f] for f in self.feature_columns])
+                fallback_std = np.array([baseline['std'][f] for f in self.feature_columns])
+                fallback_source = 'window'
+            else:
+                fallback_mean = values.mean(axis=0)
+                fallback_std = values.std(axis=0)
+                fallback_source = 'batch'
+            means = np.broadcast_to(fallback_mean, values.shape).copy()
+            stds = np.broadcast_to(fallback_std, values.shape).copy()
+            sources = np.full(len(df), fallback_source, dtype=object)
+            if has_seasonal:
+                seasonal_mean, seasonal_std, valid = seasonal
+                means[valid] = seasonal_mean[valid]
+                stds[valid] = seasonal_std[valid]
+                sources[valid] = 'seasonal'
             
-            for idx, row in df.iterrows():
-                metric = metrics[idx]
-                anomaly_signals = []
-                max_z_score = 0.0
-                
-                # Calculate z-scores for each feature
-                for feature in self.feature_columns:
-                    if feature in df.columns:
-                        values = df[feature].values
-                        mean = np.mean(values)
-                        std = np.std(values)
-                        
-                        if std > 0:
-                            z_score = abs((row[feature] - mean) / std)
-                            
-                            if z_score > self.z_threshold:
-                                anomaly_signals.append({
-                                    'feature': feature,
-                                    'value': float(row[feature]),
-                                    'z_score': float(z_score),
-                                    'mean': float(mean),
-                                    'std': float(std)
-                                })
-                                max_z_score = max(max_z_score, z_score)
-                
-                # If any feature is anomalous, flag the metric
-                if anomaly_signals:
-                    # Normalize z-score to 0-1 range for consistency with ML scores
-                    normalized_score = min(max_z_score / 10.0, 1.0)
-                    
-                    anomalies.append({
-                        'metric_id': metric['id'],
-                        'service': metric['service'],
-                        'trace_id': metric.get('trace_id'),
-                        'method': metric.get('method'),
-                        'path': metric.get('path'),
-                        'anomaly_score': normalized_score,
-                        'detection_method': 'statistical_zscore',
-                        'timestamp': metric['timestamp'].isoformat(),
-                        'details': {
-                            'response_time_ms': metric['response_time_ms'],
-                            'status_code': metric['status_code'],
-                            'error_count': metric['error_count'],
-                            'response_size_bytes': metric.get('response_size_bytes', 0),
-                            'anomaly_signals': anomaly_signals
-                        }
-                    })
+            with np.errstate(divide='ignore', invalid='ignore'):
+                z_scores = np.where(stds > 0, np.abs(values - means) / stds, 0.0)
+            
+            anomalies = self.records(metrics, values, z_scores, means, stds, sources)
             
             if anomalies:
                 logger.info(f"Statistical detector found {len(anomalies)} anomalies")
@@ -97,5 +79,29 @@ class StatisticalDetector:
             logger.error(f"Statistical detection failed: {e}")
             return []
 
+    def records(self, metrics: List[Dict[str, Any]], values: np.ndarray, z_scores: np.ndarray,
+                means: np.ndarray, stds: np.ndarray, sources: np.ndarray) -> List[AnomalyRecord]:
+        """One record per row with a feature over the z-score threshold (arrays are rows x features)"""
+        anomalies = []
+        crossed = z_scores > self.z_threshold
+        rows = np.flatnonzero(crossed.any(axis=1))
+        # Normalize z-score to 0-1 range for consistency with ML scores
+        scores = np.minimum(np.where(crossed[rows], z_scores[rows], 0.0).max(axis=1, initial=0.0) / 10.0, 1.0)
+        # Plain floats for the flagged rows only, instead of NumPy scalars per feature
+        flagged = zip(rows.tolist(), scores.tolist(), crossed[rows].tolist(), values[rows].tolist(),
+                      z_scores[rows].tolist(), means[rows].tolist(), stds[rows].tolist())
+        for idx, score, mask, row_values, row_z, row_means, row_stds in flagged:
+            # The features whose z-score crossed the threshold
+            signals = tuple(
+                (feature, row_values[col], row_z[col], row_means[col], row_stds[col])
+                for col, feature in enumerate(self.feature_columns) if mask[col]
+            )
+            metric = metrics[idx]
+            anomalies.append(AnomalyRecord(
+                metric, metric['service'], score, 'statistical_zscore',
+                signals=signals, baseline=sources[idx]
+            ))
+        return anomalies
+
 # Singleton instance
 statistical_detector = StatisticalDetector()
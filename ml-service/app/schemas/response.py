@@ -28,6 +28,8 @@ class AnomalyDetail(BaseModel):
     service_chain: Optional[List[str]] = None
     impacted_services: Optional[List[str]] = None
     suggested_action: Optional[str] = None
+    # Cross-service incident: id, probable origin, services
+    incident: Optional[Dict[str, Any]] = None
 
 class AnomalyDetectionResponse(BaseModel):
     success: bool
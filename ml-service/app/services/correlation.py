@@ -0,0 +1,459 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+from app.models.records import AnomalyRecord
+from app.services.database import db
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+# Series kept per service and bucket
+LATENCY_P95, ERROR_RATE = 0, 1
+
+class Incident:
+    """Anomalies from one or more services merged into a single event"""
+
+    def __init__(self, bucket: int):
+        self.id = str(uuid.uuid4())
+        self.first_bucket = bucket
+        self.last_bucket = bucket
+        # Service -> bucket of its first anomaly in this incident
+        self.services: Dict[str, int] = {}
+        self.alerts = 0
+        self.origin: Optional[str] = None
+        self.evidence: List[Dict[str, Any]] = []
+
+    def add(self, service: str, bucket: int):
+        self.services.setdefault(service, bucket)
+        self.services[service] = min(self.services[service], bucket)
+        self.first_bucket = min(self.first_bucket, bucket)
+        self.last_bucket = max(self.last_bucket, bucket)
+        self.alerts += 1
+
+    def summary(self) -> Dict[str, Any]:
+        return {"id": self.id, "origin": self.origin, "services": sorted(self.services)}
+
+    def to_dict(self, bucket_seconds: int) -> Dict[str, Any]:
+        def at(bucket: int) -> str:
+            return (EPOCH + timedelta(seconds=bucket * bucket_seconds)).isoformat()
+        return {
+            **self.summary(),
+            "started": at(self.first_bucket),
+            "last_seen": at(self.last_bucket + 1),
+            "alerts": self.alerts,
+            "first_anomaly": {service: at(bucket) for service, bucket in sorted(self.services.items())},
+            "evidence": self.evidence
+        }
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "id": self.id, "first_bucket": self.first_bucket, "last_bucket": self.last_bucket,
+            "services": self.services, "alerts": self.alerts, "origin": self.origin, "evidence": self.evidence
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> 'Incident':
+        incident = cls(state["first_bucket"])
+        incident.id = state["id"]
+        incident.last_bucket = state["last_bucket"]
+        incident.services = state["services"]
+        incident.alerts = state["alerts"]
+        incident.origin = state["origin"]
+        incident.evidence = state["evidence"]
+        return incident
+
+class CorrelationSnapshot:
+    """Pairwise correlations as of one refresh; replaced whole, never modified"""
+
+    __slots__ = ('index', 'best', 'lags', 'head')
+
+    def __init__(self, index: Dict[str, int], best: np.ndarray, lags: np.ndarray, head: Optional[int]):
+        self.index = index
+        self.best = best
+        self.lags = lags
+        self.head = head
+
+EMPTY_SNAPSHOT = CorrelationSnapshot({}, np.zeros((0, 0)), np.zeros((0, 0), dtype=np.int64), None)
+
+class CorrelationEngine:
+    """
+    Links anomalies across services that do not share a trace.
+
+    Per-service latency p95 and error rate per bucket live in one ring-buffer
+    array shaped (series, services, window + max lag buckets), refreshed from
+    the metrics table. Lagged cross-correlations for every service pair come
+    from one matrix product per (series, lag) over the centred window, so
+    a refresh costs O(lags * services^2 * window) and memory is fixed by the
+    service capacity (the least recently active service is evicted when full).
+
+    Only the leader's "correlation" scheduler job refreshes the ring; it then
+    swaps in a new snapshot of the correlations. Alerts are matched against
+    the latest snapshot, so the alert path never queries the database.
+
+    Each alert joins the open incident whose members correlate best with its
+    service, or opens a new one. The probable origin is the member whose
+    series lead the others' (correlated at a positive lag), then the one
+    that went anomalous first.
+
+    With a `state_file`, the leader saves the snapshot and the incidents
+    there after every refresh and every recorded batch; other workers load
+    the latest save, so /incidents and read-only matching agree across workers.
+    """
+
+    def __init__(self, bucket_seconds: int = 60, window_buckets: int = 60, max_lag_buckets: int = 5,
+                 capacity: int = 64, threshold: float = 0.6, incident_gap_seconds: int = 600,
+                 min_points: int = 10, history: int = 100, state_file: Optional[str] = None):
+        self.enabled = settings.CORRELATION_ENABLED
+        self.bucket_seconds = bucket_seconds
+        self.window = window_buckets
+        self.max_lag = min(max_lag_buckets, window_buckets // 2)
+        self.slots = window_buckets + self.max_lag
+        self.threshold = threshold
+        self.gap_buckets = max(incident_gap_seconds // bucket_seconds, 1)
+        self.min_points = min_points
+        self.index: Dict[str, int] = {}
+        self.last_active = np.full(capacity, -1, dtype=np.int64)
+        self.series = np.full((2, capacity, self.slots), np.nan)
+        self.head: Optional[int] = None
+        self.open: Dict[str, Incident] = {}
+        self.closed: deque = deque(maxlen=history)
+        self._version = 0
+        self._cache: Optional[Tuple[int, np.ndarray, np.ndarray]] = None
+        self.snapshot = EMPTY_SNAPSHOT
+        # Guards the incidents; the ring is only touched by refresh()
+        self._lock = threading.Lock()
+        self.stats = {"refreshes": 0, "failures": 0, "evictions": 0, "last_refresh_ms": None}
+        self.state_path = Path(state_file) if state_file else None
+        self._loaded_mtime = None
+
+    def _bucket(self, timestamp: Any) -> int:
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.replace(tzinfo=None) - timestamp.utcoffset()
+        return int((timestamp - EPOCH).total_seconds() // self.bucket_seconds)
+
+    def _row(self, service: str, bucket: int) -> int:
+        row = self.index.get(service)
+        if row is None:
+            if len(self.index) < self.series.shape[1]:
+                row = len(self.index)
+            else:
+                row = int(np.argmin(self.last_active))
+                evicted = next(name for name, idx in self.index.items() if idx == row)
+                del self.index[evicted]
+                self.series[:, row, :] = np.nan
+                self.last_active[row] = -1
+                self.stats["evictions"] += 1
+            self.index[service] = row
+        self.last_active[row] = max(self.last_active[row], bucket)
+        return row
+
+    def _advance(self, bucket: int):
+        """Move the head to `bucket`, clearing the slots it wraps onto"""
+        if self.head is not None and bucket <= self.head:
+            return
+        if self.head is None or bucket - self.head >= self.slots:
+            self.series[:] = np.nan
+        else:
+            self.series[:, :, np.arange(self.head + 1, bucket + 1) % self.slots] = np.nan
+        self.head = bucket
+
+    def ingest(self, now_bucket: int, services: List[str], buckets: np.ndarray,
+               latency_p95: np.ndarray, error_rate: np.ndarray):
+        """Write per-(service, bucket) values into the ring; buckets older than the ring are dropped"""
+        self._advance(now_bucket)
+        buckets = np.asarray(buckets, dtype=np.int64)
+        keep = (buckets > self.head - self.slots) & (buckets <= self.head)
+        if keep.any():
+            rows = np.array([
+                self._row(service, int(bucket))
+                for service, bucket, kept in zip(services, buckets, keep) if kept
+            ])
+            columns = buckets[keep] % self.slots
+            self.series[LATENCY_P95, rows, columns] = np.asarray(latency_p95, dtype=float)[keep]
+            self.series[ERROR_RATE, rows, columns] = np.asarray(error_rate, dtype=float)[keep]
+        self._version += 1
+
+    def refresh(self) -> bool:
+        """
+        Aggregate buckets since the head (re-reading the last two for late rows)
+        into the ring, then publish a new snapshot of the correlations.
+        Runs on the leader's scheduler, one call at a time.
+        """
+        started = time.monotonic()
+        since = None if self.head is None else self.head - 2
+        try:
+            rows = db.execute("""
+            WITH bounds AS (
+                SELECT floor(extract(epoch FROM NOW()::timestamp) / %(bucket)s)::bigint AS now_bucket
+            )
+            SELECT bounds.now_bucket, agg.service, agg.bucket, agg.p95, agg.error_rate
+            FROM bounds
+            LEFT JOIN (
+                SELECT
+                    service,
+                    floor(extract(epoch FROM timestamp) / %(bucket)s)::bigint AS bucket,
+                    percentile_cont(0.95) WITHIN GROUP (ORDER BY "responseTimeMs") AS p95,
+                    AVG(CASE WHEN "statusCode" >= 500 OR "errorCount" > 0 THEN 1.0 ELSE 0.0 END)::float8 AS error_rate
+                FROM metrics
+                WHERE timestamp >= COALESCE(%(since)s, NOW()::timestamp - %(span)s::interval)
+                AND service <> 'api'
+                GROUP BY 1, 2
+            ) agg ON TRUE
+            """, {
+                "bucket": self.bucket_seconds,
+                "since": EPOCH + timedelta(seconds=since * self.bucket_seconds) if since is not None else None,
+                "span": f"{self.slots * self.bucket_seconds} seconds"
+            })
+        except Exception as e:
+            self.stats["failures"] += 1
+            logger.error(f"Correlation refresh failed: {e}")
+            return False
+        found = [row for row in rows if row["service"] is not None]
+        self.ingest(
+            rows[0]["now_bucket"],
+            [row["service"] for row in found],
+            np.array([row["bucket"] for row in found], dtype=np.int64),
+            np.array([row["p95"] for row in found], dtype=float),
+            np.array([row["error_rate"] for row in found], dtype=float)
+        )
+        best, lags = self.correlations()
+        snapshot = CorrelationSnapshot(dict(self.index), best, lags, self.head)
+        self.stats["refreshes"] += 1
+        self.stats["last_refresh_ms"] = round((time.monotonic() - started) * 1000, 2)
+        with self._lock:
+            self.snapshot = snapshot
+            self.save()
+        return True
+
+    def correlations(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Best lagged correlation for every service pair over both series, and its
+        lag in buckets: lags[i, j] > 0 means service i leads service j.
+        Rows and columns follow `self.index`; cached until the ring changes.
+        """
+        if self._cache is not None and self._cache[0] == self._version:
+            return self._cache[1], self._cache[2]
+        count = len(self.index)
+        best = np.zeros((count, count))
+        lags = np.zeros((count, count), dtype=np.int64)
+        if self.head is not None and count:
+            columns = np.arange(self.head - self.window + 1, self.head + 1) % self.slots
+            for values in self.series[:, :count][:, :, columns]:
+                present = ~np.isnan(values)
+                points = present.sum(axis=1)
+                # Centre on the window mean; missing buckets sit at the mean, so
+                # they add nothing to any product
+                centred = np.where(present, values, 0.0)
+                centred -= (centred.sum(axis=1) / np.maximum(points, 1))[:, None]
+                centred[~present] = 0.0
+                flat = (centred ** 2).sum(axis=1) <= 1e-12 * np.maximum(points, 1)
+                centred[(points < self.min_points) | flat] = 0.0
+                for lag in range(self.max_lag + 1):
+                    # corr[i, j] = corr(i at t, j at t + lag): i leads j by `lag`
+                    leading, following = centred[:, :self.window - lag], centred[:, lag:]
+                    norms = np.outer(np.linalg.norm(leading, axis=1), np.linalg.norm(following, axis=1))
+                    corr = np.divide(leading @ following.T, norms, out=np.zeros_like(norms), where=norms > 0)
+                    for matrix, signed in ((corr, lag), (corr.T, -lag)):
+                        better = matrix > best
+                        best = np.where(better, matrix, best)
+                        lags = np.where(better, signed, lags)
+        np.fill_diagonal(best, 1.0)
+        np.fill_diagonal(lags, 0)
+        self._cache = (self._version, best, lags)
+        return best, lags
+
+    @staticmethod
+    def _score(service: str, incident: Incident, snapshot: CorrelationSnapshot) -> float:
+        row = snapshot.index.get(service)
+        members = [snapshot.index[name] for name in incident.services if name in snapshot.index]
+        if row is None or not members:
+            return 0.0
+        return float(snapshot.best[row, members].max())
+
+    def _explain(self, incident: Incident, snapshot: CorrelationSnapshot):
+        """Pick the probable origin and keep the correlated pairs behind it"""
+        best, lags = snapshot.best, snapshot.lags
+        members = sorted(incident.services, key=lambda name: (incident.services[name], name))
+        rows = [snapshot.index.get(name) for name in members]
+        known = [idx for idx, row in enumerate(rows) if row is not None]
+        lead = np.zeros(len(members))
+        evidence = []
+        if len(known) > 1:
+            picked = np.array([rows[idx] for idx in known])
+            pair_corr = best[np.ix_(picked, picked)]
+            pair_lag = lags[np.ix_(picked, picked)]
+            strong = pair_corr >= self.threshold
+            lead[known] = (np.where(strong & (pair_lag > 0), pair_corr, 0.0).sum(axis=1)
+                           - np.where(strong & (pair_lag < 0), pair_corr, 0.0).sum(axis=1))
+            for a, b in zip(*np.nonzero(np.triu(strong, k=1))):
+                leader, follower = (a, b) if pair_lag[a, b] >= 0 else (b, a)
+                evidence.append({
+                    "leader": members[known[leader]],
+                    "follower": members[known[follower]],
+                    "correlation": round(float(pair_corr[a, b]), 3),
+                    "lag_seconds": int(abs(pair_lag[a, b])) * self.bucket_seconds
+                })
+        # Members are ordered by first anomaly, so ties go to the earliest
+        incident.origin = members[int(np.argmax(lead))] if lead.any() else members[0]
+        incident.evidence = evidence
+
+    def _assign(self, service: str, bucket: int, snapshot: CorrelationSnapshot,
+                record: bool) -> Optional[Incident]:
+        if record:
+            for incident_id, incident in list(self.open.items()):
+                if bucket - incident.last_bucket > self.gap_buckets:
+                    self.closed.append(self.open.pop(incident_id))
+        match, score = None, self.threshold
+        for incident in self.open.values():
+            if abs(bucket - incident.last_bucket) > self.gap_buckets:
+                continue
+            if service in incident.services:
+                match = incident
+                break
+            candidate = self._score(service, incident, snapshot)
+            if candidate >= score:
+                match, score = incident, candidate
+        if not record:
+            return match
+        if match is None:
+            match = Incident(bucket)
+            self.open[match.id] = match
+        match.add(service, bucket)
+        self._explain(match, snapshot)
+        return match
+
+    def correlate(self, alerts: List[AnomalyRecord], record: bool = True) -> List[AnomalyRecord]:
+        """
+        Set each alert's incident (id, origin, services).
+        With `record` off (read-only API calls) alerts are matched against open
+        incidents without opening or extending any. Reads the latest snapshot only.
+        """
+        if not alerts:
+            return alerts
+        with self._lock:
+            snapshot = self.snapshot
+            for alert in sorted(alerts, key=lambda item: self._bucket(item.timestamp)):
+                incident = self._assign(alert.service, self._bucket(alert.timestamp), snapshot, record)
+                if incident is not None:
+                    alert.incident = incident.summary()
+            if record:
+                self.save()
+        return alerts
+
+    def save(self):
+        """Write the snapshot and incidents for other workers (caller holds the lock)"""
+        if self.state_path is None:
+            return
+        snapshot = self.snapshot
+        state = {
+            "snapshot": {
+                "services": sorted(snapshot.index, key=snapshot.index.get),
+                "best": snapshot.best.tolist(),
+                "lags": snapshot.lags.tolist(),
+                "head": snapshot.head
+            },
+            "open": [incident.state() for incident in self.open.values()],
+            "closed": [incident.state() for incident in self.closed],
+            "stats": self.stats
+        }
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.state_path.with_name(f".{self.state_path.name}.tmp")
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+        except Exception as e:
+            logger.error(f"Failed to save correlation state: {e}")
+
+    def load(self) -> bool:
+        """
+        Take the snapshot and incidents last saved by the leader
+
+        Returns:
+            True if a newer save was loaded
+        """
+        if self.state_path is None:
+            return False
+        try:
+            mtime = self.state_path.stat().st_mtime
+            if mtime == self._loaded_mtime:
+                return False
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            saved = state["snapshot"]
+            shape = (len(saved["services"]),) * 2
+            snapshot = CorrelationSnapshot(
+                {service: row for row, service in enumerate(saved["services"])},
+                np.array(saved["best"], dtype=float).reshape(shape),
+                np.array(saved["lags"], dtype=np.int64).reshape(shape),
+                saved["head"]
+            )
+            open_incidents = [Incident.from_state(item) for item in state["open"]]
+            closed = [Incident.from_state(item) for item in state["closed"]]
+        except (OSError, ValueError, KeyError):
+            return False
+        with self._lock:
+            self.snapshot = snapshot
+            self.open = {incident.id: incident for incident in open_incidents}
+            self.closed = deque(closed, maxlen=self.closed.maxlen)
+            self.stats.update(state.get("stats", {}))
+            self._loaded_mtime = mtime
+        return True
+
+    def top_pairs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Most strongly correlated service pairs in the current window"""
+        snapshot = self.snapshot
+        best, lags = snapshot.best, snapshot.lags
+        names = sorted(snapshot.index, key=snapshot.index.get)
+        first, second = np.triu_indices(len(names), k=1)
+        scores = best[first, second]
+        return [
+            {
+                "services": [names[first[idx]], names[second[idx]]],
+                "correlation": round(float(scores[idx]), 3),
+                # Positive: the first service leads the second
+                "lag_seconds": int(lags[first[idx], second[idx]]) * self.bucket_seconds
+            }
+            for idx in np.argsort(-scores)[:limit] if scores[idx] >= self.threshold
+        ]
+
+    def incidents(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open": [incident.to_dict(self.bucket_seconds) for incident in self.open.values()],
+                "recent": [incident.to_dict(self.bucket_seconds) for incident in reversed(self.closed)]
+            }
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "services": len(self.snapshot.index),
+            "snapshot_bucket": self.snapshot.head,
+            "bucket_seconds": self.bucket_seconds,
+            "window_buckets": self.window,
+            "max_lag_buckets": self.max_lag,
+            "open_incidents": len(self.open),
+            **self.stats
+        }
+
+# Singleton instance
+correlation_engine = CorrelationEngine(
+    bucket_seconds=settings.CORRELATION_BUCKET_SECONDS,
+    window_buckets=settings.CORRELATION_WINDOW_BUCKETS,
+    max_lag_buckets=settings.CORRELATION_MAX_LAG_BUCKETS,
+    capacity=settings.CORRELATION_MAX_SERVICES,
+    threshold=settings.CORRELATION_THRESHOLD,
+    incident_gap_seconds=settings.CORRELATION_INCIDENT_GAP_SECONDS,
+    state_file=settings.CORRELATION_STATE_FILE
+)
@@ -1,30 +1,154 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import List, Dict, Any
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import logging
+import threading
+import time
+import uuid
+import weakref
+import numpy as np
 from app.config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+METRIC_COLUMNS = """
+            id,
+            service,
+            "traceId" as trace_id,
+            method,
+            path,
+            timestamp,
+            "responseTimeMs" as response_time_ms,
+            "statusCode" as status_code,
+            "requestCount" as request_count,
+            "errorCount" as error_count,
+            "responseSizeBytes" as response_size_bytes,
+            "createdAt" as created_at"""
+
+# Rows per page of scheduled detection reads
+DETECTION_PAGE_ROWS = 1000
+
+def _sampled_query(by_path: bool, by_status: bool) -> str:
+    """Stratified sample ($1 service, $2 window, $3 bucket seconds, $4 limit)"""
+    stratum = ["floor(extract(epoch FROM timestamp) / $3)::text"]
+    if by_path:
+        stratum.append("COALESCE(path, '')")
+    if by_status:
+        stratum.append('("statusCode" / 100)::text')
+    return f"""
+        WITH windowed AS (
+            SELECT{METRIC_COLUMNS},
+                concat_ws('|', {", ".join(stratum)}) AS stratum
+            FROM metrics
+            WHERE service = $1
+            AND timestamp >= NOW() - $2
+        ),
+        ranked AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY stratum ORDER BY random()) AS stratum_rank
+            FROM windowed
+        )
+        SELECT
+            id, service, trace_id, method, path, timestamp, response_time_ms, status_code,
+            request_count, error_count, response_size_bytes, created_at
+        FROM (
+            -- Round-robin over strata: every stratum's 1st row, then every 2nd row...
+            SELECT * FROM ranked
+            ORDER BY stratum_rank, random()
+            LIMIT $4
+        ) sampled
+        ORDER BY timestamp DESC
+        """
+
+def sampled_statement(by_path: bool, by_status: bool) -> str:
+    """Name of the stratified-sample statement for these strata"""
+    return f"metrics_sampled{'_path' * by_path}{'_status' * by_status}"
+
+# Hot read statements: name -> (argument types, query with $n placeholders).
+# Each is prepared once per pooled connection and then run with EXECUTE, so
+# repeated calls skip parsing and planning
+STATEMENTS: Dict[str, Tuple[str, str]] = {
+    "metrics_by_service": ("text, interval", f"""
+        SELECT{METRIC_COLUMNS}
+        FROM metrics
+        WHERE service = $1
+        AND timestamp >= NOW() - $2
+        ORDER BY timestamp DESC
+        LIMIT 1000
+        """),
+    # Scheduled detection pages through rows past a (timestamp, id) cursor, oldest
+    # first; without a cursor it starts $4 back
+    "metrics_after": ("text, timestamp, uuid, interval", f"""
+        SELECT{METRIC_COLUMNS}
+        FROM metrics
+        WHERE service = $1
+        AND timestamp >= COALESCE($2, NOW()::timestamp - $4)
+        AND (timestamp, id) > (
+            COALESCE($2, NOW()::timestamp - $4),
+            COALESCE($3, '00000000-0000-0000-0000-000000000000'::uuid)
+        )
+        ORDER BY timestamp ASC, id ASC
+        LIMIT {DETECTION_PAGE_ROWS}
+        """),
+    # ...and re-reads the rows just behind the cursor, for those inserted late
+    "metrics_overlap": ("text, timestamp, timestamp, uuid", f"""
+        SELECT{METRIC_COLUMNS}
+        FROM metrics
+        WHERE service = $1
+        AND timestamp > $2
+        AND (timestamp, id) <= ($3, $4)
+        ORDER BY timestamp ASC, id ASC
+        LIMIT {DETECTION_PAGE_ROWS}
+        """),
+    "events_by_trace": ("uuid", f"""
+        SELECT{METRIC_COLUMNS}
+        FROM metrics
+        WHERE "traceId" = $1
+        ORDER BY timestamp ASC
+        """),
+    "services_24h": ("", """
+        SELECT DISTINCT service
+        FROM metrics
+        WHERE timestamp >= NOW() - INTERVAL '24 hours'
+        ORDER BY service
+        """),
+    **{
+        sampled_statement(by_path, by_status): (
+            "text, interval, integer, integer", _sampled_query(by_path, by_status)
+        )
+        for by_path in (False, True)
+        for by_status in (False, True)
+    }
+}
+
 class Database:
     def __init__(self):
-        self.connection = None
-        self.cursor = None
+        # Scheduler workers, API requests and the stream consumer each borrow
+        # their own connection, so queries no longer queue behind one cursor
+        self.pool = None
+        # ThreadedConnectionPool raises when exhausted; callers wait here instead
+        self._slots = threading.BoundedSemaphore(settings.DB_POOL_SIZE)
+        self.prepare_enabled = settings.DB_PREPARED_STATEMENTS
+        # Statements prepared on each live connection (forgotten with the connection)
+        self._prepared: "weakref.WeakKeyDictionary[Any, set]" = weakref.WeakKeyDictionary()
+        self._stats_lock = threading.Lock()
+        self.query_stats: Dict[str, Dict[str, Any]] = {}
 
     def connect(self):
         """
         Connect to PostgreSQL database.
         """
+        # psycopg2 loads with the first connection, not at import
+        from psycopg2.pool import ThreadedConnectionPool
         try:
-            self.connection = psycopg2.connect(
+            self.pool = ThreadedConnectionPool(
+                1, settings.DB_POOL_SIZE,
                 host=settings.DB_HOST,
                 port=settings.DB_PORT,
                 database=settings.DB_NAME,
                 user=settings.DB_USER,
                 password=settings.DB_PASSWORD
             )
-            self.cursor = self.connection.cursor(cursor_factory=RealDictCursor)
-            logger.info(f"✅ Connected to database: {settings.DB_NAME}")
+            logger.info(f"✅ Connected to database: {settings.DB_NAME} (pool of {settings.DB_POOL_SIZE})")
         except Exception as e:
             logger.error(f"Failed to connect to database: {e}")
             raise
@@ -33,37 +157,148 @@ class Database:
         """
         Close database connection.
         """
-        if self.cursor:
-            self.cursor.close()
-        if self.connection:
-            self.connection.close()
+        if self.pool:
+            self.pool.closeall()
         logger.info("Disconnected from database")
 
-    def fetch_recent_metrics(self, minutes: int = 60) -> List[Dict[str, Any]]:
+    @contextmanager
+    def _cursor(self):
+        """Borrow a pooled connection for one statement; broken connections are discarded"""
+        import psycopg2
+        from psycopg2.extras import RealDictCursor
+        self._slots.acquire()
+        try:
+            connection = self.pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        # Without autocommit every query shares one never-ending transaction,
+        # which freezes NOW() and keeps rollup writes uncommitted
+        connection.autocommit = True
+        broken = False
+        try:
+            with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                yield cursor
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.pool.putconn(connection, close=broken or connection.closed != 0)
+            self._slots.release()
+
+    def execute(self, query: str, params: Any = None, fetch: bool = True) -> List[Dict[str, Any]]:
         """
-        Fetch metrics from the last N minutes.
+        Run an arbitrary statement on a pooled connection.
+        Errors are raised to the caller.
         """
-        query = """
-        SELECT
-            id,
-            service,
-            "traceId" as trace_id,
-            method,
-            path,
-            timestamp,
-            "responseTimeMs" as response_time_ms,
-            "statusCode" as status_code,
-            "requestCount" as request_count,
-            "errorCount" as error_count,
-            "responseSizeBytes" as response_size_bytes,
-            "createdAt" as created_at
-        FROM metrics
-        WHERE timestamp >= NOW() - INTERVAL %s
-        ORDER BY timestamp DESC
+        with self._cursor() as cursor:
+            cursor.execute(query, params)
+            if fetch and cursor.description is not None:
+                return cursor.fetchall()
+            return []
+
+    def _ensure_prepared(self, cursor, name: str) -> bool:
+        """PREPARE `name` on the cursor's connection unless already done; False if disabled"""
+        if not self.prepare_enabled:
+            return False
+        with self._stats_lock:
+            prepared = self._prepared.setdefault(cursor.connection, set())
+        if name not in prepared:
+            arg_types, query = STATEMENTS[name]
+            cursor.execute(f"PREPARE {name}{f'({arg_types})' if arg_types else ''} AS {query}")
+            prepared.add(name)
+            self._record(name, prepares=1)
+        return True
+
+    @staticmethod
+    def _statement_sql(name: str, params: Tuple, prepared: bool) -> str:
+        if prepared:
+            return f"EXECUTE {name}({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+        # Same statement sent as plain text, with typed placeholders
+        arg_types, query = STATEMENTS[name]
+        types = [arg.strip() for arg in arg_types.split(",")] if arg_types else []
+        for position in range(len(types), 0, -1):
+            query = query.replace(f"${position}", f"%s::{types[position - 1]}")
+        return query
+
+    def execute_statement(self, name: str, params: Tuple = ()) -> List[Dict[str, Any]]:
         """
+        Run one of the named STATEMENTS on a pooled connection and record its timing.
+        Errors are raised to the caller.
+        """
+        from psycopg2 import errors
+        started = time.perf_counter()
         try:
-            self.cursor.execute(query, (f"{minutes} minutes",))
-            results = self.cursor.fetchall()
+            with self._cursor() as cursor:
+                prepared = self._ensure_prepared(cursor, name)
+                try:
+                    cursor.execute(self._statement_sql(name, params, prepared), params)
+                except errors.InvalidSqlStatementName:
+                    # Dropped server-side (DISCARD ALL, pooler reset): prepare again once
+                    self._prepared.pop(cursor.connection, None)
+                    self._ensure_prepared(cursor, name)
+                    cursor.execute(self._statement_sql(name, params, True), params)
+                rows = cursor.fetchall()
+        except Exception:
+            self._record(name, errors=1)
+            raise
+        self._record(name, seconds=time.perf_counter() - started, rows=len(rows))
+        return rows
+
+    def explain(self, name: str, params: Tuple = (), analyze: bool = False) -> Dict[str, Any]:
+        """
+        EXPLAIN (FORMAT JSON) of a named statement, as prepared on a pooled
+        connection. With `analyze` the statement is run and actual timings included.
+        """
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+        with self._cursor() as cursor:
+            prepared = self._ensure_prepared(cursor, name)
+            cursor.execute(f"EXPLAIN ({options}) {self._statement_sql(name, params, prepared)}", params)
+            row = cursor.fetchone()
+        return next(iter(row.values()))[0]
+
+    def _record(self, name: str, seconds: float = 0.0, rows: int = 0, errors: int = 0, prepares: int = 0):
+        with self._stats_lock:
+            stats = self.query_stats.setdefault(name, {
+                "calls": 0, "rows": 0, "errors": 0, "prepares": 0, "total_ms": 0.0, "max_ms": 0.0
+            })
+            if seconds:
+                stats["calls"] += 1
+                stats["rows"] += rows
+                stats["total_ms"] += seconds * 1000
+                stats["max_ms"] = max(stats["max_ms"], seconds * 1000)
+            stats["errors"] += errors
+            stats["prepares"] += prepares
+
+    def get_query_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-statement call counts and timings since startup"""
+        with self._stats_lock:
+            return {
+                name: {
+                    **stats,
+                    "total_ms": round(stats["total_ms"], 2),
+                    "max_ms": round(stats["max_ms"], 2),
+                    "avg_ms": round(stats["total_ms"] / stats["calls"], 3) if stats["calls"] else None
+                }
+                for name, stats in self.query_stats.items()
+            }
+
+    def fetch_recent_metrics(self, minutes: int = 60, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Fetch metrics from the last N minutes, newest first, up to `limit` rows.
+        Rows come off a server-side cursor, so the driver never buffers more
+        than one chunk; use `stream_metrics` to process wide windows without
+        holding them at all.
+        """
+        try:
+            results = []
+            chunks = self.stream_metrics(minutes=minutes, newest_first=True,
+                                         chunk_size=min(limit, 5000) if limit else 5000)
+            for chunk in chunks:
+                results.extend(chunk[:limit - len(results)] if limit else chunk)
+                if limit and len(results) >= limit:
+                    chunks.close()
+                    break
             logger.debug(f"Fetched {len(results)} metrics from last {minutes} minutes")
             return results
         except Exception as e:
@@ -77,29 +312,8 @@ class Database:
             service: Service name.
             minutes: Time window in minutes (e.g., 60, 360, 1440 for backfill).
         """
-        query = """
-        SELECT
-            id,
-            service,
-            "traceId" as trace_id,
-            method,
-            path,
-            timestamp,
-            "responseTimeMs" as response_time_ms,
-            "statusCode" as status_code,
-            "requestCount" as request_count,
-            "errorCount" as error_count,
-            "responseSizeBytes" as response_size_bytes,
-            "createdAt" as created_at
-        FROM metrics
-        WHERE service = %s
-        AND timestamp >= NOW() - INTERVAL %s
-        ORDER BY timestamp DESC
-        LIMIT 1000
-        """
         try:
-            self.cursor.execute(query, (service, f"{minutes} minutes"))
-            results = self.cursor.fetchall()
+            results = self.execute_statement("metrics_by_service", (service, f"{minutes} minutes"))
             if minutes > 60:
                 logger.info(f"📊 Backfill: Fetched {len(results)} metrics for {service} from last {minutes//60}h")
             else:
@@ -109,19 +323,153 @@ class Database:
             logger.error(f"Failed to fetch metrics for {service}: {e}")
             return []
 
-    def get_all_services(self) -> List[str]:
+    def fetch_metrics_after(self, service: str, cursor: Optional[Tuple[datetime, str]],
+                            seconds: float) -> List[Dict[str, Any]]:
         """
-        Get list of all unique services.
+        Fetch the next page of metrics past a (timestamp, id) cursor, oldest first.
+        Args:
+            service: Service name.
+            cursor: Last row of the previous page (None starts `seconds` ago).
+            seconds: Look-back without a cursor.
         """
-        query = """
-        SELECT DISTINCT service
+        timestamp, metric_id = cursor if cursor else (None, None)
+        try:
+            results = self.execute_statement(
+                "metrics_after", (service, timestamp, metric_id, f"{seconds} seconds")
+            )
+            logger.debug(f"Fetched {len(results)} metrics for {service} after {timestamp}")
+            return results
+        except Exception as e:
+            logger.error(f"Failed to fetch metrics for {service}: {e}")
+            return []
+
+    def fetch_metrics_overlap(self, service: str, since: datetime,
+                              cursor: Tuple[datetime, str]) -> List[Dict[str, Any]]:
+        """Fetch metrics newer than `since` up to and including the cursor row, oldest first"""
+        try:
+            return self.execute_statement("metrics_overlap", (service, since) + tuple(cursor))
+        except Exception as e:
+            logger.error(f"Failed to fetch metrics for {service}: {e}")
+            return []
+
+    def fetch_metrics_sampled(self, service: str, minutes: int = 60, limit: int = 1000,
+                              buckets: int = 24, by_path: bool = False,
+                              by_status: bool = False) -> List[Dict[str, Any]]:
+        """
+        Fetch a bounded sample spread evenly over the window instead of the newest rows.
+        Rows are split into strata (time bucket, optionally path and status class)
+        and taken round-robin, so each stratum gets an equal share of the limit
+        and sparse strata hand their unused share to the others.
+        Args:
+            service: Service name.
+            minutes: Time window in minutes.
+            limit: Upper bound on returned rows.
+            buckets: Number of equal time buckets the window is cut into.
+            by_path: Also stratify by path.
+            by_status: Also stratify by status class (2xx, 4xx, 5xx...).
+        """
+        name = sampled_statement(by_path, by_status)
+        params = (service, f"{minutes} minutes", max(minutes * 60 // buckets, 1), limit)
+        try:
+            results = self.execute_statement(name, params)
+            logger.debug(f"Sampled {len(results)} metrics for {service} from last {minutes} minutes")
+            return results
+        except Exception as e:
+            logger.error(f"Failed to sample metrics for {service}: {e}")
+            return []
+
+    def stream(self, query: str, params: Any = None, chunk_size: int = 5000,
+               columns: bool = False) -> Iterator[Any]:
+        """
+        Run a query through a server-side (named) cursor and yield its result
+        `chunk_size` rows at a time, so memory stays flat however many rows
+        match and work can start before the query has finished.
+        Chunks are lists of dicts, or with `columns` a dict of NumPy arrays
+        (one per column, timestamps as datetime64[us]).
+        The pooled connection is held until the generator is exhausted or closed.
+        Errors are raised to the caller.
+        """
+        import psycopg2
+        from psycopg2.extras import RealDictCursor
+        self._slots.acquire()
+        try:
+            connection = self.pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        # Named cursors only live inside a transaction
+        connection.autocommit = False
+        broken = False
+        try:
+            factory = None if columns else RealDictCursor
+            with connection.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=factory) as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    if columns:
+                        names = [column.name for column in cursor.description]
+                        yield {name: self._column_array(values) for name, values in zip(names, zip(*rows))}
+                    else:
+                        yield rows
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            # Read-only transaction; also ends it when the consumer stops early
+            if not broken and connection.closed == 0:
+                connection.rollback()
+            self.pool.putconn(connection, close=broken or connection.closed != 0)
+            self._slots.release()
+
+    @staticmethod
+    def _column_array(values: Tuple[Any, ...]) -> np.ndarray:
+        if values and isinstance(values[0], datetime):
+            return np.array(values, dtype="datetime64[us]")
+        return np.asarray(values)
+
+    def stream_metrics(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                       services: Optional[List[str]] = None, minutes: Optional[int] = None,
+                       chunk_size: int = 5000, columns: bool = False,
+                       newest_first: bool = False) -> Iterator[Any]:
+        """
+        Stream metrics in timestamp order (see `stream` for the chunk format).
+        Args:
+            start: Inclusive lower bound on timestamp.
+            end: Exclusive upper bound on timestamp.
+            services: Only these services when given.
+            minutes: Only the last N minutes (relative to the database clock).
+            newest_first: Descending instead of ascending timestamps.
+        """
+        conditions, params = [], {}
+        if start is not None:
+            conditions.append("timestamp >= %(start)s")
+            params["start"] = start
+        if end is not None:
+            conditions.append("timestamp < %(end)s")
+            params["end"] = end
+        if minutes is not None:
+            conditions.append("timestamp >= NOW() - %(window)s::interval")
+            params["window"] = f"{minutes} minutes"
+        if services:
+            conditions.append("service = ANY(%(services)s)")
+            params["services"] = list(services)
+        query = f"""
+        SELECT{METRIC_COLUMNS}
         FROM metrics
-        WHERE timestamp >= NOW() - INTERVAL '24 hours'
-        ORDER BY service
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY timestamp {"DESC" if newest_first else "ASC"}
+        """
+        return self.stream(query, params, chunk_size, columns)
+
+    def get_all_services(self) -> List[str]:
+        """
+        Get list of all unique services.
         """
         try:
-            self.cursor.execute(query)
-            results = self.cursor.fetchall()
+            results = self.execute_statement("services_24h")
             # Filter out legacy "api"
             services = [row['service'] for row in results if row['service'] != 'api']
             logger.debug(f"Found {len(services)} services")
@@ -138,27 +486,8 @@ class Database:
         Returns:
             List of event/metric dicts ordered by timestamp asc.
         """
-        query = """
-        SELECT
-            id,
-            service,
-            "traceId" as trace_id,
-            method,
-            path,
-            timestamp,
-            "responseTimeMs" as response_time_ms,
-            "statusCode" as status_code,
-            "requestCount" as request_count,
-            "errorCount" as error_count,
-            "responseSizeBytes" as response_size_bytes,
-            "createdAt" as created_at
-        FROM metrics
-        WHERE "traceId" = %s
-        ORDER BY timestamp ASC
-        """
         try:
-            self.cursor.execute(query, (trace_id,))
-            results = self.cursor.fetchall()
+            results = self.execute_statement("events_by_trace", (trace_id,))
             logger.debug(f"Fetched {len(results)} events for trace_id={trace_id}")
             return results
         except Exception as e:
@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from datetime import timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from app.services.database import db
+from app.services.rollups import FEATURE_SOURCES
+from app.utils.sampling import stratified_sample
+from app.models.endpoint_registry import endpoint_key, MAX_KEY_LENGTH
+from app.models.feature_pipeline import FeaturePipeline, DERIVED_FEATURES
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+FEATURE_COLUMNS = list(FEATURE_SOURCES)
+
+SEGMENT_DTYPE = np.dtype(
+    [('timestamp', 'f8'), ('id', 'S36'), ('endpoint', f'S{MAX_KEY_LENGTH}')]
+    + [(name, 'f8') for name in FEATURE_COLUMNS + DERIVED_FEATURES]
+)
+
+# Bumped whenever SEGMENT_DTYPE or the window features change; older caches are dropped and refilled
+SCHEMA_VERSION = 3
+
+PARTITION_SECONDS = 3600
+
+def _epoch(ts) -> float:
+    """Naive DB timestamps are compared as-is, so treat them as UTC consistently"""
+    return ts.replace(tzinfo=timezone.utc).timestamp() if ts.tzinfo is None else ts.timestamp()
+
+class FeatureStore:
+    """
+    Local, append-only cache of training features per service.
+
+    Layout: <root>/<service>/<partition hour>/<segment>.npy plus a watermark file.
+    Rows keep the endpoint key ('GET /orders/:id') so per-endpoint models can
+    be trained from the cache, and their rolling-window features, computed
+    once at append time over the full stream so sampled training sets still
+    see true request rates.
+    Each sync appends new rows past the watermark as fresh segments; reads
+    memory-map the segments overlapping a window, so training never re-runs
+    the same query against Postgres.
+    """
+
+    def __init__(self, root: str = "feature_store"):
+        self.enabled = settings.FEATURE_STORE_ENABLED
+        self.root = Path(root)
+        self.retention_seconds = settings.FEATURE_STORE_RETENTION_HOURS * 3600
+        self.lag_seconds = settings.FEATURE_STORE_LAG_SECONDS
+        self._watermarks: Dict[str, Dict[str, Any]] = {}
+        self._pipelines: Dict[str, FeaturePipeline] = {}
+
+    def _service_dir(self, service: str) -> Path:
+        return self.root / service
+
+    def _load_watermark(self, service: str) -> Optional[Dict[str, Any]]:
+        if service not in self._watermarks:
+            path = self._service_dir(service) / "watermark.json"
+            if path.exists():
+                with open(path, 'r') as f:
+                    state = json.load(f)
+                if state.get("schema") != SCHEMA_VERSION or state.get("window") != self._window_config():
+                    logger.info(f"Feature store for {service} has an old layout, rebuilding")
+                    shutil.rmtree(self._service_dir(service), ignore_errors=True)
+                    return None
+                self._watermarks[service] = state
+        return self._watermarks.get(service)
+
+    def _save_watermark(self, service: str, upper, now_epoch: float):
+        state = {
+            "upper": upper.isoformat(),
+            "now": now_epoch,
+            "schema": SCHEMA_VERSION,
+            "window": self._window_config()
+        }
+        path = self._service_dir(service) / "watermark.json"
+        # Directories are created on first write, not at import
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+        self._watermarks[service] = state
+
+    def sync(self, service: str) -> int:
+        """
+        Append rows newer than the watermark.
+        Rows younger than FEATURE_STORE_LAG_SECONDS are left for the next sync
+        so late inserts are not skipped.
+        """
+        if not self.enabled:
+            return 0
+        state = self._load_watermark(service)
+        columns = ",\n            ".join(f"{source} AS {name}" for name, source in FEATURE_SOURCES.items())
+        query = f"""
+        WITH bounds AS (
+            SELECT
+                (NOW() - %(lag)s::interval)::timestamp AS upper,
+                COALESCE(%(since)s::timestamp, (NOW() - %(retention)s::interval)::timestamp) AS lower
+        )
+        SELECT
+            id::text AS id,
+            timestamp,
+            method,
+            path,
+            {columns},
+            bounds.upper AS upper
+        FROM bounds
+        LEFT JOIN metrics ON service = %(service)s
+            AND timestamp > bounds.lower
+            AND timestamp <= bounds.upper
+        ORDER BY timestamp ASC
+        """
+        params = {
+            "service": service,
+            "since": state["upper"] if state else None,
+            "lag": f"{self.lag_seconds} seconds",
+            "retention": f"{self.retention_seconds} seconds"
+        }
+        # Streamed in chunks so a first sync over the whole retention window stays bounded
+        upper = resume = None
+        appended = 0
+        try:
+            for chunk in db.stream(query, params, chunk_size=settings.FEATURE_STORE_CHUNK_SIZE):
+                upper = chunk[0]['upper']
+                rows = [row for row in chunk if row['id'] is not None]
+                if rows:
+                    self._append(service, rows)
+                    appended += len(rows)
+                    resume = rows[-1]['timestamp']
+        except Exception as e:
+            logger.error(f"Feature store sync failed for {service}: {e}")
+            if resume is None:
+                return 0
+            # Keep what was written; the next sync resumes after it
+            upper = resume
+        if upper is None:
+            return 0
+
+        self._save_watermark(service, upper, _epoch(upper))
+        self.prune(service)
+        self._compact(service)
+        if appended:
+            logger.debug(f"Feature store: appended {appended} rows for {service}")
+        return appended
+
+    @staticmethod
+    def _window_config() -> List[int]:
+        return [settings.FEATURE_WINDOW_SECONDS, settings.FEATURE_WINDOW_SLOTS]
+
+    def _pipeline(self, service: str) -> FeaturePipeline:
+        """Window state for a service, warmed up from the tail of the cache after a restart"""
+        pipeline = self._pipelines.get(service)
+        if pipeline is None:
+            pipeline = self._pipelines[service] = FeaturePipeline(
+                window_seconds=settings.FEATURE_WINDOW_SECONDS,
+                slots=settings.FEATURE_WINDOW_SLOTS,
+                cache_size=0
+            )
+            tail = self.read_window(service, settings.FEATURE_WINDOW_SECONDS // 60 + 1)
+            for row in tail:
+                pipeline.derive(
+                    row['endpoint'].decode(), float(row['timestamp']), row['response_time_ms'],
+                    int(row['status_code']), int(row['error_count'])
+                )
+        return pipeline
+
+    def _append(self, service: str, rows: List[Dict[str, Any]]):
+        """Write rows as new segments, one per hour partition"""
+        keys = [endpoint_key(row['method'], row['path']) for row in rows]
+        batch = np.empty(len(rows), dtype=SEGMENT_DTYPE)
+        batch['timestamp'] = [_epoch(row['timestamp']) for row in rows]
+        batch['id'] = [row['id'].encode() for row in rows]
+        batch['endpoint'] = [key.encode('ascii', 'ignore') for key in keys]
+        for name in FEATURE_COLUMNS:
+            batch[name] = [row[name] for row in rows]
+        derived = self._pipeline(service).transform(rows, keys)
+        for idx, name in enumerate(DERIVED_FEATURES):
+            batch[name] = derived[:, idx]
+
+        partitions = (batch['timestamp'] // PARTITION_SECONDS).astype(np.int64)
+        for partition in np.unique(partitions):
+            segment = batch[partitions == partition]
+            directory = self._service_dir(service) / str(partition)
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"{int(segment['timestamp'][0] * 1e6)}_{len(segment)}.npy"
+            tmp = directory / f".{path.name}.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, segment)
+            os.replace(tmp, path)
+
+    def prune(self, service: str):
+        """Delete hour partitions past the retention window"""
+        state = self._load_watermark(service)
+        if not state:
+            return
+        oldest = (state["now"] - self.retention_seconds) // PARTITION_SECONDS
+        for directory in self._service_dir(service).iterdir():
+            if directory.is_dir() and directory.name.isdigit() and int(directory.name) < oldest:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def _compact(self, service: str):
+        """Merge the segments of closed hour partitions into a single file"""
+        current = int(self._load_watermark(service)["now"] // PARTITION_SECONDS)
+        for directory in self._service_dir(service).iterdir():
+            if not (directory.is_dir() and directory.name.isdigit()) or int(directory.name) >= current:
+                continue
+            paths = sorted(directory.glob("*.npy"))
+            if len(paths) < 2:
+                continue
+            merged = np.concatenate([np.load(path) for path in paths])
+            merged = merged[np.argsort(merged['timestamp'], kind='stable')]
+            target = directory / f"{int(merged['timestamp'][0] * 1e6)}_{len(merged)}.npy"
+            tmp = directory / f".{target.name}.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, merged)
+            os.replace(tmp, target)
+            for path in paths:
+                if path != target:
+                    path.unlink()
+
+    def read_window(self, service: str, minutes: int, limit: Optional[int] = None) -> np.ndarray:
+        """
+        Rows of the last `minutes` (relative to the last sync), oldest first.
+        With `limit`, only the newest rows are kept.
+        """
+        state = self._load_watermark(service)
+        if not state:
+            return np.empty(0, dtype=SEGMENT_DTYPE)
+        start = state["now"] - minutes * 60
+        first_partition = int(start // PARTITION_SECONDS)
+        segments = []
+        for directory in sorted(self._service_dir(service).iterdir(), key=lambda d: d.name):
+            if not (directory.is_dir() and directory.name.isdigit()) or int(directory.name) < first_partition:
+                continue
+            for path in sorted(directory.glob("*.npy")):
+                segment = np.load(path, mmap_mode='r')
+                segments.append(segment[segment['timestamp'] >= start])
+        if not segments:
+            return np.empty(0, dtype=SEGMENT_DTYPE)
+        window = np.concatenate(segments)
+        window = window[np.argsort(window['timestamp'], kind='stable')]
+        if limit and len(window) > limit:
+            window = window[-limit:]
+        return window
+
+    def read_training_window(self, service: str, windows: List[int], min_samples: int,
+                             limit: Optional[int] = None, buckets: Optional[int] = None,
+                             by_path: bool = False, by_status: bool = False) -> Tuple[np.ndarray, int]:
+        """
+        Smallest of `windows` (minutes) holding at least `min_samples` rows,
+        read with a single pass over the widest window.
+        With `buckets`, rows over `limit` are sampled evenly across time buckets
+        (and endpoints with `by_path`, status classes with `by_status`);
+        otherwise the newest rows are kept.
+        Returns:
+            (rows, window in minutes)
+        """
+        rows = self.read_window(service, max(windows))
+        if not len(rows):
+            return rows, max(windows)
+        now = self._load_watermark(service)["now"]
+        for window in sorted(windows):
+            start = np.searchsorted(rows['timestamp'], now - window * 60, side='left')
+            if len(rows) - start >= min_samples or window == max(windows):
+                selected = rows[start:]
+                if limit and len(selected) > limit:
+                    if buckets:
+                        bucket_seconds = max(window * 60 // buckets, 1)
+                        strata = (selected['timestamp'] // bucket_seconds).astype(np.int64) * 10
+                        if by_status:
+                            strata += (selected['status_code'] // 100).astype(np.int64)
+                        if by_path:
+                            # Endpoint key ('GET /orders/:id') folded in as a factorized code
+                            _, endpoints = np.unique(selected['endpoint'], return_inverse=True)
+                            strata = strata * (int(endpoints.max()) + 1) + endpoints.ravel()
+                        selected = selected[stratified_sample(strata, limit)]
+                    else:
+                        selected = selected[-limit:]
+                return selected, window
+
+# Singleton instance
+feature_store = FeatureStore()
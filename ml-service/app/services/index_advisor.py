@@ -0,0 +1,157 @@
+import logging
+from typing import Dict, Any, List, Optional
+from app.services.database import db, sampled_statement
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Columns the hot per-service reads select, so the advised index can answer them
+# with an index-only scan
+COVERED_COLUMNS = [
+    "id", "traceId", "method", "path", "responseTimeMs", "statusCode",
+    "requestCount", "errorCount", "responseSizeBytes", "createdAt"
+]
+
+class IndexAdvisor:
+    """
+    Checks the metrics table for an index that serves the per-service window
+    reads (`WHERE service = ? AND timestamp >= ? ORDER BY timestamp DESC`)
+    and proposes, or creates, a composite (service, timestamp DESC) index that
+    also covers the feature columns.
+
+    The single-column indexes declared on the consumer's Metric entity make
+    Postgres pick one of them and filter or sort the rest. The covering index
+    is created CONCURRENTLY, so writers are not blocked while it builds.
+    """
+
+    INDEX_NAME = "idx_metrics_service_timestamp_covering"
+
+    def indexes(self) -> List[Dict[str, Any]]:
+        """Indexes on metrics with their key and INCLUDE columns"""
+        return db.execute("""
+        SELECT
+            i.relname AS name,
+            ix.indisvalid AS valid,
+            ARRAY(
+                SELECT a.attname FROM unnest((ix.indkey::int2[])[0:ix.indnkeyatts - 1])
+                    WITH ORDINALITY k(attnum, ord)
+                JOIN pg_attribute a ON a.attrelid = ix.indrelid AND a.attnum = k.attnum
+                ORDER BY k.ord
+            ) AS key_columns,
+            ARRAY(
+                SELECT a.attname FROM unnest((ix.indkey::int2[])[ix.indnkeyatts:])
+                    WITH ORDINALITY k(attnum, ord)
+                JOIN pg_attribute a ON a.attrelid = ix.indrelid AND a.attnum = k.attnum
+                ORDER BY k.ord
+            ) AS include_columns,
+            pg_relation_size(ix.indexrelid) AS size_bytes,
+            pg_get_indexdef(ix.indexrelid) AS definition
+        FROM pg_index ix
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        WHERE ix.indrelid = 'metrics'::regclass
+        ORDER BY i.relname
+        """)
+
+    def recommendation(self) -> str:
+        """DDL for the advised index"""
+        include = ", ".join(f'"{column}"' for column in COVERED_COLUMNS)
+        return (
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.INDEX_NAME} "
+            f"ON metrics (service, timestamp DESC) INCLUDE ({include})"
+        )
+
+    def check(self) -> Dict[str, Any]:
+        """Whether a valid (service, timestamp) index exists and whether it covers the feature columns"""
+        try:
+            indexes = self.indexes()
+        except Exception as e:
+            logger.error(f"Index check failed: {e}")
+            return {"error": str(e)}
+        composite: Optional[Dict[str, Any]] = None
+        for index in indexes:
+            if index["valid"] and index["key_columns"][:2] == ["service", "timestamp"]:
+                columns = set(index["key_columns"]) | set(index["include_columns"])
+                index["covering"] = set(COVERED_COLUMNS) <= columns
+                # Prefer a covering match when there are several
+                if composite is None or (index["covering"] and not composite["covering"]):
+                    composite = index
+        return {
+            "indexes": indexes,
+            "composite_index": composite["name"] if composite else None,
+            "covering": bool(composite and composite["covering"]),
+            "recommendation": None if composite and composite["covering"] else self.recommendation()
+        }
+
+    def apply(self) -> bool:
+        """Create the advised index if no covering (service, timestamp) index exists"""
+        report = self.check()
+        if "error" in report:
+            return False
+        if report["covering"]:
+            return True
+        try:
+            # A failed concurrent build leaves an invalid index that IF NOT EXISTS would keep
+            if any(index["name"] == self.INDEX_NAME and not index["valid"] for index in report["indexes"]):
+                db.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {self.INDEX_NAME}", fetch=False)
+            logger.info(f"🗂️  Creating index {self.INDEX_NAME} (concurrently)...")
+            db.execute(self.recommendation(), fetch=False)
+            logger.info(f"✅ Created index {self.INDEX_NAME}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to create index {self.INDEX_NAME}: {e}")
+            return False
+
+    def startup(self):
+        """Apply the advice when enabled, otherwise warn when the index is missing"""
+        if settings.DB_APPLY_INDEX_ADVICE:
+            self.apply()
+            return
+        report = self.check()
+        if report.get("recommendation"):
+            logger.warning(f"⚠️  metrics has no covering (service, timestamp) index; advised: {report['recommendation']}")
+
+    def explain(self, service: str, trace_id: Optional[str] = None,
+                minutes: int = 60, analyze: bool = False) -> Dict[str, Any]:
+        """EXPLAIN plans of the hot statements for one service (and trace, when given)"""
+        buckets = settings.TRAINING_SAMPLE_BUCKETS
+        statements = {
+            "metrics_by_service": (service, f"{minutes} minutes"),
+            "metrics_after": (service, None, None, f"{settings.SCHEDULER_BASE_INTERVAL_SECONDS} seconds"),
+            sampled_statement(settings.TRAINING_STRATIFY_BY_PATH, settings.TRAINING_STRATIFY_BY_STATUS): (
+                service, f"{settings.TRAINING_WINDOW_MINUTES} minutes",
+                max(settings.TRAINING_WINDOW_MINUTES * 60 // buckets, 1), settings.TRAINING_MAX_SAMPLES
+            ),
+            "services_24h": ()
+        }
+        if trace_id:
+            statements["events_by_trace"] = (trace_id,)
+        plans = {}
+        for name, params in statements.items():
+            try:
+                plans[name] = self._summarize(db.explain(name, params, analyze))
+            except Exception as e:
+                plans[name] = {"error": str(e)}
+        return plans
+
+    @staticmethod
+    def _summarize(explained: Dict[str, Any]) -> Dict[str, Any]:
+        """Scan nodes and indexes used, cost and (with ANALYZE) timings, plus the full plan"""
+        nodes, stack = [], [explained["Plan"]]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.get("Plans", []))
+        return {
+            "scans": [
+                {key: node[key] for key in ("Node Type", "Index Name", "Index Cond", "Filter") if key in node}
+                for node in nodes if "Relation Name" in node
+            ],
+            "sorts": sum(1 for node in nodes if node["Node Type"] in ("Sort", "Incremental Sort")),
+            "total_cost": explained["Plan"]["Total Cost"],
+            "planning_ms": explained.get("Planning Time"),
+            "execution_ms": explained.get("Execution Time"),
+            "plan": explained["Plan"]
+        }
+
+# Singleton instance
+index_advisor = IndexAdvisor()
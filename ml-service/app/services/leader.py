@@ -0,0 +1,104 @@
+import os
+import logging
+import threading
+from typing import Callable, Optional
+from app.config.settings import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+class LeaderElection:
+    """
+    Elects a single leader among the uvicorn workers of one host through an
+    exclusive file lock. The OS drops the lock when the leader process dies,
+    so a follower polling the lock takes over without any cleanup.
+    """
+
+    def __init__(self, lock_file: str, poll_seconds: int = 15):
+        self.lock_file = lock_file
+        self.poll_seconds = poll_seconds
+        self.is_leader = False
+        self._fd: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def try_acquire(self) -> bool:
+        """Try to take the lock without blocking"""
+        if self.is_leader:
+            return True
+        if self._fd is None:
+            directory = os.path.dirname(self.lock_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        os.ftruncate(self._fd, 0)
+        os.write(self._fd, str(os.getpid()).encode())
+        self.is_leader = True
+        logger.info(f"👑 Worker {os.getpid()} elected scheduler leader")
+        return True
+
+    def follow(self, on_elected: Callable[[], None], on_tick: Optional[Callable[[], None]] = None,
+               on_failed: Optional[Callable[[], None]] = None):
+        """
+        Poll in the background until elected; run `on_tick` on every poll.
+        If `on_elected` raises, `on_failed` undoes what it started and the
+        lock is released, so another worker (or this one, next poll) can lead.
+        """
+        def run():
+            while not self._stop.wait(self.poll_seconds):
+                if on_tick:
+                    try:
+                        on_tick()
+                    except Exception as e:
+                        logger.error(f"Follower sync failed: {e}")
+                if not self.try_acquire():
+                    continue
+                try:
+                    on_elected()
+                    return
+                except Exception as e:
+                    logger.error(f"❌ Worker {os.getpid()} failed to take over leader duties: {e}")
+                if on_failed:
+                    try:
+                        on_failed()
+                    except Exception as e:
+                        logger.error(f"Cleanup after failed takeover failed: {e}")
+                self._unlock()
+
+        self._thread = threading.Thread(target=run, name="leader-election", daemon=True)
+        self._thread.start()
+        logger.info(f"Worker {os.getpid()} running as follower (API reads only)")
+
+    def release(self):
+        """Stop polling and give up the lock"""
+        self._stop.set()
+        self._unlock()
+
+    def _unlock(self):
+        """Give up the lock (closing the descriptor drops it)"""
+        if self._fd is not None:
+            try:
+                if self.is_leader and fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                elif self.is_leader:
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        self.is_leader = False
+
+# Singleton instance
+leader_election = LeaderElection(settings.LEADER_LOCK_FILE, settings.LEADER_POLL_SECONDS)
@@ -1,11 +1,19 @@
 import logging
-from typing import List, Dict, Any
-from datetime import datetime
+from typing import List, Dict, Any, Iterator, Tuple, Optional, Callable
+from datetime import datetime, timedelta
 
-from app.models.anomaly_detector import detector
-from app.models.statistical_detector import statistical_detector
-from app.services.database import db
+from app.models.anomaly_detector import AnomalyDetector, detector
+from app.models.statistical_detector import StatisticalDetector, statistical_detector
+from app.models.records import AnomalyRecord
+from app.services.database import db, DETECTION_PAGE_ROWS
+from app.services.model_storage import model_storage
 from app.services.rabbitmq import rabbitmq_publisher
+from app.services.sharding import shard_ring
+from app.services.rollups import rollup_store
+from app.services.seasonal_baselines import seasonal_baselines
+from app.services.feature_store import feature_store
+from app.services.service_catalog import service_catalog
+from app.services.correlation import correlation_engine
 from app.config.settings import settings
 
 # IMPORT ROOT CAUSE ANALYZER
@@ -13,24 +21,158 @@ from app.models.root_cause_analyzer import RootCauseAnalyzer
 
 logger = logging.getLogger(__name__)
 
+# Look-back of API detection reads (scheduled runs read past a per-service cursor)
+DETECTION_WINDOW_MINUTES = 5
+
+# Pages a scheduled run scores before leaving the rest of a backlog to the next run
+DETECTION_MAX_PAGES = 10
+
 class MLService:
-    def __init__(self):
+    def __init__(self, database=db, publisher=rabbitmq_publisher,
+                 anomaly_detector: Optional[AnomalyDetector] = None,
+                 stat_detector: Optional[StatisticalDetector] = None,
+                 ring=shard_ring, rollups=rollup_store, seasonal=seasonal_baselines,
+                 store=feature_store, catalog=service_catalog, correlation=correlation_engine,
+                 persist_models: bool = True,
+                 clock: Callable[[], datetime] = datetime.now):
+        """
+        Dependencies default to the service singletons. The replay engine passes
+        an in-memory metrics source, no publisher, no rollups/seasonal/feature
+        stores (None disables them), no service catalog (services then come
+        straight from the metrics source), no correlation engine and a
+        simulated clock.
+        """
+        self.db = database
+        self.publisher = publisher
+        self.detector = anomaly_detector or detector
+        self.statistical_detector = stat_detector or statistical_detector
+        self.shard_ring = ring
+        self.rollups = rollups
+        self.seasonal = seasonal
+        self.feature_store = store
+        self.catalog = catalog
+        self.correlation = correlation
+        self.persist_models = persist_models
+        self.clock = clock
         self.last_check = {}
         self.detection_mode = {} # Track detection mode per service
+        # (timestamp, id) of the last metric scored by a publishing run, per service
+        self.detect_watermarks: Dict[str, Tuple[datetime, str]] = {}
+        # metric_id -> timestamp of alerts already published, per service (rows in the overlap are re-read)
+        self.published: Dict[str, Dict[Any, datetime]] = {}
+
+    @staticmethod
+    def _enabled(component) -> bool:
+        """Optional stores can be left out (None) or switch themselves off at runtime"""
+        return component is not None and component.enabled
 
-    def initialize(self):
-        """Load saved models at startup"""
+    def _services(self) -> List[str]:
+        """Services with metrics in the last 24 hours"""
+        return self.catalog.services() if self.catalog is not None else self.db.get_all_services()
+
+    def initialize(self, load_sklearn: bool = True):
+        """
+        Load saved models at startup. Followers pass `load_sklearn=False` and
+        serve from the shared compiled forests; the leader loads the sklearn
+        models too (called again on takeover).
+        """
         logger.info("Initializing ML service...")
-        detector.load_saved_models()
+        self.detector.load_sklearn = load_sklearn
+        self.detector.load_saved_models(service_filter=self.shard_ring.owns)
+        # Seasonal baselines and incidents as last saved by the leader (which then keeps going from there)
+        if self.seasonal:
+            self.seasonal.load()
+        if self._enabled(self.correlation):
+            self.correlation.load()
         # Set initial detection modes
-        for service in detector.get_trained_services():
+        for service in self.detector.get_trained_services():
             self.detection_mode[service] = "ml"
             logger.info(f"✅ {service}: ML mode (model loaded)")
 
+    def sync_models(self):
+        """Pick up models, seasonal baselines and incidents saved by the leader worker (followers only)"""
+        for service in self.detector.sync_saved_models(service_filter=self.shard_ring.owns):
+            self.detection_mode[service] = "ml"
+        if self.seasonal:
+            self.seasonal.load()
+        if self._enabled(self.correlation):
+            self.correlation.load()
+
+    def refresh_rollups(self):
+        """Bring the per-minute rollups up to date for the services this replica owns"""
+        if not self._enabled(self.rollups):
+            return
+        if self.rollups.refresh(self.shard_ring.filter(self._services())) and self.seasonal:
+            self.seasonal.refresh()
+
+    def refresh_correlation(self):
+        """Re-aggregate the correlation ring and publish a new snapshot for the alert path"""
+        if self._enabled(self.correlation):
+            self.correlation.refresh()
+
+    def rollback_model(self, service: str, version: str = None) -> Optional[str]:
+        """
+        Activate a retained model version (the previous one by default) and load it.
+        Leader only: followers pick the change up on their next sync_models tick.
+        """
+        if version:
+            activated = version if model_storage.activate(service, version) else None
+        else:
+            activated = model_storage.rollback(service)
+        if activated:
+            self.detector.challengers.pop(service, None)
+        if activated and self.detector.reload_model(service):
+            self.detection_mode[service] = "ml"
+        return activated
+
+    def _fetch_training_window(self, service: str) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Fetch training rows, widening the window (6h, 24h backfill) while too sparse.
+        In "stratified" sampling mode rows are spread over the whole window
+        rather than being the newest burst.
+        The local feature store is tried first; otherwise rollup counts pick
+        the window up front so only one raw fetch is made.
+        Returns:
+            (metrics, window in minutes)
+        """
+        windows = [settings.TRAINING_WINDOW_MINUTES, 360, 1440]
+        stratified = settings.TRAINING_SAMPLING_MODE == "stratified"
+        if self._enabled(self.feature_store):
+            self.feature_store.sync(service)
+            rows, window = self.feature_store.read_training_window(
+                service, windows, settings.MIN_SAMPLES, limit=settings.TRAINING_MAX_SAMPLES,
+                buckets=settings.TRAINING_SAMPLE_BUCKETS if stratified else None,
+                by_path=settings.TRAINING_STRATIFY_BY_PATH,
+                by_status=settings.TRAINING_STRATIFY_BY_STATUS
+            )
+            if len(rows):
+                return rows, window
+        if self._enabled(self.rollups):
+            counts = self.rollups.sample_counts(service, windows)
+            if counts:
+                windows = [next((w for w in windows if counts[w] >= settings.MIN_SAMPLES), windows[-1])]
+
+        metrics: List[Dict[str, Any]] = []
+        for idx, window in enumerate(windows):
+            if stratified:
+                metrics = self.db.fetch_metrics_sampled(
+                    service, minutes=window,
+                    limit=settings.TRAINING_MAX_SAMPLES,
+                    buckets=settings.TRAINING_SAMPLE_BUCKETS,
+                    by_path=settings.TRAINING_STRATIFY_BY_PATH,
+                    by_status=settings.TRAINING_STRATIFY_BY_STATUS
+                )
+            else:
+                metrics = self.db.fetch_metrics_by_service(service, minutes=window)
+            if len(metrics) >= settings.MIN_SAMPLES or idx == len(windows) - 1:
+                return metrics, window
+            logger.info(f"{service}: Only {len(metrics)} samples in {window}min, trying {windows[idx + 1] // 60}-hour backfill...")
+        return metrics, windows[-1]
+
     def train_all_services(self) -> Dict[str, Any]:
         """Train models for all services with intelligent backfill"""
         logger.info("Starting training for all services...")
-        services = db.get_all_services()
+        services = self.shard_ring.filter(self._services())
         if not services:
             logger.warning("No services found in database")
             return {
@@ -44,28 +186,22 @@ class MLService:
         backfill_used = []
 
         for service in services:
-            metrics = db.fetch_metrics_by_service(
-                service,
-                minutes=settings.TRAINING_WINDOW_MINUTES
-            )
+            # Leave a challenger in shadow alone until it is promoted or rejected
+            if self.detector.is_evaluating(service):
+                logger.info(f"Skipping {service}: challenger still in shadow evaluation")
+                continue
+            metrics, window = self._fetch_training_window(service)
             if len(metrics) < settings.MIN_SAMPLES:
-                logger.info(f"{service}: Only {len(metrics)} samples in 60min, trying 6-hour backfill...")
-                metrics = db.fetch_metrics_by_service(service, minutes=360)
-                if len(metrics) < settings.MIN_SAMPLES:
-                    logger.info(f"{service}: Only {len(metrics)} samples in 6h, trying 24-hour backfill...")
-                    metrics = db.fetch_metrics_by_service(service, minutes=1440)
-                    if len(metrics) < settings.MIN_SAMPLES:
-                        logger.info(f"Skipping {service}: only {len(metrics)} samples (need {settings.MIN_SAMPLES})")
-                        if service not in detector.get_trained_services():
-                            self.detection_mode[service] = "statistical"
-                            logger.info(f"✅ {service}: Using statistical fallback")
-                        continue
-                    else:
-                        backfill_used.append(f"{service} (24h)")
-                else:
-                    backfill_used.append(f"{service} (6h)")
-            # Train model
-            success = detector.train(service, metrics, save_model=True)
+                logger.info(f"Skipping {service}: only {len(metrics)} samples (need {settings.MIN_SAMPLES})")
+                if service not in self.detector.get_trained_services():
+                    self.detection_mode[service] = "statistical"
+                    logger.info(f"✅ {service}: Using statistical fallback")
+                continue
+            if window > settings.TRAINING_WINDOW_MINUTES:
+                backfill_used.append(f"{service} ({window // 60}h)")
+            # Train model (feature scaling from the long rollup window when available)
+            baseline = self.rollups.window_stats(service, settings.ROLLUP_BASELINE_MINUTES) if self._enabled(self.rollups) else None
+            success = self.detector.train(service, metrics, save_model=self.persist_models, baseline=baseline)
             if success:
                 trained_services.append(service)
                 total_samples += len(metrics)
@@ -78,66 +214,170 @@ class MLService:
             "services_trained": trained_services,
             "backfill_used": backfill_used,
             "total_samples": total_samples,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": self.clock().isoformat()
         }
         logger.info(f"Training complete: {result}")
         return result
 
-    def detect_anomalies(self, service: str = None) -> List[Dict[str, Any]]:
-        """Hybrid anomaly detection with ML + statistical fallback, now with root cause enrichment"""
+    def detection_targets(self, skip_streamed: bool = False) -> List[str]:
+        """Services this replica polls; ML services are left to the stream consumer with `skip_streamed`"""
+        ml_services = self.detector.get_trained_services()
+        services = set(self.shard_ring.filter(ml_services + self._services()))
+        if skip_streamed:
+            services = {
+                svc for svc in services
+                if not (self.detection_mode.get(svc) == "ml" and self.detector.is_trained(svc))
+            }
+        return sorted(services)
+
+    def _detection_batches(self, svc: str, window_seconds: Optional[float]) -> Iterator[Tuple[List[Dict[str, Any]], int]]:
+        """
+        Batches for a publishing run: pages of the rows past the service's
+        (timestamp, id) cursor, oldest first, so every row is scored however
+        fast the service writes. The first batch also re-reads the
+        SCHEDULER_OVERLAP_SECONDS behind the cursor for rows inserted late.
+        Without a cursor the run starts `window_seconds` (the time since its
+        previous run) back; a backlog over DETECTION_MAX_PAGES pages is left
+        to the next run.
+        Yields:
+            (rows, how many are past the cursor)
+        """
+        cursor = self.detect_watermarks.get(svc)
+        late = []
+        if cursor is not None:
+            since = cursor[0] - timedelta(seconds=settings.SCHEDULER_OVERLAP_SECONDS)
+            # Alerts on rows at or before `since` can no longer be read again
+            published = self.published.get(svc)
+            if published:
+                self.published[svc] = {metric_id: ts for metric_id, ts in published.items() if ts > since}
+            late = self.db.fetch_metrics_overlap(svc, since, cursor)
+        seconds = window_seconds or DETECTION_WINDOW_MINUTES * 60
+        for _ in range(DETECTION_MAX_PAGES):
+            page = self.db.fetch_metrics_after(svc, cursor, seconds)
+            if page:
+                cursor = self.detect_watermarks[svc] = (page[-1]['timestamp'], str(page[-1]['id']))
+            if page or late:
+                yield late + page, len(page)
+            late = []
+            if len(page) < DETECTION_PAGE_ROWS:
+                break
+
+    def _score_metrics(self, svc: str, metrics: List[Dict[str, Any]], publish: bool) -> List[AnomalyRecord]:
+        """Anomalies among `metrics` from the service's model, or the statistical detector without one"""
+        if self.detection_mode.get(svc, "statistical") == "ml" and self.detector.is_trained(svc):
+            # Only publishing runs update the live window state and feed the challenger's shadow evaluation
+            anomalies = self.detector.predict(svc, metrics, publish=publish)
+            logger.debug(f"{svc}: ML detection checked {len(metrics)} metrics")
+        else:
+            baseline = self.rollups.window_stats(svc, settings.ROLLUP_BASELINE_MINUTES) if self._enabled(self.rollups) else None
+            seasonal = self.seasonal.lookup(svc, [metric['timestamp'] for metric in metrics]) if self.seasonal else None
+            anomalies = self.statistical_detector.detect(metrics, baseline=baseline, seasonal=seasonal)
+            logger.debug(f"{svc}: Statistical detection checked {len(metrics)} metrics")
+        return anomalies
+
+    def detect_service(self, svc: str, publish: bool = True,
+                       window_seconds: Optional[float] = None) -> Tuple[int, List[AnomalyRecord]]:
+        """
+        Score the metrics of one service; `publish=False` scores the last
+        DETECTION_WINDOW_MINUTES without alerting (API reads), otherwise only
+        rows past the service's cursor are scored and a row is published at
+        most once.
+        Returns:
+            (rows checked, alerts raised); publishing runs count only new rows
+        """
+        if not publish:
+            metrics = self.db.fetch_metrics_by_service(svc, minutes=DETECTION_WINDOW_MINUTES)
+            if not metrics:
+                return 0, []
+            return len(metrics), self._process_anomalies(self._score_metrics(svc, metrics, publish), publish)
+        checked, alerts = 0, []
+        for metrics, fresh in self._detection_batches(svc, window_seconds):
+            checked += fresh
+            anomalies = self._score_metrics(svc, metrics, publish)
+            # Skip rows already alerted on before they reach root cause analysis and correlation
+            published = self.published.setdefault(svc, {})
+            batch = self._process_anomalies([a for a in anomalies if a.metric_id not in published])
+            for alert in batch:
+                published[alert.metric_id] = alert.timestamp
+            alerts.extend(batch)
+        return checked, alerts
+
+    def scheduled_detection(self, svc: str, window_seconds: float) -> Tuple[int, int]:
+        """
+        Scheduler entry point. `window_seconds` is the time since the service's
+        previous run; (new rows, alerts raised) drive its next interval.
+        """
+        rows, alerts = self.detect_service(svc, window_seconds=window_seconds)
+        return rows, len(alerts)
+
+    def detect_anomalies(self, service: str = None, skip_streamed: bool = False,
+                         publish: bool = True) -> List[AnomalyRecord]:
+        """
+        Hybrid anomaly detection with ML + statistical fallback, now with root cause enrichment.
+        API reads pass `publish=False`: the scheduler and stream consumer already
+        publish every alert, so a read must not publish it again.
+        """
         all_anomalies = []
         if service:
-            services_to_check = [service]
+            services_to_check = self.shard_ring.filter([service])
         else:
-            ml_services = detector.get_trained_services()
-            all_services = db.get_all_services()
-            services_to_check = list(set(ml_services + all_services))
+            services_to_check = self.detection_targets(skip_streamed)
 
         for svc in services_to_check:
-            metrics = db.fetch_metrics_by_service(svc, minutes=5)
-            if not metrics:
-                continue
-            detection_mode = self.detection_mode.get(svc, "statistical")
-            anomalies = []
-            if detection_mode == "ml" and detector.is_trained(svc):
-                anomalies = detector.predict(svc, metrics)
-                logger.debug(f"{svc}: ML detection checked {len(metrics)} metrics")
-            else:
-                anomalies = statistical_detector.detect(metrics)
-                logger.debug(f"{svc}: Statistical detection checked {len(metrics)} metrics")
-            for anomaly in anomalies:
-                anomaly['threshold'] = settings.ANOMALY_THRESHOLD
-
-                if anomaly['anomaly_score'] >= settings.ANOMALY_THRESHOLD:
-                    # ENRICH ANOMALY: fetch trace events, analyze
-                    trace_id = anomaly.get("trace_id")
-                    if trace_id:
-                        events = RootCauseAnalyzer.fetch_trace_events(trace_id)
-                        enrichment = RootCauseAnalyzer.analyze(events)
-                        anomaly.update({
-                            "root_cause": enrichment.get("root_cause"),
-                            "service_chain": enrichment.get("service_chain"),
-                            "impacted_services": enrichment.get("impacted_services"),
-                            "suggested_action": enrichment.get("suggested_action")
-                        })
-
-                    # Publish to RabbitMQ
-                    if rabbitmq_publisher.is_connected():
-                        rabbitmq_publisher.publish_anomaly_alert(anomaly)
-                    all_anomalies.append(anomaly)
+            _, alerts = self.detect_service(svc, publish)
+            all_anomalies.extend(alerts)
         if all_anomalies:
             logger.info(f"✅ Detected {len(all_anomalies)} anomalies across {len(services_to_check)} services")
         return all_anomalies
 
+    def detect_stream_batch(self, service: str, metrics: List[Dict[str, Any]]) -> List[AnomalyRecord]:
+        """Score a micro-batch delivered by the stream consumer against the loaded model"""
+        if not self.detector.is_trained(service):
+            return []
+        anomalies = self._process_anomalies(self.detector.predict(service, metrics))
+        if anomalies:
+            logger.info(f"⚡ {service}: {len(anomalies)} anomalies from stream batch of {len(metrics)}")
+        return anomalies
+
+    def _process_anomalies(self, anomalies: List[AnomalyRecord], publish: bool = True) -> List[AnomalyRecord]:
+        """
+        Apply the alert threshold, enrich with root cause and cross-service
+        incident, then publish (unless `publish` is off)
+        """
+        alerts = []
+        for anomaly in anomalies:
+            if anomaly.anomaly_score >= settings.ANOMALY_THRESHOLD:
+                anomaly.threshold = settings.ANOMALY_THRESHOLD
+                # ENRICH ANOMALY: fetch trace events, analyze
+                trace_id = anomaly.trace_id
+                if trace_id:
+                    events = RootCauseAnalyzer.fetch_trace_events(trace_id, self.db)
+                    anomaly.enrichment = RootCauseAnalyzer.analyze(events)
+                alerts.append(anomaly)
+
+        # Merge with correlated anomalies on other services; reads only look incidents up
+        if alerts and self._enabled(self.correlation):
+            self.correlation.correlate(alerts, record=publish)
+
+        # Publish to RabbitMQ
+        if publish and self.publisher and self.publisher.is_connected():
+            for alert in alerts:
+                self.publisher.publish_anomaly_alert(alert)
+        return alerts
+
     def get_service_status(self) -> Dict[str, Any]:
         """Get detailed status of all services and their detection modes"""
-        ml_services = detector.get_trained_services()
-        db_services = db.get_all_services()
-        all_services = list(set(ml_services + db_services))
+        ml_services = self.detector.get_trained_services()
+        db_services = self._services()
+        all_services = list(set(ml_services + self.shard_ring.filter(db_services)))
         status = {
             "total_services": len(all_services),
             "ml_enabled": len(ml_services),
             "statistical_fallback": len(all_services) - len(ml_services),
+            "shard": self.shard_ring.describe(list(set(ml_services + db_services))),
+            "seasonal_baselines": self.seasonal.describe() if self.seasonal else None,
+            "service_catalog": self.catalog.describe() if self.catalog is not None else None,
+            "correlation": self.correlation.describe() if self._enabled(self.correlation) else None,
             "services": []
         }
         for service in all_services:
@@ -150,8 +390,10 @@ class MLService:
                 "model_trained": service in ml_services
             }
             if service in ml_services:
-                info["last_training"] = detector.last_training.get(service)
-                info["model_version"] = detector.model_versions.get(service)
+                info["last_training"] = self.detector.last_training.get(service)
+                info["model_version"] = self.detector.model_versions.get(service)
+                if service in self.detector.challengers:
+                    info["challenger"] = self.detector.challengers[service].get_stats()
             status['services'].append(info)
         return status
 
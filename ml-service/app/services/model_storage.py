@@ -1,99 +1,462 @@
-import joblib
+import numpy as np
 import os
 import json
-from datetime import datetime
-from typing import Dict, Any, Optional
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List
 import logging
 from pathlib import Path
+from app.config.settings import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 logger = logging.getLogger(__name__)
 
 class ModelStorage:
+    """
+    Versioned model store.
+
+    Layout: <storage_dir>/<service>/metadata.json lists the saved versions and
+    the active one, next to the version artifacts (<version>_model.pkl,
+    _scaler.pkl, _endpoints.npz, _forest_*.npy). Every file is written to a temp file and
+    renamed into place, and metadata updates hold a per-service file lock, so
+    concurrent workers never see or produce a torn file. Old versions past
+    the retention policy are garbage-collected in the background.
+
+    Challengers saved for shadow evaluation carry "shadow": "pending" until
+    they are promoted ("promoted") or rejected ("rejected"). Rollback never
+    lands on a pending or rejected version, and rejected ones do not count
+    towards retention.
+    """
+
+    METADATA_FILE = "metadata.json"
+    # Unreferenced artifacts younger than this may belong to a save in progress
+    ORPHAN_GRACE_SECONDS = 600
+
     def __init__(self, storage_dir: str = "models"):
         self.storage_dir = Path(storage_dir)
-        self.storage_dir.mkdir(exist_ok=True)
-        self.metadata_file = self.storage_dir / "metadata.json"
-        self.metadata = self._load_metadata()
-    
-    def _load_metadata(self) -> Dict[str, Any]:
-        """Load model metadata"""
-        if self.metadata_file.exists():
-            with open(self.metadata_file, 'r') as f:
-                return json.load(f)
-        return {}
-    
-    def _save_metadata(self):
-        """Save model metadata"""
-        with open(self.metadata_file, 'w') as f:
-            json.dump(self.metadata, f, indent=2)
-    
-    def save_model(self, service: str, model: Any, scaler: Any, 
-                   training_samples: int, features: list) -> str:
+        self.retention_count = settings.MODEL_RETENTION_COUNT
+        self.retention_hours = settings.MODEL_RETENTION_HOURS
+        # service -> {"active": version, "versions": [meta, ...]} (oldest first)
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._opened = False
+        self._gc_thread: Optional[threading.Thread] = None
+
+    def open(self):
+        """
+        Create the store directory, migrate legacy metadata and load the index.
+        Runs once, at startup or on first use, so importing the module touches no files.
+        """
+        if self._opened:
+            return
+        with self._open_lock:
+            if self._opened:
+                return
+            self.storage_dir.mkdir(exist_ok=True)
+            self._migrate_legacy_metadata()
+            self._refresh()
+            self._opened = True
+
+    # ---- metadata ----
+
+    @property
+    def index(self) -> Dict[str, Dict[str, Any]]:
+        """service -> {"active": version, "versions": [meta, ...]} (oldest first)"""
+        self.open()
+        return self._index
+
+    @property
+    def metadata(self) -> Dict[str, Dict[str, Any]]:
+        """Active version metadata per service"""
+        return {service: self._active_meta(entry) for service, entry in self.index.items()
+                if self._active_meta(entry)}
+
+    @staticmethod
+    def _active_meta(entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        for meta in reversed(entry.get("versions", [])):
+            if meta["version"] == entry.get("active"):
+                return meta
+        return None
+
+    def _metadata_path(self, service: str) -> Path:
+        return self.storage_dir / service / self.METADATA_FILE
+
+    @staticmethod
+    def _write_atomic(path: Path, write):
+        """Write through a temp file in the same directory, then rename over the target"""
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, 'wb') as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    @contextmanager
+    def _service_lock(self, service: str):
+        """Exclusive cross-process lock on a service's metadata"""
+        service_dir = self.storage_dir / service
+        service_dir.mkdir(exist_ok=True)
+        fd = os.open(service_dir / ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _read_entry(self, service: str) -> Optional[Dict[str, Any]]:
+        path = self._metadata_path(service)
+        try:
+            mtime = path.stat().st_mtime
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._mtimes[service] = mtime
+        return entry
+
+    def _write_entry(self, service: str, entry: Dict[str, Any]):
+        """Caller holds the service lock"""
+        path = self._metadata_path(service)
+        self._write_atomic(path, lambda f: f.write(json.dumps(entry, indent=2).encode()))
+        self._mtimes[service] = path.stat().st_mtime
+        self._index[service] = entry
+
+    def refresh(self) -> bool:
+        """
+        Reload per-service metadata files rewritten by another process
+
+        Returns:
+            True if any metadata changed
+        """
+        if not self._opened:
+            self.open()
+            return True
+        return self._refresh()
+
+    def _refresh(self) -> bool:
+        changed = False
+        with self._lock:
+            for path in self.storage_dir.glob(f"*/{self.METADATA_FILE}"):
+                service = path.parent.name
+                try:
+                    mtime = path.stat().st_mtime
+                except OSError:
+                    continue
+                if mtime == self._mtimes.get(service):
+                    continue
+                entry = self._read_entry(service)
+                if entry is not None:
+                    self._index[service] = entry
+                    changed = True
+        return changed
+
+    def _migrate_legacy_metadata(self):
+        """Split the old single models/metadata.json into per-service files"""
+        legacy = self.storage_dir / self.METADATA_FILE
+        if not legacy.exists():
+            return
+        try:
+            with open(legacy, 'r') as f:
+                metadata = json.load(f)
+        except ValueError as e:
+            logger.error(f"Legacy model metadata is unreadable, skipping migration: {e}")
+            return
+        for service, meta in metadata.items():
+            with self._service_lock(service):
+                if self._metadata_path(service).exists():
+                    continue
+                self._write_entry(service, {"active": meta["version"], "versions": [meta]})
+        os.replace(legacy, legacy.with_name(f"{self.METADATA_FILE}.migrated"))
+        logger.info(f"Migrated legacy model metadata for {len(metadata)} services")
+
+    # ---- save / load ----
+
+    def save_model(self, service: str, model: Any, scaler: Any,
+                   training_samples: int, features: list,
+                   feature_pipeline: Optional[Dict[str, Any]] = None,
+                   endpoints: Optional[Dict[str, Any]] = None,
+                   forest: Optional[Any] = None,
+                   scaling: Optional[Dict[str, Any]] = None,
+                   score_scale: Optional[tuple] = None,
+                   activate: bool = True) -> str:
         """
         Save trained model and scaler to disk
-        
+
+        Args:
+            feature_pipeline: Window feature configuration the model was trained with
+            endpoints: Optional per-endpoint registry arrays, saved as one .npz
+            forest: Optional CompiledForest; its node arrays are saved as .npy
+                so workers can memory-map and share them
+            scaling: Optional scaler mean/scale lists, used with the compiled
+                forest by workers that do not load the pickles
+            score_scale: (low, high) training decision values anomaly scores are placed on
+            activate: Make it the active version right away (False for challengers)
+
         Returns:
             Model version string
         """
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        version = f"v_{timestamp}"
-        
+        import joblib
+        self.open()
+        version = f"v_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+
         # Create service directory
         service_dir = self.storage_dir / service
         service_dir.mkdir(exist_ok=True)
-        
-        # Save model and scaler
+
+        # Artifacts first; the version only becomes visible once metadata points at it
         model_path = service_dir / f"{version}_model.pkl"
         scaler_path = service_dir / f"{version}_scaler.pkl"
-        
-        joblib.dump(model, model_path)
-        joblib.dump(scaler, scaler_path)
-        
-        # Update metadata
-        self.metadata[service] = {
+        self._write_atomic(model_path, lambda f: joblib.dump(model, f))
+        self._write_atomic(scaler_path, lambda f: joblib.dump(scaler, f))
+
+        endpoints_path = None
+        if endpoints is not None:
+            endpoints_path = service_dir / f"{version}_endpoints.npz"
+            self._write_atomic(endpoints_path, lambda f: np.savez(f, **endpoints))
+
+        forest_meta = None
+        if forest is not None:
+            index_path = service_dir / f"{version}_forest_index.npy"
+            values_path = service_dir / f"{version}_forest_values.npy"
+            self._write_atomic(index_path, lambda f: np.save(f, forest.index))
+            self._write_atomic(values_path, lambda f: np.save(f, forest.values))
+            forest_meta = {**forest.header(), "index_path": str(index_path), "values_path": str(values_path)}
+
+        meta = {
             "version": version,
             "timestamp": datetime.now().isoformat(),
             "training_samples": training_samples,
             "features": features,
+            "feature_pipeline": feature_pipeline,
             "model_path": str(model_path),
-            "scaler_path": str(scaler_path)
+            "scaler_path": str(scaler_path),
+            "endpoints_path": str(endpoints_path) if endpoints_path else None,
+            "forest": forest_meta,
+            "scaling": scaling,
+            "score_scale": list(score_scale) if score_scale else None
         }
-        self._save_metadata()
-        
+        with self._lock, self._service_lock(service):
+            entry = self._read_entry(service) or {"versions": []}
+            if activate or not entry.get("active"):
+                entry["active"] = version
+            else:
+                meta["shadow"] = "pending"
+            entry["versions"].append(meta)
+            self._write_entry(service, entry)
+
         logger.info(f"Saved model for {service}: {version} ({training_samples} samples)")
+        self.collect_garbage_async()
         return version
-    
-    def load_model(self, service: str) -> Optional[tuple]:
+
+    def load_model(self, service: str, version: Optional[str] = None) -> Optional[tuple]:
         """
-        Load latest model and scaler for a service
-        
+        Load a model version (the active one by default) for a service
+
         Returns:
             (model, scaler, metadata) or None if not found
         """
-        if service not in self.metadata:
+        meta = self.get_model_info(service, version)
+        if not meta:
             logger.warning(f"No saved model found for {service}")
             return None
-        
+
+        import joblib
         try:
-            meta = self.metadata[service]
-            model = joblib.load(meta['model_path'])
-            scaler = joblib.load(meta['scaler_path'])
-            
+            # Memory-mapped arrays share page cache across worker processes
+            mmap_mode = 'r' if settings.MODEL_MMAP else None
+            model = joblib.load(meta['model_path'], mmap_mode=mmap_mode)
+            scaler = joblib.load(meta['scaler_path'], mmap_mode=mmap_mode)
+
             logger.info(f"Loaded model for {service}: {meta['version']}")
             return (model, scaler, meta)
-        
+
         except Exception as e:
             logger.error(f"Failed to load model for {service}: {e}")
             return None
-    
+
+    def load_endpoints(self, meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Load the per-endpoint registry arrays saved with a model version"""
+        if not meta.get('endpoints_path'):
+            return None
+        try:
+            with np.load(meta['endpoints_path']) as arrays:
+                return {name: arrays[name] for name in arrays.files}
+        except Exception as e:
+            logger.error(f"Failed to load endpoint models {meta['endpoints_path']}: {e}")
+            return None
+
+    def load_forest(self, meta: Dict[str, Any]) -> Optional[tuple]:
+        """
+        Load the compiled forest arrays saved with a model version
+
+        Returns:
+            (index, values, header) or None
+        """
+        forest = meta.get('forest')
+        if not forest:
+            return None
+        try:
+            mmap_mode = 'r' if settings.MODEL_MMAP else None
+            index = np.load(forest['index_path'], mmap_mode=mmap_mode)
+            values = np.load(forest['values_path'], mmap_mode=mmap_mode)
+            return index, values, forest
+        except Exception as e:
+            logger.error(f"Failed to load compiled forest for {meta['version']}: {e}")
+            return None
+
+    # ---- versions ----
+
+    def list_versions(self, service: str) -> List[Dict[str, Any]]:
+        """Saved versions of a service, newest first, with the active one flagged"""
+        entry = self.index.get(service, {})
+        return [
+            {**meta, "active": meta["version"] == entry.get("active")}
+            for meta in reversed(entry.get("versions", []))
+        ]
+
+    def _update_version(self, service: str, version: str, update) -> bool:
+        """Apply `update(entry, meta)` to a retained version under the service lock"""
+        self.open()
+        with self._lock, self._service_lock(service):
+            entry = self._read_entry(service)
+            meta = next((meta for meta in entry["versions"] if meta["version"] == version), None) if entry else None
+            if meta is None:
+                logger.warning(f"Cannot update {service} {version}: version not found")
+                return False
+            update(entry, meta)
+            self._write_entry(service, entry)
+        return True
+
+    def activate(self, service: str, version: str) -> bool:
+        """Point a service at a retained version without retraining"""
+        def update(entry, meta):
+            entry["active"] = version
+            if meta.get("shadow"):
+                meta["shadow"] = "promoted"
+        if not self._update_version(service, version, update):
+            return False
+        logger.info(f"Activated model {version} for {service}")
+        return True
+
+    def reject(self, service: str, version: str) -> bool:
+        """Mark a challenger that failed shadow evaluation; rollback skips it and retention drops it"""
+        return self._update_version(service, version, lambda entry, meta: meta.update(shadow="rejected"))
+
+    @staticmethod
+    def _servable(meta: Dict[str, Any]) -> bool:
+        """Versions that were (or may be) live: not a challenger still in, or rejected by, shadow"""
+        return meta.get("shadow") not in ("pending", "rejected")
+
+    def rollback(self, service: str) -> Optional[str]:
+        """
+        Activate the last servable version saved before the active one
+
+        Returns:
+            The version now active, or None if there is nothing to roll back to
+        """
+        entry = self.index.get(service, {})
+        versions = entry.get("versions", [])
+        position = next((idx for idx, meta in enumerate(versions) if meta["version"] == entry.get("active")), None)
+        if position is None:
+            return None
+        previous = next((meta["version"] for meta in reversed(versions[:position]) if self._servable(meta)), None)
+        return previous if previous and self.activate(service, previous) else None
+
+    # ---- retention ----
+
+    def collect_garbage_async(self):
+        """Run garbage collection on a background thread (one at a time)"""
+        if self._gc_thread and self._gc_thread.is_alive():
+            return
+        self._gc_thread = threading.Thread(target=self.collect_garbage, daemon=True, name="model-gc")
+        self._gc_thread.start()
+
+    def collect_garbage(self) -> int:
+        """
+        Drop versions past the retention policy (keep the newest
+        MODEL_RETENTION_COUNT, and with MODEL_RETENTION_HOURS only those that
+        recent) and delete unreferenced artifacts. Rejected challengers, and
+        pending ones left behind by a restart, go first and do not count
+        towards retention. The active version is always kept.
+
+        Returns:
+            Number of files deleted
+        """
+        removed = 0
+        orphan_cutoff = datetime.now().timestamp() - self.ORPHAN_GRACE_SECONDS
+        cutoff = datetime.now() - timedelta(hours=self.retention_hours) if self.retention_hours else None
+        # A pending challenger this old is no longer being evaluated by anyone
+        abandoned = datetime.now() - timedelta(minutes=2 * settings.SHADOW_MAX_MINUTES)
+        for service in list(self.index):
+            try:
+                with self._lock, self._service_lock(service):
+                    entry = self._read_entry(service)
+                    if not entry:
+                        continue
+                    versions = entry["versions"]
+                    candidates = [
+                        meta for meta in versions
+                        if meta.get("shadow") != "rejected" and not (
+                            meta.get("shadow") == "pending"
+                            and datetime.fromisoformat(meta["timestamp"]) < abandoned
+                        )
+                    ]
+                    retained = {meta["version"] for meta in candidates[-self.retention_count:]
+                                if not cutoff or datetime.fromisoformat(meta["timestamp"]) >= cutoff}
+                    keep = [meta for meta in versions
+                            if meta["version"] in retained or meta["version"] == entry["active"]]
+                    if len(keep) != len(versions):
+                        entry["versions"] = keep
+                        self._write_entry(service, entry)
+                    referenced = {
+                        Path(meta[key]).name for meta in keep
+                        for key in ("model_path", "scaler_path", "endpoints_path") if meta.get(key)
+                    }
+                    referenced |= {
+                        Path(meta["forest"][key]).name for meta in keep if meta.get("forest")
+                        for key in ("index_path", "values_path")
+                    }
+                    for path in (self.storage_dir / service).iterdir():
+                        if (path.name.startswith("v_") and path.name not in referenced
+                                and path.stat().st_mtime < orphan_cutoff):
+                            path.unlink()
+                            removed += 1
+            except Exception as e:
+                logger.error(f"Model garbage collection failed for {service}: {e}")
+        if removed:
+            logger.info(f"🧹 Removed {removed} expired model files")
+        return removed
+
     def has_model(self, service: str) -> bool:
         """Check if a model exists for a service"""
         return service in self.metadata
-    
-    def get_model_info(self, service: str) -> Optional[Dict[str, Any]]:
-        """Get model metadata without loading the model"""
-        return self.metadata.get(service)
-    
+
+    def get_model_info(self, service: str, version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Get metadata of a version (the active one by default) without loading the model"""
+        entry = self.index.get(service)
+        if not entry:
+            return None
+        if version is None:
+            return self._active_meta(entry)
+        return next((meta for meta in entry["versions"] if meta["version"] == version), None)
+
     def list_services(self) -> list:
         """List all services with saved models"""
         return list(self.metadata.keys())
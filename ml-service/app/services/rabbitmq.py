@@ -1,27 +1,53 @@
-import pika
-import json
 import logging
+import threading
 import time
 from collections import deque
-from typing import Dict, Any, Optional
+from typing import Dict, Any
+from app.models.records import AnomalyRecord
+from app.utils.serialization import dumps
 from app.config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+def alert_message(alert: AnomalyRecord) -> Dict[str, Any]:
+    """The anomaly.detected event published for an alert"""
+    metric = alert.metric
+    msg = {
+        "eventType": "anomaly.detected",
+        "timestamp": metric["timestamp"].isoformat(),
+        "traceId": metric.get("trace_id"),
+        "service": alert.service,
+        "method": metric.get("method"),
+        "path": metric.get("path"),
+        "metricId": metric["id"],
+        "anomalyScore": alert.anomaly_score,
+        "threshold": alert.threshold if alert.threshold is not None else 0.65,
+        "details": alert.details()
+    }
+    if alert.incident:
+        msg["incident"] = alert.incident
+    return msg
+
 class RabbitMQPublisher:
     def __init__(self):
         self.exchange = settings.RABBITMQ_EXCHANGE
-        self.parameters = pika.URLParameters(settings.RABBITMQ_URL)
-        self.parameters.heartbeat = 30            # keepalive
-        self.parameters.blocked_connection_timeout = 30
-        self.connection: Optional[pika.BlockingConnection] = None
-        self.channel: Optional[pika.adapters.blocking_connection.BlockingChannel] = None
+        # pika is imported and the URL parsed on first connect
+        self.parameters = None
+        self.connection = None
+        self.channel = None
         self._closing = False
         self._buffer = deque(maxlen=1000)         # buffer outgoing messages
         self._connected = False
+        # Scheduler, API and stream threads all publish through this connection
+        self._lock = threading.RLock()
 
     def connect(self):
         """Establish connection/channel; retry with backoff."""
+        import pika
+        if self.parameters is None:
+            self.parameters = pika.URLParameters(settings.RABBITMQ_URL)
+            self.parameters.heartbeat = 30            # keepalive
+            self.parameters.blocked_connection_timeout = 30
         backoff = 1
         while not self._closing:
             try:
@@ -69,45 +95,36 @@ class RabbitMQPublisher:
 
     def _basic_publish(self, routing_key: str, message: Dict[str, Any]):
         """Actual publish to exchange."""
+        import pika
         if not self.channel:
             raise RuntimeError("Channel not available")
         self.channel.basic_publish(
             exchange=self.exchange,
             routing_key=routing_key,
-            body=json.dumps(message),
+            body=dumps(message),
             properties=pika.BasicProperties(
                 delivery_mode=2,          # persistent
                 content_type="application/json"
             )
         )
 
-    def publish_anomaly_alert(self, alert: Dict[str, Any]):
+    def publish_anomaly_alert(self, alert: AnomalyRecord):
         """Public API: publish anomaly alert with reconnect & buffering."""
-        routing_key = f"anomaly.{alert['service']}"
-        msg = {
-            "eventType": "anomaly.detected",
-            "timestamp": alert["timestamp"],
-            "traceId": alert.get("trace_id"),
-            "service": alert["service"],
-            "method": alert.get("method"),
-            "path": alert.get("path"),
-            "metricId": alert["metric_id"],
-            "anomalyScore": alert["anomaly_score"],
-            "threshold": alert.get("threshold", 0.65),
-            "details": alert["details"]
-        }
-        try:
-            if not self._ensure_connection():
-                # buffer if offline
+        routing_key = f"anomaly.{alert.service}"
+        msg = alert_message(alert)
+        with self._lock:
+            try:
+                if not self._ensure_connection():
+                    # buffer if offline
+                    self._buffer.append((routing_key, msg))
+                    logger.warning("RabbitMQ offline, buffering anomaly alert")
+                    return
+                self._basic_publish(routing_key, msg)
+            except Exception as e:
+                logger.error(f"Publish failed, buffering and scheduling reconnect: {e}")
                 self._buffer.append((routing_key, msg))
-                logger.warning("RabbitMQ offline, buffering anomaly alert")
-                return
-            self._basic_publish(routing_key, msg)
-        except Exception as e:
-            logger.error(f"Publish failed, buffering and scheduling reconnect: {e}")
-            self._buffer.append((routing_key, msg))
-            self._safe_close()
-            self.connect()
+                self._safe_close()
+                self.connect()
 
     def is_connected(self) -> bool:
         return self._connected
@@ -0,0 +1,355 @@
+import csv
+import json
+import logging
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Iterator, Iterable, Tuple
+
+from app.models.anomaly_detector import AnomalyDetector
+from app.models.statistical_detector import StatisticalDetector
+from app.services.database import db, DETECTION_PAGE_ROWS
+from app.services.ml_service import MLService
+from app.services.sharding import ShardRing
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Column types of an exported metrics file (CSV values are all strings)
+_NUMERIC_COLUMNS = {
+    "response_time_ms": float,
+    "status_code": int,
+    "request_count": int,
+    "error_count": int,
+    "response_size_bytes": int
+}
+
+def _parse_timestamp(value) -> datetime:
+    """Naive UTC, like the `timestamp without time zone` column"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _cursor_key(row: Dict[str, Any]) -> Tuple[datetime, str]:
+    """Detection cursor order: (timestamp, id)"""
+    return row["timestamp"], str(row["id"])
+
+def _normalize(row: Dict[str, Any]) -> Dict[str, Any]:
+    row["timestamp"] = _parse_timestamp(row["timestamp"])
+    for column, cast in _NUMERIC_COLUMNS.items():
+        value = row.get(column)
+        row[column] = cast(value) if value not in (None, "") else 0
+    return row
+
+def read_metrics_file(path: str, chunk_size: int = 5000) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Stream an exported metrics file (.csv with a header, or JSON lines) in chunks.
+    Columns use the names Database returns (service, trace_id, response_time_ms...)
+    and rows must be in timestamp order.
+    """
+    with open(path, newline="") as handle:
+        rows: Iterable[Dict[str, Any]]
+        if path.endswith(".csv"):
+            rows = csv.DictReader(handle)
+        else:
+            rows = (json.loads(line) for line in handle if line.strip())
+        chunk = []
+        for row in rows:
+            chunk.append(_normalize(dict(row)))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def load_incidents(path: str) -> List[Dict[str, Any]]:
+    """
+    Labeled incidents from a JSON list, JSON lines or CSV file with
+    `start`, `end` and an optional `service` (empty means any service).
+    """
+    with open(path, newline="") as handle:
+        if path.endswith(".csv"):
+            entries = list(csv.DictReader(handle))
+        else:
+            text = handle.read().strip()
+            entries = json.loads(text) if text.startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [
+        {
+            "service": entry.get("service") or None,
+            "start": _parse_timestamp(entry["start"]),
+            "end": _parse_timestamp(entry["end"]),
+            "label": entry.get("label")
+        }
+        for entry in entries
+    ]
+
+class ReplayDatabase:
+    """
+    In-memory stand-in for Database during a replay.
+
+    Holds the last `history_minutes` of replayed rows per service and answers
+    the queries MLService makes, with NOW() being the simulated clock. Older
+    rows are evicted as the clock moves, so memory is bounded by the history
+    window rather than by the length of the replay.
+    """
+
+    def __init__(self, clock, history_minutes: int = 1440, seed: int = 42):
+        self.clock = clock
+        self.history = timedelta(minutes=history_minutes)
+        self.rows: Dict[str, deque] = {}
+        self.traces: Dict[str, List[Dict[str, Any]]] = {}
+        self._rng = random.Random(seed)
+
+    def append(self, row: Dict[str, Any]):
+        self.rows.setdefault(row["service"], deque()).append(row)
+        trace_id = row.get("trace_id")
+        if trace_id:
+            self.traces.setdefault(str(trace_id), []).append(row)
+
+    def evict(self):
+        cutoff = self.clock() - self.history
+        for rows in self.rows.values():
+            while rows and rows[0]["timestamp"] < cutoff:
+                row = rows.popleft()
+                trace_id = row.get("trace_id")
+                events = self.traces.get(str(trace_id)) if trace_id else None
+                if events is not None:
+                    events.remove(row)
+                    if not events:
+                        del self.traces[str(trace_id)]
+
+    def _window(self, service: str, minutes: int) -> List[Dict[str, Any]]:
+        """Rows of the last `minutes`, newest first"""
+        cutoff = self.clock() - timedelta(minutes=minutes)
+        window = []
+        for row in reversed(self.rows.get(service, ())):
+            if row["timestamp"] < cutoff:
+                break
+            window.append(row)
+        return window
+
+    def fetch_metrics_by_service(self, service: str, minutes: int = 60) -> List[Dict[str, Any]]:
+        return self._window(service, minutes)[:1000]
+
+    def _from(self, service: str, floor: datetime) -> List[Dict[str, Any]]:
+        """Rows at or after `floor`, ordered like the (timestamp, id) cursor"""
+        window = []
+        for row in reversed(self.rows.get(service, ())):
+            if row["timestamp"] < floor:
+                break
+            window.append(row)
+        return sorted(window, key=_cursor_key)
+
+    def fetch_metrics_after(self, service: str, cursor: Optional[Tuple[datetime, str]],
+                            seconds: float) -> List[Dict[str, Any]]:
+        if cursor is None:
+            return self._from(service, self.clock() - timedelta(seconds=seconds))[:DETECTION_PAGE_ROWS]
+        return [row for row in self._from(service, cursor[0]) if _cursor_key(row) > cursor][:DETECTION_PAGE_ROWS]
+
+    def fetch_metrics_overlap(self, service: str, since: datetime,
+                              cursor: Tuple[datetime, str]) -> List[Dict[str, Any]]:
+        rows = self._from(service, since + timedelta(microseconds=1))
+        return [row for row in rows if _cursor_key(row) <= cursor][:DETECTION_PAGE_ROWS]
+
+    def fetch_metrics_sampled(self, service: str, minutes: int = 60, limit: int = 1000,
+                              buckets: int = 24, by_path: bool = False,
+                              by_status: bool = False) -> List[Dict[str, Any]]:
+        """Same stratified round-robin sample as Database.fetch_metrics_sampled"""
+        bucket_seconds = max(minutes * 60 // buckets, 1)
+        strata: Dict[Tuple, List[Dict[str, Any]]] = {}
+        for row in self._window(service, minutes):
+            key = (int(row["timestamp"].replace(tzinfo=timezone.utc).timestamp() // bucket_seconds),
+                   (row.get("path") or "") if by_path else None,
+                   row["status_code"] // 100 if by_status else None)
+            strata.setdefault(key, []).append(row)
+        ranked = []
+        for rows in strata.values():
+            self._rng.shuffle(rows)
+            ranked.extend((rank, self._rng.random(), row) for rank, row in enumerate(rows))
+        ranked.sort(key=lambda item: item[:2])
+        sampled = [row for _, _, row in ranked[:limit]]
+        sampled.sort(key=lambda row: row["timestamp"], reverse=True)
+        return sampled
+
+    def get_all_services(self) -> List[str]:
+        cutoff = self.clock() - timedelta(hours=24)
+        return sorted(
+            service for service, rows in self.rows.items()
+            if rows and rows[-1]["timestamp"] >= cutoff and service != "api"
+        )
+
+    def fetch_events_by_trace_id(self, trace_id: str) -> List[Dict[str, Any]]:
+        return sorted(self.traces.get(str(trace_id), []), key=lambda row: row["timestamp"])
+
+class ReplayEngine:
+    """
+    Replays historical metrics through MLService on a simulated clock.
+
+    Rows arrive in timestamp order (a server-side cursor over `metrics`, or an
+    exported file) and the clock ticks every `detect_every_seconds` of
+    simulated time. Each tick runs what the leader would: a training pass
+    every `train_every_minutes`, then detection for every service over the
+    rows that arrived since its previous tick (plus the late-row overlap),
+    seeing only rows that had arrived by then. Nothing is persisted or
+    published, and the live singletons are untouched.
+
+    As in production, rows in the overlap are scored again but never raise a
+    second alert; precision and recall count each flagged row once.
+    """
+
+    def __init__(self, contamination: Optional[float] = None, z_threshold: float = 3.0,
+                 detect_every_seconds: Optional[float] = None,
+                 train_every_minutes: Optional[float] = None,
+                 history_minutes: int = 1440,
+                 incidents: Optional[List[Dict[str, Any]]] = None):
+        self.now: Optional[datetime] = None
+        self.detect_every = timedelta(seconds=detect_every_seconds or settings.SCHEDULER_BASE_INTERVAL_SECONDS)
+        self.train_every = timedelta(minutes=train_every_minutes or settings.TRAINING_INTERVAL_MINUTES)
+        self.incidents = incidents or []
+        self.database = ReplayDatabase(self.clock, history_minutes)
+        self.detector = AnomalyDetector(
+            contamination=settings.CONTAMINATION if contamination is None else contamination,
+            clock=self.clock
+        )
+        self.service = MLService(
+            database=self.database, publisher=None,
+            anomaly_detector=self.detector,
+            stat_detector=StatisticalDetector(z_threshold=z_threshold),
+            ring=ShardRing(), rollups=None, seasonal=None, store=None, catalog=None, correlation=None,
+            persist_models=False, clock=self.clock
+        )
+        self.rows: Dict[str, int] = {}
+        self.alerts: Dict[str, int] = {}
+        self.flagged: Dict[str, Dict[Any, datetime]] = {}
+        self.ticks = 0
+        self.trainings = 0
+        self.train_seconds = 0.0
+        self.detect_seconds = 0.0
+
+    def clock(self) -> datetime:
+        return self.now
+
+    def run(self, chunks: Iterable[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        first = last = next_tick = next_training = None
+        for chunk in chunks:
+            for row in chunk:
+                ts = row["timestamp"]
+                if first is None:
+                    first = self.now = ts
+                    next_tick = ts + self.detect_every
+                    next_training = ts + self.train_every
+                # Everything due before this row runs on the data seen so far
+                while ts >= next_tick:
+                    self.now = next_tick
+                    if next_tick >= next_training:
+                        self._train()
+                        next_training += self.train_every
+                    self._tick()
+                    next_tick += self.detect_every
+                self.now = last = ts
+                self.database.append(row)
+                self.rows[row["service"]] = self.rows.get(row["service"], 0) + 1
+        if last is not None:
+            # Final cycle over the tail
+            self.now = last + timedelta(microseconds=1)
+            self._tick()
+        return self.report(first, last, time.perf_counter() - started)
+
+    def _train(self):
+        began = time.perf_counter()
+        self.service.train_all_services()
+        self.train_seconds += time.perf_counter() - began
+        self.trainings += 1
+
+    def _tick(self):
+        self.database.evict()
+        began = time.perf_counter()
+        for service in self.service.detection_targets():
+            _, alerts = self.service.detect_service(service, window_seconds=self.detect_every.total_seconds())
+            self.alerts[service] = self.alerts.get(service, 0) + len(alerts)
+            flagged = self.flagged.setdefault(service, {})
+            for alert in alerts:
+                flagged[alert.metric_id] = _parse_timestamp(alert.timestamp)
+        self.detect_seconds += time.perf_counter() - began
+        self.ticks += 1
+
+    def _in_incident(self, service: str, ts: datetime) -> bool:
+        return any(
+            incident["start"] <= ts <= incident["end"]
+            for incident in self.incidents
+            if incident["service"] in (None, service)
+        )
+
+    def report(self, first: Optional[datetime], last: Optional[datetime], wall_seconds: float) -> Dict[str, Any]:
+        services = {}
+        for service in sorted(set(self.rows) | set(self.alerts)):
+            flagged = self.flagged.get(service, {})
+            info = {
+                "rows": self.rows.get(service, 0),
+                "alerts": self.alerts.get(service, 0),
+                "flagged_rows": len(flagged),
+                "detection_mode": self.service.detection_mode.get(service, "none")
+            }
+            if self.incidents:
+                relevant = [incident for incident in self.incidents if incident["service"] in (None, service)]
+                true_positives = sum(1 for ts in flagged.values() if self._in_incident(service, ts))
+                detected = sum(
+                    1 for incident in relevant
+                    if any(incident["start"] <= ts <= incident["end"] for ts in flagged.values())
+                )
+                info.update({
+                    "true_positives": true_positives,
+                    "precision": round(true_positives / len(flagged), 4) if flagged else None,
+                    "incidents": len(relevant),
+                    "incidents_detected": detected,
+                    "recall": round(detected / len(relevant), 4) if relevant else None
+                })
+            services[service] = info
+
+        total_rows = sum(self.rows.values())
+        simulated_seconds = (last - first).total_seconds() if first is not None else 0.0
+        report = {
+            "start": first.isoformat() if first else None,
+            "end": last.isoformat() if last else None,
+            "settings": {
+                "contamination": self.detector.contamination,
+                "anomaly_threshold": settings.ANOMALY_THRESHOLD,
+                "z_threshold": self.service.statistical_detector.z_threshold,
+                "detect_every_seconds": self.detect_every.total_seconds(),
+                "train_every_minutes": self.train_every.total_seconds() / 60,
+                "detection_overlap_seconds": settings.SCHEDULER_OVERLAP_SECONDS
+            },
+            "services": services,
+            "totals": {
+                "rows": total_rows,
+                "alerts": sum(self.alerts.values()),
+                "flagged_rows": sum(len(flagged) for flagged in self.flagged.values())
+            },
+            "throughput": {
+                "wall_seconds": round(wall_seconds, 3),
+                "simulated_seconds": round(simulated_seconds, 1),
+                "speedup": round(simulated_seconds / wall_seconds, 1) if wall_seconds else None,
+                "rows_per_second": round(total_rows / wall_seconds, 1) if wall_seconds else None,
+                "detection_cycles": self.ticks,
+                "detect_seconds": round(self.detect_seconds, 3),
+                "training_runs": self.trainings,
+                "train_seconds": round(self.train_seconds, 3)
+            }
+        }
+        if self.incidents:
+            true_positives = sum(info["true_positives"] for info in services.values())
+            flagged_rows = report["totals"]["flagged_rows"]
+            report["totals"]["precision"] = round(true_positives / flagged_rows, 4) if flagged_rows else None
+        return report
+
+def stream_from_database(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         services: Optional[List[str]] = None,
+                         chunk_size: int = 5000) -> Iterator[List[Dict[str, Any]]]:
+    """Chunks of the `metrics` table in timestamp order via a server-side cursor"""
+    if db.pool is None:
+        db.connect()
+    yield from db.stream_metrics(start, end, services, chunk_size=chunk_size)
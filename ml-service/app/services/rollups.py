@@ -0,0 +1,214 @@
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from app.services.database import db
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Detector feature -> source expression in the metrics table
+FEATURE_SOURCES = {
+    'response_time_ms': '"responseTimeMs"',
+    'status_code': '"statusCode"',
+    'error_count': '"errorCount"',
+    'response_size_bytes': 'COALESCE("responseSizeBytes", 0)'
+}
+
+# Sum and sum of squares per feature, so mean/std combine exactly over any window
+MOMENT_COLUMNS = [
+    (f"{feature}_{moment}", expr)
+    for feature, source in FEATURE_SOURCES.items()
+    for moment, expr in (
+        ("sum", f"SUM({source}::float8)"),
+        ("sumsq", f"SUM(({source}::float8) ^ 2)")
+    )
+]
+
+COUNT_COLUMNS = {"sample_count", "request_count", "status_4xx", "status_5xx"}
+
+AGGREGATE_COLUMNS = [
+    ("sample_count", "COUNT(*)"),
+    ("request_count", 'SUM("requestCount")'),
+    ("status_4xx", 'COUNT(*) FILTER (WHERE "statusCode" BETWEEN 400 AND 499)'),
+    ("status_5xx", 'COUNT(*) FILTER (WHERE "statusCode" >= 500)'),
+    *MOMENT_COLUMNS,
+    ("response_time_ms_min", 'MIN("responseTimeMs")'),
+    ("response_time_ms_max", 'MAX("responseTimeMs")'),
+    ("response_time_ms_p50", 'percentile_cont(0.5) WITHIN GROUP (ORDER BY "responseTimeMs")'),
+    ("response_time_ms_p95", 'percentile_cont(0.95) WITHIN GROUP (ORDER BY "responseTimeMs")'),
+    ("response_time_ms_p99", 'percentile_cont(0.99) WITHIN GROUP (ORDER BY "responseTimeMs")'),
+    ("response_size_bytes_max", 'MAX(COALESCE("responseSizeBytes", 0))')
+]
+
+class RollupStore:
+    """
+    Maintains per-service, per-path, per-minute aggregates of the metrics table
+    in an auxiliary table so long training and baseline windows stay cheap.
+
+    Each service has its own watermark (its latest rolled-up minute), so a
+    busy service never moves the re-aggregation window past another
+    service's late rows. Watermarks are read back from the table at startup.
+    """
+
+    TABLE = "metric_rollups_1m"
+
+    def __init__(self):
+        self.enabled = settings.ROLLUPS_ENABLED
+        self.watermarks: Dict[str, datetime] = {}
+        self.last_refresh: Optional[str] = None
+        self._schema_ready = False
+
+    @property
+    def watermark(self) -> Optional[datetime]:
+        """Latest minute rolled up for any service"""
+        return max(self.watermarks.values(), default=None)
+
+    def ensure_schema(self) -> bool:
+        """Create the rollup table if needed; disables rollups if that fails"""
+        if self._schema_ready or not self.enabled:
+            return self._schema_ready
+        columns = ",\n            ".join(
+            f"{name} {'bigint' if name in COUNT_COLUMNS else 'double precision'}"
+            for name, _ in AGGREGATE_COLUMNS
+        )
+        try:
+            db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.TABLE} (
+            service varchar(50) NOT NULL,
+            path varchar(255) NOT NULL,
+            bucket timestamp NOT NULL,
+            {columns},
+            PRIMARY KEY (service, path, bucket)
+            )
+            """, fetch=False)
+            db.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{self.TABLE}_bucket ON {self.TABLE} (bucket)",
+                fetch=False
+            )
+            rows = db.execute(
+                f"SELECT service, MAX(bucket) AS watermark FROM {self.TABLE} "
+                f"WHERE bucket >= NOW() - %s::interval GROUP BY service",
+                (f"{settings.ROLLUP_BACKFILL_MINUTES} minutes",)
+            )
+            self.watermarks = {row['service']: row['watermark'] for row in rows}
+            self._schema_ready = True
+            logger.info(f"✅ Rollup table ready (watermark: {self.watermark})")
+        except Exception as e:
+            logger.error(f"Failed to prepare rollup table, rollups disabled: {e}")
+            self.enabled = False
+        return self._schema_ready
+
+    def refresh(self, services: List[str]) -> bool:
+        """
+        Re-aggregate every minute since each service's watermark (minus a
+        lateness margin); services without one are backfilled. Rollup rows
+        are replaced rather than added to, so re-running is safe.
+        """
+        if not self.ensure_schema():
+            return False
+        names = ", ".join(name for name, _ in AGGREGATE_COLUMNS)
+        exprs = ",\n            ".join(f"{expr} AS {name}" for name, expr in AGGREGATE_COLUMNS)
+        updates = ", ".join(f"{name} = EXCLUDED.{name}" for name, _ in AGGREGATE_COLUMNS)
+        # One (service, timestamp) index range per service; returns the new watermark of each
+        query = f"""
+        WITH marks AS (
+            SELECT * FROM unnest(%(services)s::text[], %(watermarks)s::timestamp[]) AS w(service, watermark)
+        ), upserted AS (
+            INSERT INTO {self.TABLE} (service, path, bucket, {names})
+            SELECT
+                m.service,
+                COALESCE(m.path, '') AS path,
+                date_trunc('minute', m.timestamp) AS bucket,
+                {exprs}
+            FROM marks w
+            JOIN metrics m ON m.service = w.service
+            AND m.timestamp >= COALESCE(w.watermark - %(late)s::interval, NOW() - %(backfill)s::interval)
+            WHERE w.service <> 'api'
+            GROUP BY 1, 2, 3
+            ON CONFLICT (service, path, bucket) DO UPDATE SET {updates}
+            RETURNING service, bucket
+        )
+        SELECT service, MAX(bucket) AS watermark FROM upserted GROUP BY service
+        """
+        started = time.perf_counter()
+        try:
+            rows = db.execute(query, {
+                "services": services,
+                "watermarks": [self.watermarks.get(service) for service in services],
+                "late": f"{settings.ROLLUP_LATE_MINUTES} minutes",
+                "backfill": f"{settings.ROLLUP_BACKFILL_MINUTES} minutes"
+            })
+            for row in rows:
+                previous = self.watermarks.get(row['service'])
+                self.watermarks[row['service']] = max(row['watermark'], previous) if previous else row['watermark']
+            self.prune()
+            self.last_refresh = time.strftime("%Y-%m-%dT%H:%M:%S")
+            logger.debug(f"Rollups refreshed to {self.watermark} in {time.perf_counter() - started:.2f}s")
+            return True
+        except Exception as e:
+            logger.error(f"Rollup refresh failed: {e}")
+            return False
+
+    def prune(self):
+        """Drop rollups past the retention window"""
+        db.execute(
+            f"DELETE FROM {self.TABLE} WHERE bucket < NOW() - %s::interval",
+            (f"{settings.ROLLUP_RETENTION_DAYS} days",),
+            fetch=False
+        )
+
+    def sample_counts(self, service: str, windows: List[int]) -> Dict[int, int]:
+        """Number of raw samples for a service in each window (minutes), in one query"""
+        if not self.ensure_schema():
+            return {}
+        selects = ", ".join(
+            f"COALESCE(SUM(sample_count) FILTER (WHERE bucket >= NOW() - INTERVAL '{int(minutes)} minutes'), 0) AS w{int(minutes)}"
+            for minutes in windows
+        )
+        try:
+            rows = db.execute(
+                f"SELECT {selects} FROM {self.TABLE} WHERE service = %s AND bucket >= NOW() - %s::interval",
+                (service, f"{max(windows)} minutes")
+            )
+            return {minutes: int(rows[0][f"w{int(minutes)}"]) for minutes in windows}
+        except Exception as e:
+            logger.error(f"Failed to count rollup samples for {service}: {e}")
+            return {}
+
+    def window_stats(self, service: str, minutes: int) -> Optional[Dict[str, Any]]:
+        """
+        Per-feature mean and std for a service over a window, combined from rollups.
+        Returns:
+            {"count": n, "mean": {feature: value}, "std": {feature: value}} or None
+        """
+        if not self.ensure_schema():
+            return None
+        sums = ", ".join(f"SUM({name}) AS {name}" for name, _ in MOMENT_COLUMNS)
+        try:
+            rows = db.execute(
+                f"SELECT SUM(sample_count) AS n, {sums} FROM {self.TABLE} "
+                f"WHERE service = %s AND bucket >= NOW() - %s::interval",
+                (service, f"{minutes} minutes")
+            )
+        except Exception as e:
+            logger.error(f"Failed to read rollup stats for {service}: {e}")
+            return None
+        if not rows or not rows[0]['n']:
+            return None
+        return self._moments_to_stats(rows[0])
+
+    @staticmethod
+    def _moments_to_stats(row: Dict[str, Any]) -> Dict[str, Any]:
+        n = float(row['n'])
+        stats = {"count": int(n), "mean": {}, "std": {}}
+        for feature in FEATURE_SOURCES:
+            mean = float(row[f"{feature}_sum"]) / n
+            variance = max(float(row[f"{feature}_sumsq"]) / n - mean ** 2, 0.0)
+            stats["mean"][feature] = mean
+            stats["std"][feature] = math.sqrt(variance)
+        return stats
+
+# Singleton instance
+rollup_store = RollupStore()
@@ -0,0 +1,239 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+class ScheduledTask:
+    """One recurring job plus its timing metrics"""
+
+    __slots__ = ('name', 'fn', 'interval', 'adaptive', 'last_started', 'due', 'running',
+                 'runs', 'failures', 'overruns', 'missed_deadlines', 'last_lag', 'max_lag',
+                 'total_lag', 'last_duration', 'last_rows', 'last_anomalies', 'removed')
+
+    def __init__(self, name: str, fn: Callable, interval: float, adaptive: bool = False):
+        self.name = name
+        self.fn = fn
+        self.interval = float(interval)
+        self.adaptive = adaptive
+        self.last_started: Optional[float] = None
+        self.due = 0.0
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.overruns = 0
+        self.missed_deadlines = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.last_duration = 0.0
+        self.last_rows = 0
+        self.last_anomalies = 0
+        self.removed = False
+
+    def priority(self) -> int:
+        """Ties on the due time go to tasks that found anomalies last time"""
+        return -self.last_anomalies
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": round(self.interval, 1),
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "overruns": self.overruns,
+            "missed_deadlines": self.missed_deadlines,
+            "last_lag_seconds": round(self.last_lag, 3),
+            "max_lag_seconds": round(self.max_lag, 3),
+            "avg_lag_seconds": round(self.total_lag / self.runs, 3) if self.runs else 0.0,
+            "last_duration_seconds": round(self.last_duration, 3),
+            "last_rows": self.last_rows,
+            "last_anomalies": self.last_anomalies
+        }
+
+class AdaptiveScheduler:
+    """
+    Priority-queue scheduler for periodic jobs and per-service detection.
+
+    Tasks sit in a heap keyed by due time and run on a bounded thread pool.
+    A task is only re-queued once its run has finished, so cycles of the same
+    task never overlap; a run that outlasts its interval is counted as an
+    overrun instead. Every start is measured against its due time (lag), and
+    a run that ends after its next due time counts as a missed deadline.
+
+    Adaptive (per-service) tasks are passed the seconds since their previous
+    start - the span they need to read - and return (new rows, anomalies).
+    Their interval
+    shrinks to the minimum while anomalies are being found, tracks
+    SCHEDULER_TARGET_BATCH rows per cycle otherwise, and backs off towards
+    the maximum for services with no traffic.
+    """
+
+    def __init__(self, max_workers: int = 4, jitter: float = 0.1):
+        self.max_workers = max_workers
+        self.jitter = jitter
+        self.tasks: Dict[str, ScheduledTask] = {}
+        self._heap: List[Tuple[float, int, int, ScheduledTask]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _jittered(self, interval: float) -> float:
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _push(self, task: ScheduledTask):
+        """Caller holds the condition"""
+        heapq.heappush(self._heap, (task.due, task.priority(), next(self._seq), task))
+        self._cond.notify()
+
+    def add_job(self, name: str, fn: Callable, interval_seconds: float, adaptive: bool = False,
+                delay_seconds: Optional[float] = None):
+        """Register a recurring task; the first run is due after `delay_seconds` (jittered interval by default)"""
+        with self._cond:
+            if name in self.tasks:
+                return
+            task = ScheduledTask(name, fn, interval_seconds, adaptive)
+            delay = self._jittered(interval_seconds) if delay_seconds is None else delay_seconds
+            task.due = time.monotonic() + delay
+            self.tasks[name] = task
+            self._push(task)
+
+    def remove_job(self, name: str):
+        """Stop scheduling a task; a run in progress finishes normally"""
+        with self._cond:
+            task = self.tasks.pop(name, None)
+            if task:
+                task.removed = True
+
+    def sync_services(self, services: List[str], run: Callable[[str, float], Tuple[int, int]]):
+        """Add detection tasks for new services and drop those no longer listed"""
+        wanted = {f"detect:{service}": service for service in services}
+        for name in [name for name in self.tasks if name.startswith("detect:") and name not in wanted]:
+            self.remove_job(name)
+        for name, service in wanted.items():
+            if name not in self.tasks:
+                self.add_job(
+                    name, lambda span, service=service: run(service, span),
+                    settings.SCHEDULER_BASE_INTERVAL_SECONDS, adaptive=True,
+                    delay_seconds=random.uniform(0, settings.SCHEDULER_MIN_INTERVAL_SECONDS)
+                )
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scheduler")
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="scheduler")
+        self._thread.start()
+        logger.info(f"✅ Adaptive scheduler started ({self.max_workers} workers)")
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                # Wait for a free worker, then for the earliest due task
+                while not self._stop.is_set() and (self._inflight >= self.max_workers or not self._heap):
+                    self._cond.wait(timeout=1.0)
+                if self._stop.is_set():
+                    return
+                due, _, _, task = self._heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+                heapq.heappop(self._heap)
+                if task.removed:
+                    continue
+                task.running = True
+                self._inflight += 1
+            self._executor.submit(self._execute, task, due)
+
+    def _execute(self, task: ScheduledTask, due: float):
+        started = time.monotonic()
+        task.last_lag = started - due
+        task.max_lag = max(task.max_lag, task.last_lag)
+        task.total_lag += task.last_lag
+        # Time since this task's previous start: what an adaptive run has to cover
+        span = started - task.last_started if task.last_started is not None else task.interval
+        task.last_started = started
+        result = None
+        try:
+            result = task.fn(span) if task.adaptive else task.fn()
+        except Exception as e:
+            task.failures += 1
+            logger.error(f"Scheduled task {task.name} failed: {e}")
+        finished = time.monotonic()
+        task.runs += 1
+        task.last_duration = finished - started
+        if task.last_duration > task.interval:
+            task.overruns += 1
+        if finished > due + task.interval:
+            task.missed_deadlines += 1
+            logger.warning(
+                f"⏱️  {task.name} missed its deadline (lag {task.last_lag:.1f}s, took {task.last_duration:.1f}s)"
+            )
+        if task.adaptive and isinstance(result, tuple):
+            self._adapt(task, span, *result)
+
+        with self._cond:
+            task.running = False
+            self._inflight -= 1
+            if not task.removed:
+                # Next run counts from now, so a slow cycle pushes the next one back instead of stacking up
+                task.due = finished + self._jittered(task.interval)
+                self._push(task)
+            self._cond.notify()
+
+    @staticmethod
+    def _adapt(task: ScheduledTask, span: float, rows: int, anomalies: int):
+        task.last_rows = rows
+        task.last_anomalies = anomalies
+        low, high = settings.SCHEDULER_MIN_INTERVAL_SECONDS, settings.SCHEDULER_MAX_INTERVAL_SECONDS
+        if anomalies:
+            target = low
+        elif rows == 0:
+            target = task.interval * 2
+        else:
+            rate = rows / max(span, 1e-3)
+            target = settings.SCHEDULER_TARGET_BATCH / rate
+        # Tighten straight away, relax gradually
+        interval = target if target < task.interval else 0.5 * task.interval + 0.5 * target
+        task.interval = min(max(interval, low), high)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            tasks = {name: task.get_stats() for name, task in self.tasks.items()}
+            queued = len(self._heap)
+            inflight = self._inflight
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "max_workers": self.max_workers,
+            "inflight": inflight,
+            "queued": queued,
+            "max_lag_seconds": max((t["max_lag_seconds"] for t in tasks.values()), default=0.0),
+            "missed_deadlines": sum(t["missed_deadlines"] for t in tasks.values()),
+            "tasks": tasks
+        }
+
+# Singleton instance
+scheduler = AdaptiveScheduler(
+    max_workers=settings.SCHEDULER_MAX_CONCURRENCY,
+    jitter=settings.SCHEDULER_JITTER
+)
@@ -0,0 +1,237 @@
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from app.services.database import db
+from app.services.rollups import rollup_store, FEATURE_SOURCES
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+FEATURES = list(FEATURE_SOURCES)
+
+HOURS_PER_WEEK = 168
+
+# Moment slots per (service, hour-of-week, feature)
+COUNT, SUM, SUMSQ = 0, 1, 2
+
+def hour_of_week(ts) -> int:
+    """Monday 00:00 is bucket 0 (matches ISODOW - 1 in Postgres)"""
+    return ts.weekday() * 24 + ts.hour
+
+class SeasonalBaselineStore:
+    """
+    Per-service, per-feature baselines bucketed by hour of week.
+
+    Moments live in one float64 array shaped
+    (services, 168 hours, features, [count, sum, sumsq]) - about 16 KB per
+    service - so a lookup is a pair of indexes into it. The array is folded
+    forward from closed minute rollups; rows still inside the rollup lateness
+    margin are left until they can no longer change. Each service has its own
+    fold watermark, trailing its own rollup watermark, so a lagging or newly
+    backfilled service is folded once its minutes are final. Moments decay
+    with a half-life of SEASONAL_HALF_LIFE_WEEKS, so recent weeks outweigh
+    old ones.
+
+    The leader saves the array after every refresh (<dir>/moments_<n>.npy
+    plus index.json naming it); other workers memory-map the latest save, so
+    every worker scores against the same baselines.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, capacity: int = 64, directory: str = settings.SEASONAL_BASELINES_DIR):
+        self.enabled = settings.SEASONAL_BASELINES_ENABLED and settings.ROLLUPS_ENABLED
+        self.min_samples = settings.SEASONAL_MIN_SAMPLES
+        self.half_life_seconds = settings.SEASONAL_HALF_LIFE_WEEKS * 7 * 86400
+        self.directory = Path(directory)
+        self.index: Dict[str, int] = {}
+        self.moments = np.zeros((capacity, HOURS_PER_WEEK, len(FEATURES), 3))
+        # Latest rollup minute folded in, per service
+        self.watermarks: Dict[str, datetime] = {}
+        self._loaded_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def watermark(self) -> Optional[datetime]:
+        """Latest minute folded in for any service"""
+        return max(self.watermarks.values(), default=None)
+
+    def _writable(self):
+        """Copy a memory-mapped save into memory before folding into it (a follower taking over)"""
+        if isinstance(self.moments, np.memmap):
+            self.moments = np.array(self.moments)
+
+    def _row(self, service: str) -> int:
+        row = self.index.get(service)
+        if row is None:
+            row = self.index[service] = len(self.index)
+            if row >= len(self.moments):
+                grown = np.zeros((len(self.moments) * 2,) + self.moments.shape[1:])
+                grown[:len(self.moments)] = self.moments
+                self.moments = grown
+        return row
+
+    def refresh(self) -> int:
+        """
+        Fold each service's rollup minutes closed since its last fold into the
+        buckets, decaying what it already has. A service's first fold
+        backfills everything the rollup table still retains for it (weighted
+        by age); the store is saved after every fold.
+
+        Returns:
+            Number of (service, hour) groups folded in
+        """
+        if not self.enabled or not rollup_store.ensure_schema():
+            return 0
+        late = timedelta(minutes=settings.ROLLUP_LATE_MINUTES)
+        closed = {
+            service: watermark - late for service, watermark in rollup_store.watermarks.items()
+            if service not in self.watermarks or watermark - late > self.watermarks[service]
+        }
+        if not closed:
+            return 0
+        services = sorted(closed)
+        # Each row is weighted by its age at its service's `closed`, so a backfill decays like incremental folds
+        sums = ", ".join(
+            f"SUM({feature}_sum * w) AS {feature}_sum, SUM({feature}_sumsq * w) AS {feature}_sumsq"
+            for feature in FEATURES
+        )
+        try:
+            rows = db.execute(f"""
+            WITH marks AS (
+                SELECT * FROM unnest(%(services)s::text[], %(since)s::timestamp[], %(closed)s::timestamp[])
+                AS marks(service, since, closed)
+            )
+            SELECT service, hour, SUM(sample_count * w) AS n, {sums}
+            FROM (
+                SELECT r.*,
+                    ((EXTRACT(ISODOW FROM r.bucket)::int - 1) * 24 + EXTRACT(HOUR FROM r.bucket)::int) AS hour,
+                    power(0.5, EXTRACT(EPOCH FROM (marks.closed - r.bucket)) / %(half_life)s) AS w
+                FROM {rollup_store.TABLE} r
+                JOIN marks ON r.service = marks.service
+                WHERE (marks.since IS NULL OR r.bucket > marks.since)
+                AND r.bucket <= marks.closed
+            ) weighted
+            GROUP BY 1, 2
+            """, {
+                "services": services,
+                "since": [self.watermarks.get(service) for service in services],
+                "closed": [closed[service] for service in services],
+                "half_life": self.half_life_seconds
+            })
+        except Exception as e:
+            logger.error(f"Seasonal baseline refresh failed: {e}")
+            return 0
+
+        with self._lock:
+            self._writable()
+            for service in services:
+                previous = self.watermarks.get(service)
+                if previous is not None:
+                    elapsed = (closed[service] - previous).total_seconds()
+                    self.moments[self._row(service)] *= 0.5 ** (elapsed / self.half_life_seconds)
+                self.watermarks[service] = closed[service]
+            for row in rows:
+                cell = self.moments[self._row(row['service']), int(row['hour'])]
+                for idx, feature in enumerate(FEATURES):
+                    cell[idx, COUNT] += float(row['n'])
+                    cell[idx, SUM] += float(row[f"{feature}_sum"])
+                    cell[idx, SUMSQ] += float(row[f"{feature}_sumsq"])
+            self.save()
+        logger.debug(f"Seasonal baselines: folded {len(rows)} service-hours for {len(services)} services")
+        return len(rows)
+
+    def save(self):
+        """Write the moments for other workers: a fresh array file, then the index pointing at it"""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f"moments_{time.time_ns()}.npy"
+            tmp = self.directory / f".{path.name}.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, self.moments[:max(len(self.index), 1)])
+            os.replace(tmp, path)
+            index = {
+                "moments": path.name,
+                "services": sorted(self.index, key=self.index.get),
+                "watermarks": {service: watermark.isoformat() for service, watermark in self.watermarks.items()}
+            }
+            tmp = self.directory / f".{self.INDEX_FILE}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp, self.directory / self.INDEX_FILE)
+            # Readers may still map the previous file; older ones are unused
+            saves = sorted(self.directory.glob("moments_*.npy"), key=lambda p: p.stat().st_mtime)
+            for old in saves[:-2]:
+                old.unlink()
+        except Exception as e:
+            logger.error(f"Failed to save seasonal baselines: {e}")
+
+    def load(self) -> bool:
+        """
+        Memory-map the moments last saved by the leader
+
+        Returns:
+            True if a newer save was loaded
+        """
+        if not self.enabled:
+            return False
+        index_path = self.directory / self.INDEX_FILE
+        try:
+            mtime = index_path.stat().st_mtime
+            if mtime == self._loaded_mtime:
+                return False
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            moments = np.load(self.directory / index["moments"], mmap_mode='r')
+            watermarks = {service: datetime.fromisoformat(watermark)
+                          for service, watermark in index["watermarks"].items()}
+        except (OSError, ValueError, KeyError):
+            return False
+        with self._lock:
+            self.moments = moments
+            self.index = {service: row for row, service in enumerate(index["services"])}
+            self.watermarks = watermarks
+            self._loaded_mtime = mtime
+        return True
+
+    def lookup(self, service: str, timestamps: List[Any]) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Seasonal mean/std for each timestamp's hour-of-week bucket.
+
+        Returns:
+            (mean [n x features], std [n x features], valid [n]) or None if the
+            service has no history; rows whose bucket has fewer than
+            SEASONAL_MIN_SAMPLES (decayed) samples are marked invalid
+        """
+        with self._lock:
+            row = self.index.get(service)
+            moments = self.moments
+        if row is None:
+            return None
+        hours = np.fromiter((hour_of_week(ts) for ts in timestamps), dtype=np.int64, count=len(timestamps))
+        cells = moments[row, hours]
+        count = cells[:, :, COUNT]
+        valid = count[:, 0] >= self.min_samples
+        count = np.maximum(count, 1.0)
+        mean = cells[:, :, SUM] / count
+        std = np.sqrt(np.maximum(cells[:, :, SUMSQ] / count - mean ** 2, 0.0))
+        return mean, std, valid
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "services": len(self.index),
+            "watermarks": {service: watermark.isoformat() for service, watermark in sorted(self.watermarks.items())},
+            "half_life_weeks": settings.SEASONAL_HALF_LIFE_WEEKS,
+            "memory_mapped": isinstance(self.moments, np.memmap),
+            "bytes": int(self.moments.nbytes)
+        }
+
+# Singleton instance
+seasonal_baselines = SeasonalBaselineStore()
@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+from app.services.database import db
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+class ServiceCatalog:
+    """
+    In-memory set of services and the last time each one reported a metric,
+    standing in for a SELECT DISTINCT over a day of the metrics table.
+
+    The first refresh (and a periodic rescan) walks the service index with a
+    loose index scan, one probe per distinct service. In between, refreshes
+    only read rows newer than the watermark, minus a margin for late inserts.
+    Refreshes run lazily once the TTL has passed, or on the next call after
+    `invalidate()`. Services first seen on the metric stream are added
+    through `observe()` without waiting for a refresh.
+    """
+
+    def __init__(self, ttl_seconds: float = 30, horizon_hours: int = 24,
+                 late_seconds: float = 120, rescan_minutes: float = 60):
+        self.ttl_seconds = ttl_seconds
+        self.horizon = timedelta(hours=horizon_hours)
+        self.late = timedelta(seconds=late_seconds)
+        self.rescan_seconds = rescan_minutes * 60
+        self.last_seen: Dict[str, datetime] = {}
+        self.watermark: Optional[datetime] = None
+        # Database clock at the last refresh, so ages match NOW() in SQL
+        self._db_now: Optional[datetime] = None
+        self._refreshed_at: Optional[float] = None
+        self._rescanned_at: Optional[float] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"refreshes": 0, "rescans": 0, "failures": 0, "last_refresh_ms": None}
+
+    def _now(self) -> Optional[datetime]:
+        if self._db_now is None:
+            return None
+        return self._db_now + timedelta(seconds=time.monotonic() - self._refreshed_at)
+
+    def _rescan(self) -> List[Dict[str, Any]]:
+        """Loose index scan: hop from each service to the next one through the index"""
+        return db.execute("""
+        WITH RECURSIVE services AS (
+            (SELECT service FROM metrics ORDER BY service LIMIT 1)
+            UNION ALL
+            SELECT (SELECT m.service FROM metrics m WHERE m.service > s.service ORDER BY m.service LIMIT 1)
+            FROM services s
+            WHERE s.service IS NOT NULL
+        ),
+        bounds AS (
+            SELECT NOW()::timestamp AS now
+        )
+        SELECT
+            bounds.now,
+            s.service,
+            (SELECT MAX(m.timestamp) FROM metrics m
+             WHERE m.service = s.service
+             AND m.timestamp >= bounds.now - %(horizon)s::interval) AS last_seen
+        FROM bounds
+        LEFT JOIN services s ON s.service IS NOT NULL
+        """, {"horizon": f"{int(self.horizon.total_seconds())} seconds"})
+
+    def _increment(self) -> List[Dict[str, Any]]:
+        """Services with rows newer than the watermark (less the late-insert margin)"""
+        return db.execute("""
+        WITH bounds AS (
+            SELECT NOW()::timestamp AS now
+        )
+        SELECT bounds.now, recent.service, recent.last_seen
+        FROM bounds
+        LEFT JOIN (
+            SELECT service, MAX(timestamp) AS last_seen
+            FROM metrics
+            WHERE timestamp > %(since)s
+            GROUP BY service
+        ) recent ON TRUE
+        """, {"since": self.watermark - self.late})
+
+    def refresh(self) -> bool:
+        """Bring the catalog up to date; a failed refresh keeps the last known services"""
+        with self._lock:
+            started = time.monotonic()
+            rescan = (
+                self.watermark is None or self._rescanned_at is None
+                or started - self._rescanned_at >= self.rescan_seconds
+            )
+            try:
+                rows = self._rescan() if rescan else self._increment()
+            except Exception as e:
+                self.stats["failures"] += 1
+                # Retry on the next TTL rather than on every call
+                self._expires_at = started + self.ttl_seconds
+                logger.error(f"Service catalog refresh failed: {e}")
+                return False
+
+            now = rows[0]["now"]
+            seen = {row["service"]: row["last_seen"] for row in rows if row["service"] and row["last_seen"]}
+            if rescan:
+                # Also drops services that went quiet past the horizon
+                self.last_seen = seen
+                self._rescanned_at = started
+                self.stats["rescans"] += 1
+            else:
+                for service, last_seen in seen.items():
+                    if last_seen > self.last_seen.get(service, datetime.min):
+                        self.last_seen[service] = last_seen
+            cutoff = now - self.horizon
+            self.last_seen = {service: ts for service, ts in self.last_seen.items() if ts >= cutoff}
+            # Only rows read from the table move the watermark (not observe()), and
+            # never past the database clock
+            latest = max(seen.values(), default=None)
+            if rescan or self.watermark is None:
+                self.watermark = min(latest or cutoff, now)
+            elif latest is not None and latest > self.watermark:
+                self.watermark = min(latest, now)
+            self._db_now = now
+            self._refreshed_at = time.monotonic()
+            self._expires_at = self._refreshed_at + self.ttl_seconds
+            self.stats["refreshes"] += 1
+            self.stats["last_refresh_ms"] = round((self._refreshed_at - started) * 1000, 2)
+            return True
+
+    def invalidate(self):
+        """Force a refresh on the next lookup"""
+        self._expires_at = 0.0
+
+    def observe(self, service: str):
+        """Register a service seen outside the database (e.g. on the metric stream)"""
+        if service in self.last_seen:
+            return
+        now = self._now()
+        if now is None:
+            self.invalidate()
+            return
+        with self._lock:
+            self.last_seen.setdefault(service, now)
+        logger.info(f"🆕 Service catalog: discovered {service}")
+
+    def services(self) -> List[str]:
+        """Services with metrics in the last 24 hours (same set as Database.get_all_services)"""
+        if time.monotonic() >= self._expires_at:
+            self.refresh()
+        now = self._now()
+        if now is None:
+            return []
+        cutoff = now - self.horizon
+        # Filter out legacy "api"
+        return sorted(service for service, ts in list(self.last_seen.items()) if ts >= cutoff and service != "api")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "services": len(self.last_seen),
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "ttl_seconds": self.ttl_seconds,
+            **self.stats
+        }
+
+# Singleton instance
+service_catalog = ServiceCatalog(
+    ttl_seconds=settings.SERVICE_CATALOG_TTL_SECONDS,
+    late_seconds=settings.SERVICE_CATALOG_LATE_SECONDS,
+    rescan_minutes=settings.SERVICE_CATALOG_RESCAN_MINUTES
+)
@@ -0,0 +1,73 @@
+import bisect
+import hashlib
+import logging
+from typing import Dict, Any, List
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+class ShardRing:
+    """
+    Consistent-hash ring that assigns each service to exactly one replica.
+    Every replica builds the same ring from the replica count, so ownership
+    is agreed on without any coordination.
+    """
+
+    def __init__(self, replica_id: int = 0, replica_count: int = 1, virtual_nodes: int = 128):
+        if replica_count < 1:
+            raise ValueError(f"SHARD_REPLICA_COUNT must be >= 1, got {replica_count}")
+        if not 0 <= replica_id < replica_count:
+            raise ValueError(f"SHARD_REPLICA_ID must be in [0, {replica_count}), got {replica_id}")
+        self.replica_id = replica_id
+        self.replica_count = replica_count
+        self.virtual_nodes = virtual_nodes
+
+        points = sorted(
+            (self._hash(f"replica-{replica}#{vnode}"), replica)
+            for replica in range(replica_count)
+            for vnode in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [replica for _, replica in points]
+        if replica_count > 1:
+            logger.info(f"Sharding enabled: replica {replica_id} of {replica_count}")
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    @property
+    def enabled(self) -> bool:
+        return self.replica_count > 1
+
+    def owner_of(self, service: str) -> int:
+        """Replica that owns a service"""
+        if not self.enabled:
+            return self.replica_id
+        idx = bisect.bisect(self._points, self._hash(service)) % len(self._points)
+        return self._owners[idx]
+
+    def owns(self, service: str) -> bool:
+        """Check if this replica owns a service"""
+        return self.owner_of(service) == self.replica_id
+
+    def filter(self, services: List[str]) -> List[str]:
+        """Keep only the services owned by this replica"""
+        return [service for service in services if self.owns(service)]
+
+    def describe(self, services: List[str]) -> Dict[str, Any]:
+        """Shard ownership summary for the given services"""
+        return {
+            "enabled": self.enabled,
+            "replica_id": self.replica_id,
+            "replica_count": self.replica_count,
+            "owned_services": sorted(self.filter(services)),
+            "assignments": {service: self.owner_of(service) for service in sorted(services)}
+        }
+
+# Singleton instance
+shard_ring = ShardRing(
+    settings.SHARD_REPLICA_ID,
+    settings.SHARD_REPLICA_COUNT,
+    settings.SHARD_VIRTUAL_NODES
+)
@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Callable
+from app.config.settings import settings
+from app.services.sharding import shard_ring
+from app.utils.serialization import loads
+from app.services.service_catalog import service_catalog
+
+logger = logging.getLogger(__name__)
+
+BatchHandler = Callable[[str, List[Dict[str, Any]]], List[Dict[str, Any]]]
+
+class MetricStreamConsumer:
+    """
+    Consumes metric events directly from the observability exchange and hands
+    them to the detector in micro-batches, bypassing the Postgres polling loop.
+    """
+
+    def __init__(self):
+        self.exchange = settings.RABBITMQ_EXCHANGE
+        # Each replica needs its own copy of the stream to pick out its services
+        self.queue = settings.STREAM_QUEUE
+        if shard_ring.enabled:
+            self.queue = f"{settings.STREAM_QUEUE}.{shard_ring.replica_id}"
+        self.binding_key = settings.STREAM_BINDING_KEY
+        self.batch_size = settings.STREAM_BATCH_SIZE
+        self.batch_interval = settings.STREAM_BATCH_INTERVAL_MS / 1000.0
+        # pika is imported and the URL parsed on first connect
+        self.parameters = None
+        self.connection = None
+        self.channel = None
+        self._handler: Optional[BatchHandler] = None
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+        self.stats = {
+            "messages_received": 0,
+            "messages_dropped": 0,
+            "batches_scored": 0,
+            "anomalies_published": 0,
+            "last_batch_latency_ms": None,
+            "last_batch_at": None
+        }
+
+    def start(self, handler: BatchHandler):
+        """Start consuming in a background thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._handler = handler
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="metric-stream", daemon=True)
+        self._thread.start()
+        logger.info(f"✅ Metric stream consumer started ({self.queue} <- {self.binding_key})")
+
+    def stop(self):
+        """Stop consuming and close the connection."""
+        self._closing = True
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._safe_close()
+        logger.info("Metric stream consumer stopped")
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive() and not self._closing)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"running": self.is_running(), "queue": self.queue, **self.stats}
+
+    def _connect(self):
+        """Open a dedicated connection and bind our own queue to the exchange."""
+        import pika
+        if self.parameters is None:
+            self.parameters = pika.URLParameters(settings.RABBITMQ_URL)
+            self.parameters.heartbeat = 30
+            self.parameters.blocked_connection_timeout = 30
+        self.connection = pika.BlockingConnection(self.parameters)
+        self.channel = self.connection.channel()
+        self.channel.exchange_declare(exchange=self.exchange, exchange_type="topic", durable=True)
+        # Stale metrics are useless for live scoring, so the queue expires them
+        self.channel.queue_declare(
+            queue=self.queue,
+            durable=True,
+            arguments={"x-message-ttl": settings.STREAM_MESSAGE_TTL_MS}
+        )
+        self.channel.queue_bind(queue=self.queue, exchange=self.exchange, routing_key=self.binding_key)
+        self.channel.basic_qos(prefetch_count=self.batch_size * 2)
+        logger.info(f"Metric stream bound to {self.exchange} ({self.binding_key})")
+
+    def _run(self):
+        """Consume loop with reconnect and backoff."""
+        backoff = 1
+        while not self._closing:
+            try:
+                self._connect()
+                backoff = 1
+                self._consume()
+            except Exception as e:
+                if self._closing:
+                    break
+                logger.error(f"Metric stream failed: {e}. Reconnecting in {backoff}s")
+                self._safe_close()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _consume(self):
+        """Collect messages into micro-batches flushed by size or age."""
+        pending: List[tuple] = []
+        deadline = None
+        for method, _properties, body in self.channel.consume(
+            self.queue, inactivity_timeout=self.batch_interval
+        ):
+            if self._closing:
+                break
+            if method is not None:
+                self.stats["messages_received"] += 1
+                pending.append((method.delivery_tag, self._parse_message(body)))
+                if deadline is None:
+                    deadline = time.monotonic() + self.batch_interval
+            if pending and (len(pending) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(pending)
+                pending = []
+                deadline = None
+        if pending:
+            self._flush(pending)
+        self.channel.cancel()
+
+    def _flush(self, pending: List[tuple]):
+        """Score a micro-batch grouped by service, then ack it in one go."""
+        started = time.perf_counter()
+        by_service: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for _tag, metric in pending:
+            if metric is None:
+                self.stats["messages_dropped"] += 1
+                continue
+            service_catalog.observe(metric["service"])
+            if not shard_ring.owns(metric["service"]):
+                continue
+            by_service[metric["service"]].append(metric)
+
+        for service, metrics in by_service.items():
+            try:
+                anomalies = self._handler(service, metrics)
+                self.stats["anomalies_published"] += len(anomalies)
+            except Exception as e:
+                logger.error(f"Stream scoring failed for {service}: {e}")
+
+        # Scoring failures are not retried: redelivering stale metrics has no value
+        self.channel.basic_ack(delivery_tag=pending[-1][0], multiple=True)
+        self.stats["batches_scored"] += 1
+        self.stats["last_batch_latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        self.stats["last_batch_at"] = datetime.now().isoformat()
+
+    @staticmethod
+    def _parse_message(body: bytes) -> Optional[Dict[str, Any]]:
+        """Map a gateway `metric.service` event onto the metrics row shape."""
+        try:
+            message = loads(body)
+            values = message["metrics"]
+            service = message["service"]
+            if service == "api":
+                return None
+            # Alerts must reference the row MetricsConsumer stores, so the id comes from the gateway
+            metric_id = message.get("id")
+            if not metric_id:
+                raise ValueError("metric event has no id")
+            timestamp = message.get("timestamp")
+            if timestamp:
+                timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+            else:
+                timestamp = datetime.now(timezone.utc)
+            return {
+                "id": metric_id,
+                "service": service,
+                "trace_id": message.get("traceId"),
+                "method": message.get("method"),
+                "path": message.get("path"),
+                "timestamp": timestamp,
+                "response_time_ms": values["response_time_ms"],
+                "status_code": values["status_code"],
+                "request_count": values.get("request_count", 1),
+                "error_count": values.get("error_count", 0),
+                "response_size_bytes": values.get("response_size_bytes"),
+                "created_at": timestamp
+            }
+        except Exception as e:
+            logger.warning(f"Dropping malformed metric message: {e}")
+            return None
+
+    def _safe_close(self):
+        try:
+            if self.channel and self.channel.is_open:
+                self.channel.close()
+        except Exception:
+            pass
+        try:
+            if self.connection and self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+
+# Singleton
+stream_consumer = MetricStreamConsumer()
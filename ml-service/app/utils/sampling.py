@@ -0,0 +1,25 @@
+import numpy as np
+from typing import Optional
+
+def stratified_sample(strata: np.ndarray, limit: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Pick at most `limit` row indices, spread evenly across strata.
+
+    Rows are taken round-robin over strata in random order (every stratum's
+    first row, then every second row...), so a busy stretch of the window
+    cannot crowd out the quiet ones and sparse strata hand their unused share
+    to the others. Indices are returned in ascending order.
+    """
+    n = len(strata)
+    if n <= limit:
+        return np.arange(n)
+    rng = rng or np.random.default_rng()
+    _, inverse = np.unique(strata, return_inverse=True)
+
+    # Shuffle, then rank rows within their stratum in shuffled order
+    order = rng.permutation(n)
+    grouped = order[np.argsort(inverse[order], kind='stable')]
+    groups = inverse[grouped]
+    rank = np.arange(n) - np.searchsorted(groups, groups, side='left')
+    chosen = grouped[np.lexsort((rng.random(n), rank))[:limit]]
+    return np.sort(chosen)
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, Hashable, Tuple
+from starlette.concurrency import run_in_threadpool
+
+class SingleFlight:
+    """
+    Request coalescing with a short-TTL result cache, for blocking read paths
+    behind async endpoints.
+
+    Concurrent calls with the same key share one computation, run in the
+    thread pool so the event loop stays free; its result is then served to
+    later calls for `ttl_seconds`. The computation is detached from the
+    request that started it, so a client disconnecting does not fail the
+    others waiting on it. Errors are not cached.
+    Event-loop only: not for use from worker threads.
+    """
+
+    def __init__(self, ttl_seconds: float = 5.0):
+        self.ttl_seconds = ttl_seconds
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._cache: Dict[Hashable, Tuple[float, Any]] = {}
+        self.stats = {"hits": 0, "coalesced": 0, "computed": 0, "errors": 0}
+
+    async def run(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.stats["hits"] += 1
+            return cached[1]
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["computed"] += 1
+            task = asyncio.ensure_future(run_in_threadpool(fn, *args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            self.stats["errors"] += 1
+            return
+        now = time.monotonic()
+        self._cache = {k: entry for k, entry in self._cache.items() if entry[0] > now}
+        self._cache[key] = (now + self.ttl_seconds, task.result())
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"ttl_seconds": self.ttl_seconds, "inflight": len(self._inflight),
+                "cached": len(self._cache), **self.stats}
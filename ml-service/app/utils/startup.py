@@ -0,0 +1,49 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class StartupTimer:
+    """
+    Wall-clock durations of each startup phase, from the first app import to
+    the point the worker is ready to serve. Phases are recorded in order;
+    time between phases shows up in the total only.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: List[Tuple[str, float]] = []
+        self.ready_seconds: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._last = time.perf_counter()
+            self.phases.append((name, self._last - started))
+
+    def mark(self, name: str):
+        """Close a phase that began where the previous one ended (or at import)"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def ready(self):
+        self.ready_seconds = time.perf_counter() - self.started
+        logger.info(f"⏱️  Ready in {self.ready_seconds * 1000:.0f} ms")
+        for name, seconds in self.phases:
+            logger.info(f"   - {name}: {seconds * 1000:.0f} ms")
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "ready_ms": round(self.ready_seconds * 1000, 1) if self.ready_seconds is not None else None,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases}
+        }
+
+# Singleton instance, created by the first import of main
+startup_timer = StartupTimer()
@@ -0,0 +1,238 @@
+"""
+Alert-storm cost of the anomaly representation: per-anomaly nested dicts
+(previous detectors + MLService._process_anomalies + publish_anomaly_alert)
+vs AnomalyRecord, converted at the broker and API boundary.
+
+The record side runs the service code itself: the detectors' record
+construction (StatisticalDetector.records, AnomalyDetector.records),
+MLService._process_anomalies with root cause analysis and correlation
+stubbed, and the broker message from rabbitmq.alert_message.
+
+Per-anomaly CPU is the median over repeats; peak is the tracemalloc peak
+above the already-loaded metric batch while processing it, and retained is
+what the alert list still holds afterwards.
+
+Run from ml-service/:
+    python benchmarks/bench_anomaly_records.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.config.settings import settings  # noqa: E402
+from app.models.anomaly_detector import AnomalyDetector  # noqa: E402
+from app.models.statistical_detector import StatisticalDetector  # noqa: E402
+from app.services import ml_service as ml_service_module  # noqa: E402
+from app.services.ml_service import MLService  # noqa: E402
+from app.services.rabbitmq import alert_message  # noqa: E402
+from app.utils.serialization import dumps  # noqa: E402
+
+STORM = 20_000
+THRESHOLD = settings.ANOMALY_THRESHOLD
+Z_THRESHOLD = 3.0
+FEATURES = ['response_time_ms', 'status_code', 'error_count', 'response_size_bytes']
+ENRICHMENT = {
+    "root_cause": {"service": "orders", "path": "/api/orders", "status_code": 500},
+    "service_chain": ["gateway", "payment", "orders"],
+    "impacted_services": ["gateway", "payment"],
+    "suggested_action": "Check orders service logs"
+}
+INCIDENT = {"id": str(uuid.uuid4()), "origin": "orders", "services": ["orders", "payment"]}
+
+def make_batch(n: int):
+    """Metric rows as the database returns them, plus detector output for each"""
+    rng = np.random.default_rng(7)
+    start = datetime(2024, 5, 1)
+    metrics = [
+        {
+            'id': str(uuid.uuid4()), 'service': 'payment', 'trace_id': str(uuid.uuid4()),
+            'method': 'POST', 'path': '/api/payments', 'timestamp': start + timedelta(seconds=idx),
+            'response_time_ms': float(rng.gamma(2.0, 80.0)), 'status_code': 500, 'request_count': 1,
+            'error_count': 1, 'response_size_bytes': int(rng.integers(100, 5000)), 'created_at': start
+        }
+        for idx in range(n)
+    ]
+    values = rng.normal(100, 10, (n, len(FEATURES)))
+    z_scores = rng.uniform(0, 6, (n, len(FEATURES)))
+    # Every row crosses on response time, so every row is flagged
+    z_scores[:, 0] = rng.uniform(Z_THRESHOLD + 0.1, 10.0, n)
+    # Same normalised score as the statistical detector gives
+    scores = np.minimum(np.where(z_scores > Z_THRESHOLD, z_scores, 0.0).max(axis=1) / 10.0, 1.0)
+    return metrics, scores, values, z_scores
+
+# Previous representation
+
+def old_detect(metrics, scores, values, z_scores, statistical: bool):
+    anomalies = []
+    for idx, metric in enumerate(metrics):
+        anomaly = {
+            'metric_id': metric['id'],
+            'service': metric['service'],
+            'trace_id': metric.get('trace_id'),
+            'method': metric.get('method'),
+            'path': metric.get('path'),
+            'anomaly_score': float(scores[idx]),
+            'detection_method': 'statistical_zscore' if statistical else 'isolation_forest',
+            'timestamp': metric['timestamp'].isoformat(),
+            'details': {
+                'response_time_ms': metric['response_time_ms'],
+                'status_code': metric['status_code'],
+                'error_count': metric['error_count'],
+                'response_size_bytes': metric.get('response_size_bytes', 0)
+            }
+        }
+        if statistical:
+            anomaly['details']['anomaly_signals'] = [
+                {'feature': feature, 'value': float(values[idx, col]), 'z_score': float(z_scores[idx, col]),
+                 'mean': 100.0, 'std': 10.0}
+                for col, feature in enumerate(FEATURES) if z_scores[idx, col] > Z_THRESHOLD
+            ]
+            anomaly['details']['baseline'] = 'window'
+        else:
+            anomaly['model_version'] = 'v_20240501_000000_000000'
+        anomalies.append(anomaly)
+    return anomalies
+
+def old_process(anomalies):
+    alerts = []
+    for anomaly in anomalies:
+        anomaly['threshold'] = THRESHOLD
+        if anomaly['anomaly_score'] >= THRESHOLD:
+            anomaly.update({
+                "root_cause": ENRICHMENT.get("root_cause"),
+                "service_chain": ENRICHMENT.get("service_chain"),
+                "impacted_services": ENRICHMENT.get("impacted_services"),
+                "suggested_action": ENRICHMENT.get("suggested_action")
+            })
+            anomaly["incident"] = INCIDENT
+            alerts.append(anomaly)
+    return alerts
+
+def old_publish(alert) -> bytes:
+    msg = {
+        "eventType": "anomaly.detected",
+        "timestamp": alert["timestamp"],
+        "traceId": alert.get("trace_id"),
+        "service": alert["service"],
+        "method": alert.get("method"),
+        "path": alert.get("path"),
+        "metricId": alert["metric_id"],
+        "anomalyScore": alert["anomaly_score"],
+        "threshold": alert.get("threshold", 0.65),
+        "details": alert["details"]
+    }
+    if alert.get("incident"):
+        msg["incident"] = alert["incident"]
+    return dumps(msg)
+
+def old_alerts(batch, statistical: bool, api: bool):
+    alerts = old_process(old_detect(*batch, statistical))
+    if not api:
+        for alert in alerts:
+            old_publish(alert)
+    return alerts
+
+# Records, through the service code
+
+class StubRootCause:
+    """Stands in for RootCauseAnalyzer: no trace reads, a fixed analysis"""
+
+    @staticmethod
+    def fetch_trace_events(trace_id, database):
+        return []
+
+    @staticmethod
+    def analyze(events):
+        return ENRICHMENT
+
+class StubCorrelation:
+    """Every alert joins the same incident"""
+    enabled = True
+
+    def correlate(self, alerts, record: bool = True):
+        for alert in alerts:
+            alert.incident = INCIDENT
+        return alerts
+
+class StubPublisher:
+    """Encodes each broker message the way RabbitMQPublisher does, without a connection"""
+
+    def is_connected(self) -> bool:
+        return True
+
+    def publish_anomaly_alert(self, alert):
+        dumps(alert_message(alert))
+
+ml_service_module.RootCauseAnalyzer = StubRootCause
+SERVICE = MLService(database=None, publisher=StubPublisher(), ring=None, rollups=None, seasonal=None,
+                    store=None, catalog=None, correlation=StubCorrelation(), persist_models=False)
+STATISTICAL = StatisticalDetector(z_threshold=Z_THRESHOLD)
+
+def new_detect(metrics, scores, values, z_scores, statistical: bool):
+    if not statistical:
+        return AnomalyDetector.records(metrics, 'payment', np.ones(len(metrics), dtype=bool), scores,
+                                       ['isolation_forest'] * len(metrics), 'v_20240501_000000_000000')
+    return STATISTICAL.records(metrics, values, z_scores, np.full(values.shape, 100.0),
+                               np.full(values.shape, 10.0), np.full(len(metrics), 'window', dtype=object))
+
+def new_alerts(batch, statistical: bool, api: bool):
+    return SERVICE._process_anomalies(new_detect(*batch, statistical), publish=not api)
+
+PIPELINES = {
+    "dicts": (old_alerts, lambda alerts: dumps(alerts)),
+    "records": (new_alerts, lambda alerts: dumps([alert.to_dict() for alert in alerts]))
+}
+
+def storm(pipeline, batch, statistical: bool, api: bool):
+    """Detect, filter + enrich, then publish every alert (scheduler) or encode one response (API)"""
+    alerts_for, respond = PIPELINES[pipeline]
+    alerts = alerts_for(batch, statistical, api)
+    if api:
+        respond(alerts)
+    return alerts
+
+def cpu_per_anomaly(pipeline, batch, statistical, api, repeats: int = 7) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        storm(pipeline, batch, statistical, api)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings)) / STORM
+
+def memory(pipeline, batch, statistical, api):
+    """(peak while processing, retained by the alert list) in bytes"""
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    alerts = storm(pipeline, batch, statistical, api)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del alerts
+    return peak - base, current - base
+
+def main():
+    batch = make_batch(STORM)
+    alerts = sum(1 for score in batch[1] if score >= THRESHOLD)
+    print(f"storm: {STORM} flagged rows, {alerts} over the {THRESHOLD} threshold")
+    for statistical in (False, True):
+        for api in (False, True):
+            label = f"{'statistical' if statistical else 'isolation forest'} -> {'API response' if api else 'broker'}"
+            print()
+            print(label)
+            print(f"{'':>8} {'cpu/anomaly':>12} {'peak':>10} {'retained':>10}")
+            results = {}
+            for pipeline in PIPELINES:
+                cpu = cpu_per_anomaly(pipeline, batch, statistical, api)
+                peak, retained = memory(pipeline, batch, statistical, api)
+                results[pipeline] = (cpu, peak, retained)
+                print(f"{pipeline:>8} {cpu * 1e6:>9.2f} us {peak / 2**20:>7.1f} MB {retained / 2**20:>7.1f} MB")
+            old, new = results["dicts"], results["records"]
+            print(f"{'':>8} {old[0] / new[0]:>11.1f}x {old[1] / new[1]:>9.1f}x {old[2] / max(new[2], 1):>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Per-anomaly serialization cost: the previous /detect response path and
+broker message encoding vs the shared fast encoder.
+
+Run from ml-service/:
+    python benchmarks/bench_serialization.py
+"""
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.schemas.response import AnomalyDetectionResponse  # noqa: E402
+from app.utils.serialization import dumps, orjson  # noqa: E402
+
+SIZES = [100, 1_000, 10_000]
+
+def make_anomalies(n: int):
+    """Records shaped like AnomalyDetector.predict + MLService._process_anomalies output"""
+    rng = np.random.default_rng(42)
+    start = datetime(2024, 5, 1)
+    return [
+        {
+            'metric_id': str(uuid.uuid4()),
+            'service': 'payment',
+            'trace_id': str(uuid.uuid4()),
+            'method': 'POST',
+            'path': '/api/payments',
+            'anomaly_score': float(rng.random()),
+            'detection_method': 'isolation_forest',
+            'model_version': 'v_20240501_000000_000000',
+            'timestamp': (start + timedelta(seconds=idx)).isoformat(),
+            'details': {
+                'response_time_ms': float(rng.gamma(2.0, 80.0)),
+                'status_code': 500,
+                'error_count': 1,
+                'response_size_bytes': int(rng.integers(100, 5000))
+            },
+            'threshold': 0.65,
+            'root_cause': {'service': 'orders', 'path': '/api/orders', 'status_code': 500},
+            'service_chain': ['gateway', 'payment', 'orders'],
+            'impacted_services': ['gateway', 'payment'],
+            'suggested_action': 'Check orders service logs'
+        }
+        for idx in range(n)
+    ]
+
+def response_payload(anomalies):
+    return {
+        "success": True,
+        "service": "all",
+        "anomalies_detected": len(anomalies),
+        "timestamp": datetime.now().isoformat(),
+        "details": anomalies
+    }
+
+def old_response(payload) -> bytes:
+    # FastAPI: validate against response_model, jsonable_encoder, stdlib JSONResponse.render
+    model = AnomalyDetectionResponse.model_validate(payload)
+    content = jsonable_encoder(model.model_dump(mode="json"))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def new_response(payload) -> bytes:
+    return dumps(payload)
+
+def broker_message(alert):
+    return {
+        "eventType": "anomaly.detected",
+        "timestamp": alert["timestamp"],
+        "traceId": alert.get("trace_id"),
+        "service": alert["service"],
+        "method": alert.get("method"),
+        "path": alert.get("path"),
+        "metricId": alert["metric_id"],
+        "anomalyScore": alert["anomaly_score"],
+        "threshold": alert.get("threshold", 0.65),
+        "details": alert["details"]
+    }
+
+def timeit(fn, arg, min_seconds: float = 0.5) -> float:
+    """Median seconds per call over enough repeats to fill `min_seconds`"""
+    fn(arg)
+    timings = []
+    deadline = time.perf_counter() + min_seconds
+    while time.perf_counter() < deadline or len(timings) < 3:
+        started = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+def main():
+    print(f"encoder: {'orjson ' + orjson.__version__ if orjson else 'stdlib json (orjson not installed)'}")
+    print()
+    print("/detect response (per anomaly)")
+    print(f"{'anomalies':>10} {'validate+encode':>16} {'fast encoder':>14} {'speedup':>8}")
+    for size in SIZES:
+        payload = response_payload(make_anomalies(size))
+        assert json.loads(old_response(payload)) == json.loads(new_response(payload))
+        old = timeit(old_response, payload) / size
+        new = timeit(new_response, payload) / size
+        print(f"{size:>10} {old * 1e6:>13.2f} us {new * 1e6:>11.2f} us {old / new:>7.1f}x")
+
+    print()
+    print("broker messages (per anomaly)")
+    messages = [broker_message(alert) for alert in make_anomalies(1_000)]
+    old = timeit(lambda batch: [json.dumps(message) for message in batch], messages) / len(messages)
+    new = timeit(lambda batch: [dumps(message) for message in batch], messages) / len(messages)
+    print(f"{'json.dumps':>10} {old * 1e6:>8.2f} us   {'fast encoder':>12} {new * 1e6:>6.2f} us   {old / new:.1f}x")
+
+if __name__ == "__main__":
+    main()
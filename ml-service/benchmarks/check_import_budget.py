@@ -0,0 +1,80 @@
+"""
+Import-time budget for the service modules, the API routes and the app
+entry point (main). Importing them must stay cheap and side-effect free: no pandas/sklearn/psycopg2/pika/joblib until a code
+path needs them, and no connections or directories until the app lifespan.
+
+Each sample runs in a fresh interpreter; the median is checked against the
+budget. Exits 1 when over budget or when a heavy module is loaded.
+
+Run from ml-service/ (tests/test_import_budget.py runs the same check under pytest):
+    python benchmarks/check_import_budget.py [--budget-ms 1200] [--samples 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+MODULES = [
+    "app.services.ml_service",
+    "app.services.replay",
+    "app.services.scheduler",
+    "app.services.stream_consumer",
+    "app.services.leader",
+    "app.api.routes",
+    "main",
+]
+HEAVY = ["pandas", "sklearn", "scipy", "psycopg2", "pika", "joblib"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def sample(root: str, workdir: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(modules=MODULES, heavy=HEAVY)],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=1200)
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    # Run from an empty directory so relative paths (models/, feature_store/) would show up there
+    with tempfile.TemporaryDirectory() as workdir:
+        sample(root, workdir)  # warm the bytecode cache
+        results = [sample(root, workdir) for _ in range(args.samples)]
+        created = sorted(os.listdir(workdir))
+
+    median_ms = statistics.median(result["seconds"] for result in results) * 1000
+    heavy = sorted({name for result in results for name in result["heavy"]})
+    print(f"import {', '.join(MODULES)}")
+    print(f"median {median_ms:.0f} ms over {args.samples} runs (budget {args.budget_ms:.0f} ms)")
+
+    failures = []
+    if median_ms > args.budget_ms:
+        failures.append(f"over budget by {median_ms - args.budget_ms:.0f} ms")
+    if heavy:
+        failures.append(f"heavy modules loaded at import: {', '.join(heavy)}")
+    if created:
+        failures.append(f"import created files: {', '.join(created)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
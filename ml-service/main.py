@@ -1,15 +1,19 @@
+from app.utils.startup import startup_timer
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
 import logging
-import schedule
-import time
-import threading
 from app.config.settings import settings
+from app.api.responses import FastJSONResponse
 from app.api.routes import router
 from app.services.database import db
 from app.services.rabbitmq import rabbitmq_publisher
+from app.services.model_storage import model_storage
 from app.services.ml_service import ml_service
+from app.services.scheduler import scheduler
+from app.services.stream_consumer import stream_consumer
+from app.services.leader import leader_election
+from app.services.index_advisor import index_advisor
 
 # Configure logging
 logging.basicConfig(
@@ -18,100 +22,155 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(
-    title="ML Anomaly Detection Service",
-    description="Production-grade real-time anomaly detection with model persistence",
-    version="2.0.0"
-)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def start_leader_duties():
+    """Initial training, periodic scheduler and stream consumer (leader worker only)"""
+    # A follower taking over also loads the sklearn models (large batches, retraining)
+    if not ml_service.detector.load_sklearn:
+        ml_service.initialize(load_sklearn=True)
+    
+    # Check (or create) the composite index the per-service reads rely on
+    index_advisor.startup()
+    
+    # Catch rollups up before they drive training windows and baselines
+    ml_service.refresh_rollups()
+    
+    # First correlation snapshot, so the first alerts can be linked into incidents
+    ml_service.refresh_correlation()
+    
+    # Run initial training with backfill
+    logger.info("🤖 Running initial model training with intelligent backfill...")
+    result = ml_service.train_all_services()
+    
+    if result['success']:
+        logger.info(f"✅ Training complete: {result['message']}")
+        if result.get('backfill_used'):
+            logger.info(f"📊 Backfill used for: {result['backfill_used']}")
+    else:
+        logger.warning(f"⚠️  {result['message']}")
+    
+    # Schedule periodic tasks
+    scheduler.add_job("train", ml_service.train_all_services, settings.TRAINING_INTERVAL_MINUTES * 60)
+    scheduler.add_job("rollups", ml_service.refresh_rollups, 60)
+    scheduler.add_job("correlation", ml_service.refresh_correlation, settings.CORRELATION_BUCKET_SECONDS)
+    
+    # Per-service detection tasks, kept in step with the services seen in the database.
+    # With streaming on, the poll only covers statistical-fallback services
+    def discover_services():
+        scheduler.sync_services(
+            ml_service.detection_targets(skip_streamed=settings.STREAM_DETECTION_ENABLED),
+            ml_service.scheduled_detection
+        )
+    
+    discover_services()
+    scheduler.add_job("discover", discover_services, settings.SCHEDULER_DISCOVERY_SECONDS)
+    
+    # Start scheduler in background
+    scheduler.start()
+    
+    # Score metrics straight off the exchange
+    if settings.STREAM_DETECTION_ENABLED:
+        stream_consumer.start(ml_service.detect_stream_batch)
 
-app.include_router(router, prefix="/api")
+def stop_leader_duties():
+    """Stop the stream consumer and scheduler (shutdown, or a takeover that failed half way)"""
+    if settings.STREAM_DETECTION_ENABLED:
+        stream_consumer.stop()
+    scheduler.stop()
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize connections and load saved models"""
+def startup():
+    """Open connections and model storage, load saved models, start leader duties"""
     logger.info("=" * 60)
     logger.info("🚀 ML Anomaly Detection Service starting...")
     logger.info("=" * 60)
     
     try:
         # 1. Connect to database
-        db.connect()
+        with startup_timer.phase("database"):
+            db.connect()
         
         # 2. Connect to RabbitMQ
-        rabbitmq_publisher.connect()
+        with startup_timer.phase("rabbitmq"):
+            rabbitmq_publisher.connect()
         
-        # 3. Load saved models (if any)
-        ml_service.initialize()
+        # 3. Open model storage and load saved models (if any); only the leader unpickles sklearn
+        with startup_timer.phase("model_storage"):
+            model_storage.open()
+        is_leader = leader_election.try_acquire()
+        with startup_timer.phase("load_models"):
+            ml_service.initialize(load_sklearn=is_leader)
         
-        # 4. Run initial training with backfill
-        logger.info("🤖 Running initial model training with intelligent backfill...")
-        result = ml_service.train_all_services()
+        # 4. Training and scheduled detection run on the leader worker only
+        with startup_timer.phase("leader_duties"):
+            if is_leader:
+                start_leader_duties()
+            else:
+                leader_election.follow(start_leader_duties, on_tick=ml_service.sync_models,
+                                       on_failed=stop_leader_duties)
         
-        if result['success']:
-            logger.info(f"✅ Training complete: {result['message']}")
-            if result.get('backfill_used'):
-                logger.info(f"📊 Backfill used for: {result['backfill_used']}")
-        else:
-            logger.warning(f"⚠️  {result['message']}")
-        
-        # 5. Schedule periodic tasks
-        schedule.every(settings.TRAINING_INTERVAL_MINUTES).minutes.do(
-            ml_service.train_all_services
-        )
-        
-        schedule.every(1).minutes.do(
-            ml_service.detect_anomalies
-        )
-        
-        # 6. Start scheduler in background
-        def run_scheduler():
-            while True:
-                schedule.run_pending()
-                time.sleep(30)
-        
-        scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-        scheduler_thread.start()
-        logger.info("✅ Background scheduler started")
-        
-        # 7. Print status
+        # 5. Print status
         status = ml_service.get_service_status()
         logger.info("=" * 60)
         logger.info(f"📡 Port: {settings.PORT}")
         logger.info(f"🌍 Environment: {settings.ENVIRONMENT}")
+        logger.info(f"👷 Workers: {settings.WORKERS} ({'leader' if leader_election.is_leader else 'follower'})")
         logger.info(f"🔄 Training interval: {settings.TRAINING_INTERVAL_MINUTES} minutes")
         logger.info(f"📊 Contamination: {settings.CONTAMINATION}")
         logger.info(f"🎯 Anomaly threshold: {settings.ANOMALY_THRESHOLD}")
+        logger.info(f"⚡ Stream detection: {'enabled' if settings.STREAM_DETECTION_ENABLED else 'disabled'}")
         logger.info("=" * 60)
         logger.info(f"📈 Detection Status:")
         logger.info(f"   ✓ ML-enabled services: {status['ml_enabled']}")
         logger.info(f"   ✓ Statistical fallback: {status['statistical_fallback']}")
         logger.info(f"   ✓ Total services: {status['total_services']}")
         logger.info("=" * 60)
+        startup_timer.ready()
         
     except Exception as e:
         logger.error(f"❌ Startup failed: {e}")
         raise
 
-@app.on_event("shutdown")
-async def shutdown_event():
+def shutdown():
     """Cleanup connections"""
     logger.info("Shutting down ML service...")
+    stop_leader_duties()
+    leader_election.release()
     db.disconnect()
     rabbitmq_publisher.disconnect()
     logger.info("✅ Cleanup complete")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Singletons are inert until here: importing the app opens no connections or files
+    startup()
+    yield
+    shutdown()
+
+app = FastAPI(
+    title="ML Anomaly Detection Service",
+    description="Production-grade real-time anomaly detection with model persistence",
+    version="2.0.0",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
+)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+app.include_router(router, prefix="/api")
+startup_timer.mark("import")
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=settings.PORT,
-        reload=settings.ENVIRONMENT == "development"
+        workers=settings.WORKERS,
+        # uvicorn cannot combine auto-reload with multiple workers
+        reload=settings.ENVIRONMENT == "development" and settings.WORKERS == 1
     )
@@ -0,0 +1,64 @@
+"""
+Import-time budget for the service modules, the API routes and main (the
+CI counterpart of benchmarks/check_import_budget.py). Each sample imports them in a fresh
+`python -X importtime` interpreter; the median must stay under
+IMPORT_BUDGET_MS, with no heavy dependency loaded and no file created.
+"""
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from check_import_budget import HEAVY, MODULES
+
+BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", 1200))
+SAMPLES = 3
+
+# Top-level packages whose imports are timed
+ROOTS = {name.split(".")[0] for name in MODULES}
+
+PROBE = f"import {', '.join(MODULES)}; import sys; print(' '.join(m for m in {HEAVY!r} if m in sys.modules))"
+
+def importtime(workdir: Path) -> Tuple[float, List[Tuple[int, str]], List[str]]:
+    """
+    Returns:
+        (ms spent importing the budgeted modules, (self us, module) of every import, heavy modules loaded)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=workdir, env=dict(os.environ, PYTHONPATH=str(ROOT)),
+        capture_output=True, text=True, check=True
+    )
+    total_us, modules = 0, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue  # header
+        modules.append((int(own), name.strip()))
+        # Top-level entries (one leading space) cover everything they imported
+        if not name[1:].startswith(" ") and name.strip().split(".")[0] in ROOTS:
+            total_us += int(cumulative)
+    return total_us / 1000, modules, result.stdout.split()
+
+def test_service_modules_import_within_budget(tmp_path: Path):
+    importtime(tmp_path)  # warm the bytecode cache
+    samples = [importtime(tmp_path) for _ in range(SAMPLES)]
+    median_ms = statistics.median(total for total, _, _ in samples)
+    slowest: Dict[str, int] = {}
+    for own, name in samples[-1][1]:
+        slowest[name] = max(slowest.get(name, 0), own)
+    top = ", ".join(f"{name} {own / 1000:.0f} ms" for name, own in
+                    sorted(slowest.items(), key=lambda item: -item[1])[:5])
+    assert median_ms <= BUDGET_MS, f"import took {median_ms:.0f} ms (budget {BUDGET_MS:.0f} ms); slowest: {top}"
+
+def test_service_modules_import_lazily(tmp_path: Path):
+    _, _, heavy = importtime(tmp_path)
+    assert not heavy, f"heavy modules loaded at import: {', '.join(heavy)}"
+    assert not list(tmp_path.iterdir()), "importing the service modules created files"